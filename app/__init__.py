@@ -1,6 +1,6 @@
 import os
-from flask import Flask
-from app.extensions import ma, cache, limiter
+from flask import Flask, jsonify
+from app.extensions import ma, cache, limiter, blob_store, photo_variants, hot_images
 from app.models import db
 from app.blueprints.users import users_bp
 from app.blueprints.posts import posts_bp
@@ -9,6 +9,10 @@ from app.blueprints.event_posts import event_posts_bp
 from app.blueprints.photos import photos_bp
 from flask_swagger_ui import get_swaggerui_blueprint
 from flask_cors import CORS
+from app.commands import photos_cli, timeline_cli, counters_cli, search_cli, events_cli, db_cli, api_cli
+from app.util.pagination import InvalidPageRequest
+from app.util.fieldsets import InvalidFieldset
+from app.util.shared_store import configure_shared_store
 
 SWAGGER_URL = '/api/docs'
 API_URL = '/static/swagger.yaml'
@@ -19,10 +23,15 @@ def create_app(config_name):
     app = Flask(__name__)
     app.config.from_object(f"config.{config_name}")
 
+    configure_shared_store(app)
+
     db.init_app(app)
     ma.init_app(app)
     limiter.init_app(app)
     cache.init_app(app)
+    blob_store.init_app(app)
+    photo_variants.init_app(app)
+    hot_images.init_app(app)
     CORS(
         app, 
         supports_credentials=True, 
@@ -36,6 +45,27 @@ def create_app(config_name):
     app.register_blueprint(photos_bp, url_prefix='/photos')
     app.register_blueprint(swagger_blueprint, url_prefix=SWAGGER_URL)
 
+    app.cli.add_command(photos_cli)
+    app.cli.add_command(timeline_cli)
+    app.cli.add_command(counters_cli)
+    app.cli.add_command(search_cli)
+    app.cli.add_command(events_cli)
+    app.cli.add_command(db_cli)
+    app.cli.add_command(api_cli)
+
+    #bodies without a Content-Length are only caught by MAX_CONTENT_LENGTH while streaming
+    @app.errorhandler(413)
+    def request_too_large(e):
+        return jsonify({"message": "Request body too large"}), 413
+
+    @app.errorhandler(InvalidPageRequest)
+    def invalid_page_request(e):
+        return jsonify({"message": str(e)}), 400
+
+    @app.errorhandler(InvalidFieldset)
+    def invalid_fieldset(e):
+        return jsonify({"message": str(e)}), 400
+
     return app
 
 # CORS(
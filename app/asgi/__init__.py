@@ -0,0 +1,90 @@
+from contextlib import asynccontextmanager
+from fastapi import FastAPI
+from flask_sqlalchemy.query import Query
+from flask_sqlalchemy.record_queries import _listen as record_queries
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from app import create_app
+from app.models import db
+from app.asgi.routes import router, forward
+from app.asgi.offload import offload_blocking_calls
+
+#async driver per database, psycopg 3 pools its connections through SQLAlchemy
+ASYNC_DRIVERS = {"postgresql": "postgresql+psycopg", "sqlite": "sqlite+aiosqlite"}
+DEFAULT_POOL_SIZE = 20
+DEFAULT_MAX_OVERFLOW = 20
+ALL_METHODS = ["GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"]
+
+
+def async_database_uri(uri):
+    url = make_url(uri)
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"No async driver for {backend} databases, set ASYNC_DATABASE_URI")
+    return url.set(drivername=ASYNC_DRIVERS[backend])
+
+
+#listeners registered on db.session land on the class its sessionmaker made
+class AsyncBridgeSession(db.session.session_factory.class_):
+    """db.session's own session class, on the async engine.
+
+    Deriving from it keeps the db.session listeners firing for the async
+    routes too. Its get_bind() would pick the app's sync engine, here every
+    query goes to the connection run_sync() awaits.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(db, **kwargs)
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        return bind if bind is not None else self.bind
+
+
+def create_async_db(app):
+    config = app.config
+    uri = config.get("ASYNC_DATABASE_URI")
+    if not uri:
+        #the sync engine's url, Flask-SQLAlchemy has put a relative sqlite path in the instance folder
+        with app.app_context():
+            uri = async_database_uri(db.engine.url)
+    options = {}
+    if make_url(uri).get_backend_name() == "postgresql":
+        options = {
+            "pool_size": config.get("ASYNC_POOL_SIZE", DEFAULT_POOL_SIZE),
+            "max_overflow": config.get("ASYNC_MAX_OVERFLOW", DEFAULT_MAX_OVERFLOW),
+            "pool_pre_ping": True,
+        }
+    engine = create_async_engine(uri, **options)
+    if config.get("SQLALCHEMY_RECORD_QUERIES"):
+        #get_recorded_queries() and @query_budget count these like the sync engine's
+        record_queries(engine.sync_engine)
+    #the same query class db.session has, for the views' Model.query and paginate()
+    return engine, async_sessionmaker(engine, sync_session_class=AsyncBridgeSession, query_cls=Query)
+
+
+def create_asgi_app(config_name):
+    """Async server for the read heavy endpoints, `uvicorn asgi_app:app`.
+
+    The Flask app is built as usual and its views answer every request, so
+    the responses are the ones gunicorn gives. For the routes in
+    app/asgi/routes.py they run with db.session on an async engine, a slow
+    query or a slow client holds a coroutine instead of a worker thread,
+    and their cache and rate limit store calls run in the threadpool.
+    Everything else is forwarded to the Flask app in a worker thread.
+    """
+    flask_app = create_app(config_name)
+    offload_blocking_calls(flask_app)
+    engine, async_sessions = create_async_db(flask_app)
+
+    @asynccontextmanager
+    async def lifespan(api):
+        yield
+        await engine.dispose()
+
+    api = FastAPI(title="Gapp'd API", docs_url=None, redoc_url=None, openapi_url=None, lifespan=lifespan)
+    api.state.flask_app = flask_app
+    api.state.async_engine = engine
+    api.state.async_sessions = async_sessions
+    api.include_router(router)
+    api.add_api_route("/{path:path}", forward, methods=ALL_METHODS, include_in_schema=False)
+    return api
@@ -0,0 +1,85 @@
+import io
+import sys
+from starlette.concurrency import iterate_in_threadpool
+from starlette.responses import Response, StreamingResponse
+from app.models import db
+
+
+def environ_from_scope(scope, body):
+    """WSGI environ for an ASGI http request, what the Flask views read the request from."""
+    root_path = scope.get("root_path", "")
+    path = scope["path"]
+    if root_path and path.startswith(root_path):
+        path = path[len(root_path):]
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("", 0)
+
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": root_path.encode("utf8").decode("latin1"),
+        "PATH_INFO": path.encode("utf8").decode("latin1"),
+        "QUERY_STRING": scope["query_string"].decode("latin1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope['http_version']}",
+        "REMOTE_ADDR": client[0],
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    for name, value in scope["headers"]:
+        name = name.decode("latin1").upper().replace("-", "_")
+        key = name if name in ("CONTENT_TYPE", "CONTENT_LENGTH") else f"HTTP_{name}"
+        value = value.decode("latin1")
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+def dispatch(app, environ, session=None):
+    """Run the Flask view for `environ`, returns (status, headers, body, in_memory).
+
+    With `session` the request's db.session is that session instead of one
+    on the app's engine. Called from AsyncSession.run_sync() it is the sync
+    side of an async session, every query the view runs is then awaited on
+    the event loop instead of blocking it.
+    """
+    ctx = app.request_context(environ)
+    error = None
+    try:
+        ctx.push()
+        if session is not None:
+            #db.session is scoped per app context, teardown closes it like any other request's
+            db.session.registry.set(session)
+        try:
+            response = app.full_dispatch_request()
+        except Exception as e:
+            error = e
+            response = app.handle_exception(e)
+        in_memory = response.is_sequence
+        body, status, headers = response.get_wsgi_response(environ)
+        return int(status.split(" ", 1)[0]), headers, body, in_memory
+    finally:
+        ctx.pop(error)
+
+
+def _closing(body):
+    try:
+        yield from body
+    finally:
+        if hasattr(body, "close"):
+            body.close()
+
+
+def to_response(status, headers, body, in_memory):
+    """ASGI response for dispatch()'s result, files are read in the threadpool."""
+    if in_memory:
+        response = Response(b"".join(_closing(body)), status_code=status)
+    else:
+        response = StreamingResponse(iterate_in_threadpool(_closing(body)), status_code=status)
+    #Flask's headers as they are, repeated ones included
+    response.raw_headers = [(name.lower().encode("latin1"), value.encode("latin1")) for name, value in headers]
+    return response
@@ -0,0 +1,54 @@
+from functools import partial, wraps
+from anyio import to_thread
+from flask_caching.backends import NullCache, SimpleCache
+from sqlalchemy.util.concurrency import await_only, in_greenlet
+from app.extensions import limiter
+
+#backends that answer from process memory, a thread hop costs more than the call
+IN_PROCESS_CACHES = (NullCache, SimpleCache)
+
+
+def offloaded(fn):
+    """`fn` run in a worker thread when a view serve() runs calls it.
+
+    Those views run on the event loop inside AsyncSession.run_sync(), only
+    their queries are awaited. A call waiting on Redis or a file there
+    would stall every request the process serves, so it is awaited in the
+    threadpool instead, with the request's context. Anywhere else `fn` is
+    called as is.
+    """
+    @wraps(fn)
+    def call(*args, **kwargs):
+        if in_greenlet():
+            return await_only(to_thread.run_sync(partial(fn, *args, **kwargs)))
+        return fn(*args, **kwargs)
+    return call
+
+
+class OffloadedCache:
+    """Cache backend whose methods go through offloaded()."""
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def __getattr__(self, name):
+        value = getattr(self.backend, name)
+        return offloaded(value) if callable(value) else value
+
+
+def _limiter_hook(hook):
+    #the check is a bound method, the headers an after_request partial of the limiter
+    owner = getattr(hook, "__self__", None) or (hook.args[0] if isinstance(hook, partial) and hook.args else None)
+    return owner is limiter
+
+
+def offload_blocking_calls(app):
+    """Move the response cache's and the rate limiter's store calls off the event loop."""
+    caches = app.extensions.get("cache", {})
+    for extension, backend in caches.items():
+        if not isinstance(backend, IN_PROCESS_CACHES):
+            caches[extension] = OffloadedCache(backend)
+
+    if not app.config.get("RATELIMIT_STORAGE_URI", "memory://").startswith("memory://"):
+        for hooks in (app.before_request_funcs.get(None, []), app.after_request_funcs.get(None, [])):
+            hooks[:] = [offloaded(hook) if _limiter_hook(hook) else hook for hook in hooks]
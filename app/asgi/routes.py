@@ -0,0 +1,44 @@
+from anyio import to_thread
+from fastapi import APIRouter, Request
+from app.asgi.bridge import environ_from_scope, dispatch, to_response
+
+router = APIRouter()
+
+
+async def serve(request: Request):
+    """Answer with the Flask view for this URL, its queries awaited on the async engine."""
+    app = request.app.state.flask_app
+    environ = environ_from_scope(request.scope, await request.body())
+    async with request.app.state.async_sessions() as session:
+        result = await session.run_sync(lambda sync_session: dispatch(app, environ, sync_session))
+    return to_response(*result)
+
+
+async def forward(request: Request):
+    """Every other route, run as is on the Flask app's own session in a worker thread."""
+    environ = environ_from_scope(request.scope, await request.body())
+    result = await to_thread.run_sync(dispatch, request.app.state.flask_app, environ)
+    return to_response(*result)
+
+
+#the read heavy endpoints, same views and same responses as under gunicorn. Photos and
+#avatars are mostly file reads, they go through forward() with the routes not listed here
+@router.get('/posts/feed')
+async def get_feed(request: Request):
+    return await serve(request)
+
+
+@router.get('/posts/{post_id:int}')
+async def get_post(request: Request):
+    return await serve(request)
+
+
+#/users/me and /users/search match here too, Flask routes them to their own views
+@router.get('/users/{username}')
+async def read_user(request: Request):
+    return await serve(request)
+
+
+@router.get('/events/search')
+async def search_events(request: Request):
+    return await serve(request)
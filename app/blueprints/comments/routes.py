@@ -6,6 +6,13 @@ from app.blueprints.comments import comments_bp
 from app.blueprints.comments.schemas import comment_schema, comments_schema
 from marshmallow import ValidationError
 from app.util.auth import encode_token, token_required
+from app.util.counters import adjust
+from app.util.pagination import PageRequest, paginate
+from app.util.loaders import comments_query
+from app.util.query_budget import query_budget
+from app.util.response_cache import cached, tag, invalidate
+from app.util.serializers import dump, json_response
+from app.util.fieldsets import requested_fields, sparse, projection
 from werkzeug.security import generate_password_hash, check_password_hash
 
 
@@ -47,6 +54,8 @@ def create_comment(post_id):
     )
 
     db.session.add(comment)
+    adjust(Posts, post_id, comment_count=1)
+    invalidate(f"post:{post_id}", f"comments:{post_id}")
     db.session.commit()
 
     return comment_schema.jsonify(comment), 201
@@ -54,6 +63,7 @@ def create_comment(post_id):
 
 #View all comments in a post
 @comments_bp.route('/by-post/<int:post_id>', methods=['GET'])
+@query_budget(4)
 def view_comments_of_post(post_id):
     # if not db.session.get(Posts, post_id):
     #     return jsonify({"message": "Post not found"}), 400
@@ -75,29 +85,21 @@ def view_comments_of_post(post_id):
     #     "total": pagination.total,
     #     "pages": pagination.pages
     # }), 200
-    if not db.session.get(Posts, post_id):
-        return jsonify({"message": "Post not found"}), 404
-
-    try:
-        page = max(int(request.args.get("page", 1)), 1)
-    except ValueError:
-        page = 1
+    fields = requested_fields(comments_schema)
 
-    per_page = 40
-
-    qry = (select(Comments).where(Comments.post_id == post_id).order_by(Comments.created_at.asc(), Comments.id.asc())
-    )
+    def build():
+        if not db.session.get(Posts, post_id):
+            return {"message": "Post not found"}, 404
 
-    comments = db.session.scalars(qry).all()
-    total = len(comments)
+        page_request = PageRequest(per_page=40)
+        qry = comments_query(fields).options(*projection(Comments, comments_schema, fields, "user_id"))
+        qry = qry.where(Comments.post_id == post_id)
+        comments, next_cursor, total = paginate(qry, [Comments.created_at, Comments.id], page_request, descending=False)
+        tag(*{f"user:{comment.user_id}" for comment in comments})
+        return page_request.response(dump(sparse(comments_schema, fields), comments), next_cursor, total), 200
 
-    return jsonify({
-        "items": comments_schema.dump(comments),
-        "page": page,
-        "per_page": per_page,
-        "total": total,
-        "pages": 1  
-    }), 200
+    data, status = cached(build, tags=[f"comments:{post_id}"])
+    return json_response(data, status)
 
 
 #Delete comment
@@ -116,6 +118,8 @@ def delete_comment(comment_id):
     if not can_delete:
         return jsonify({"message": "Forbidden, must be owner of comment to delete"}), 403
     
+    adjust(Posts, comment.post_id, comment_count=-1)
+    invalidate(f"post:{comment.post_id}", f"comments:{comment.post_id}")
     db.session.delete(comment)
     db.session.commit()
     return jsonify({"message": f"Successfully deleted comment"}), 200
@@ -143,6 +147,7 @@ def update_comment(comment_id):
     for key, value in comment_data.items():
         setattr(comment, key, value)
 
+    invalidate(f"comments:{comment.post_id}")
     db.session.commit()
     return comment_schema.jsonify(comment), 200
 
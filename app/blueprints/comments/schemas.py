@@ -3,7 +3,8 @@ from marshmallow import fields
 from app.models import Comments
 
 class CommentSchema(ma.SQLAlchemyAutoSchema):
-    user = fields.Nested("UserSchema")
+    #slim author, loaders.comment_options() only loads these columns
+    user = fields.Nested("UserSchema", only=("id", "username", "profile_photo_id", "avatar_url"), dump_only=True)
     class Meta:
         model = Comments
         include_fk = True
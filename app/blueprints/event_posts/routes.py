@@ -1,13 +1,23 @@
-from flask import request, jsonify
+from flask import request, jsonify, current_app, Response, stream_with_context
 from sqlalchemy import select, insert, delete, or_, exists
 from sqlalchemy.orm import joinedload
 from datetime import datetime, timezone
 from app.models import db, EventPosts, Users, event_hosts, event_rsvps, HostRole, Photos, follows
-from app.extensions import limiter, cache
+from app.extensions import limiter, cache, hot_images
 from app.blueprints.event_posts import event_posts_bp
 from app.blueprints.event_posts.schemas import event_post_schema, event_posts_schema
 from marshmallow import ValidationError
-from app.util.auth import encode_token, token_required, SECRET_KEY
+from app.util.auth import encode_token, token_required, optional_user_id, SECRET_KEY
+from app.util.photos import photo_from_upload, avatar_url, schedule_photo_variants, check_upload_request, UploadRejected, release_blobs, purge_blobs
+from app.util.pagination import PageRequest, paginate, TRUTHY
+from app.util.loaders import events_query, event_options, load_event, annotate_events, annotate_event_dicts
+from app.util.counters import adjust
+from app.util.relationships import annotate_users
+from app.util.search import match, prefix_match
+from app.util.response_cache import cached, tag, invalidate
+from app.util.serializers import dump, dumps, json_response
+from app.util.fieldsets import requested_fields, wants, sparse, projection
+from app.util.locations import normalize, within_box, within_radius, location_facets, MAX_RADIUS_KM
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
 from jose import jwt as jose_jwt, exceptions as jose_exceptions
@@ -37,6 +47,11 @@ def create_event_post():
 
 #======================= used chatGPT (was running into issues with adding image) ================
     user_id = request.user_id
+    try:
+        check_upload_request()
+    except UploadRejected as e:
+        return jsonify({"message": e.message}), e.status
+
     try:
         is_multipart = bool(request.content_type and request.content_type.startswith("multipart/form-data"))
 
@@ -51,6 +66,8 @@ def create_event_post():
                 "state": (f.get("state") or "").strip(),
                 "zipcode": (f.get("zipcode") or "").strip(),
                 "country": (f.get("country") or "").strip(),
+                "latitude": (f.get("latitude") or None),
+                "longitude": (f.get("longitude") or None),
             }
             new_cover = request.files.get("cover_photo")
         else:
@@ -79,13 +96,9 @@ def create_event_post():
         except ValidationError as e:
             return jsonify({"errors": e.messages}), 400
 
+        photo = None
         if new_cover and new_cover.filename:
-            photo = Photos(
-                user_id=user_id,
-                filename=secure_filename(new_cover.filename),
-                content_type=new_cover.mimetype or "image/jpeg",
-                file_data=new_cover.read(),
-            )
+            photo = photo_from_upload(new_cover, user_id)
             db.session.add(photo)
             db.session.flush()                
             data["cover_photo_id"] = photo.id  
@@ -101,10 +114,18 @@ def create_event_post():
                 role=HostRole.owner.value  
             )
         )
+        adjust(Users, user_id, event_count=1)
+        invalidate(f"user:{user_id}", f"user-events:{user_id}")
 
         db.session.commit()
+        schedule_photo_variants(photo)
+        annotate_events([event_post], user_id)
         return event_post_schema.jsonify(event_post), 201
 
+    except UploadRejected as e:
+        db.session.rollback()
+        return jsonify({"message": e.message}), e.status
+
     except Exception as e:
         db.session.rollback()
         return jsonify({"message": "Failed to create event post"}), 500
@@ -114,58 +135,59 @@ def create_event_post():
 #View individual event post of user
 @event_posts_bp.route('/<int:event_post_id>', methods=['GET'])
 def read_event(event_post_id):
-    event = db.session.get(EventPosts, event_post_id)
-    if not event:
-        return jsonify({"message": "Event not found"}), 404
-    return event_post_schema.jsonify(event), 200
+    def build():
+        event = load_event(event_post_id)
+        if not event:
+            return {"message": "Event not found"}, 404
+        tag(*[f"user:{host.id}" for host in event.hosts])
+        return dump(event_post_schema, event), 200
+
+    data, status = cached(build, tags=[f"event:{event_post_id}"])
+    if status == 200:
+        annotate_event_dicts([data], optional_user_id())
+    return json_response(data, status)
 
 
 #view all event posts from a user
 @event_posts_bp.route('/by-username/<string:username>', methods=["GET"])
 def list_all_events_by_username(username):
-    try:
-        page = max(int(request.args.get("page", 1)), 1)
-    except ValueError:
-        page = 1
-    per_page = min(max(int(request.args.get("per_page", 12)), 1), 50)
+    fields = requested_fields(event_posts_schema)
 
-    date_range = (request.args.get("range") or "all").lower()
-    now = datetime.now(timezone.utc)
+    def build():
+        page_request = PageRequest(per_page=12)
+        user_id = db.session.execute(select(Users.id).where(Users.username == username)).scalar()
+        if user_id is not None:
+            tag(f"user-events:{user_id}")
+
+        qry = events_query(fields).options(*projection(EventPosts, event_posts_schema, fields))
+        qry = qry.join(event_hosts, EventPosts.id == event_hosts.c.event_post_id).where(event_hosts.c.user_id == user_id)
+        events, next_cursor, total = paginate(qry, [EventPosts.created_at, EventPosts.id], page_request)
+        tag(*[f"event:{event.id}" for event in events])
+        if wants(fields, "hosts"):
+            tag(*{f"user:{host.id}" for event in events for host in event.hosts})
+        return page_request.response(dump(sparse(event_posts_schema, fields), events), next_cursor, total), 200
 
-    qry = (db.session.query(EventPosts).join(event_hosts, EventPosts.id == event_hosts.c.event_post_id).join(Users, Users.id == event_hosts.c.user_id).filter(Users.username==username).order_by(EventPosts.created_at.desc()))
-    pagination = qry.paginate(page=page, per_page=per_page, error_out=False)
-    return jsonify({
-        "items": event_posts_schema.dump(pagination.items),
-        "page": pagination.page,
-        "per_page": pagination.per_page,
-        "total": pagination.total,
-        "pages": pagination.pages
-    }), 200
+    data, status = cached(build, tags=[f"username:{username}"])
+    if wants(fields, "rsvped_by_me"):
+        annotate_event_dicts(data["items"], optional_user_id())
+    return json_response(data, status)
 
 
 #Events I host
 @event_posts_bp.route('/me/hosting', methods=['GET'])
 @token_required
-def my_hosting(user_id):
+def my_hosting():
     user_id = request.user_id
 
-    try:
-        page = max(int(request.args.get("page", 1)), 1)
-    except ValueError:
-        page=1
-
-    per_page = 10
+    page_request = PageRequest(per_page=10)
+    fields = requested_fields(event_posts_schema)
 
-    qry = (db.session.query(EventPosts).join(event_hosts, EventPosts.id == event_hosts.c.event_post_id).filter(event_hosts.c.user_id == user_id).order_by(EventPosts.start_time.asc()))
-    
-    pagination = qry.paginate(page=page, per_page=per_page, error_out=False)
-    return jsonify({
-        "items": event_posts_schema.dump(pagination.items),
-        "page": pagination.page,
-        "per_page": pagination.per_page,
-        "total": pagination.total,
-        "pages": pagination.pages
-    }), 200
+    qry = events_query(fields).options(*projection(EventPosts, event_posts_schema, fields))
+    qry = qry.join(event_hosts, EventPosts.id == event_hosts.c.event_post_id).where(event_hosts.c.user_id == user_id)
+    events, next_cursor, total = paginate(qry, [EventPosts.start_time, EventPosts.id], page_request, descending=False)
+    if wants(fields, "rsvped_by_me"):
+        annotate_events(events, user_id)
+    return json_response(page_request.response(dump(sparse(event_posts_schema, fields), events), next_cursor, total))
 
 
 #View all event posts
@@ -175,34 +197,52 @@ def read_all_event_posts():
         return ("", 204)
 
 #need this since i'm not returning a user (found in @token_required)
-    owner_user_id = None
-    auth = request.headers.get("Authorization", "")
-    if auth.startswith("Bearer "):
-        token = auth.split(" ", 1)[1].strip()
-        try:
-            data = jose_jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
-            owner_user_id = int(data.get("sub"))
-        except (jose_exceptions.ExpiredSignatureError, jose_exceptions.JWTError, ValueError):
-            owner_user_id = None
-
-    event_posts = db.session.query(EventPosts).all()
-    payload = []
-    for event in event_posts:
-        data = event_post_schema.dump(event)
-        if owner_user_id and data.get("hosts"):
-            for idx, host in enumerate(data["hosts"]):
-                host_id = host.get("id")
-                if host_id:
-                    host["is_following"] = bool(db.session.execute(
-                        select(exists().where(
-                            (follows.c.follower_id == owner_user_id) &
-                            (follows.c.followed_id == host_id)
-                        ))
-                    ).scalar())
-                    data["hosts"][idx] = host
-        payload.append(data)
-
-    return jsonify(payload), 200
+    owner_user_id = optional_user_id()
+
+    range = (request.args.get("range") or "all").lower()
+    now = datetime.now(timezone.utc)
+    fields = requested_fields(event_posts_schema)
+
+    qry = events_query(fields).options(*projection(EventPosts, event_posts_schema, fields))
+    descending = False
+    if range == "upcoming":
+        qry = qry.where(EventPosts.start_time >= now)
+    elif range == "past":
+        qry = qry.where(EventPosts.start_time < now)
+        descending = True
+
+    if request.args.get("format") == "ndjson" or request.accept_mimetypes.best == "application/x-ndjson":
+        return stream_events(qry, descending, owner_user_id, fields)
+
+    page_request = PageRequest(per_page=20)
+    events, next_cursor, total = paginate(qry, [EventPosts.start_time, EventPosts.id], page_request, descending=descending)
+    if wants(fields, "rsvped_by_me"):
+        annotate_events(events, owner_user_id)
+    items = dump(sparse(event_posts_schema, fields), events)
+    annotate_users([host for data in items for host in data.get("hosts") or []], owner_user_id)
+
+    return json_response(page_request.response(items, next_cursor, total))
+
+
+def stream_events(qry, descending, viewer_id, fields=None, batch_size=200):
+    """Every event matching `qry` as one JSON object per line.
+
+    Rows are fetched and serialized `batch_size` at a time with yield_per, so
+    memory stays flat however many events match.
+    """
+    order = (EventPosts.start_time.desc(), EventPosts.id.desc()) if descending else (EventPosts.start_time.asc(), EventPosts.id.asc())
+    qry = qry.order_by(*order).execution_options(yield_per=batch_size)
+
+    @stream_with_context
+    def generate():
+        for batch in db.session.execute(qry).scalars().partitions():
+            if wants(fields, "rsvped_by_me"):
+                annotate_events(batch, viewer_id)
+            items = dump(sparse(event_posts_schema, fields), batch)
+            annotate_users([host for data in items for host in data.get("hosts") or []], viewer_id)
+            yield b"".join(dumps(data) + b"\n" for data in items)
+
+    return Response(generate(), mimetype="application/x-ndjson")
 
 
 #Delete event post
@@ -220,6 +260,11 @@ def delete_event_post(event_post_id):
     if role != HostRole.owner:
         return jsonify({"message": "Must be owner to delete this event"}), 403
 
+    host_ids = db.session.execute(select(event_hosts.c.user_id).where(event_hosts.c.event_post_id == event_post_id)).scalars().all()
+    for host_id in host_ids:
+        adjust(Users, host_id, event_count=-1)
+        invalidate(f"user:{host_id}", f"user-events:{host_id}")
+    invalidate(f"event:{event_post_id}")
     db.session.delete(event_post)
     db.session.commit()
     return jsonify({"message": f"Successfully deleted event post"}), 200
@@ -246,14 +291,16 @@ def update_event_post(event_post_id):
     for key, value in event_post_data.items():
         setattr(event_post, key, value)
 
+    invalidate(f"event:{event_post_id}")
     db.session.commit()
+    annotate_events([event_post], user_id)
     return event_post_schema.jsonify(event_post), 200
 
 
 #Add cohost
 @event_posts_bp.route('/<int:event_post_id>/hosts/<int:target_id>', methods=['POST'])
 @token_required
-def add_cohost(user_id, target_id, event_post_id):
+def add_cohost(event_post_id, target_id):
     owner_id = request.user_id
 
     role_row = db.session.execute(select(event_hosts.c.role).where(event_hosts.c.event_post_id == event_post_id, event_hosts.c.user_id == owner_id)).first()
@@ -268,6 +315,8 @@ def add_cohost(user_id, target_id, event_post_id):
         return jsonify({"message": "User is already a host"}), 200
     
     db.session.execute(insert(event_hosts).values(user_id=target_id, event_post_id=event_post_id, role=HostRole.cohost.value))
+    adjust(Users, target_id, event_count=1)
+    invalidate(f"event:{event_post_id}", f"user:{target_id}", f"user-events:{target_id}")
     db.session.commit()
     return jsonify({"message": "Successfully added cohost"}), 201
 
@@ -275,7 +324,7 @@ def add_cohost(user_id, target_id, event_post_id):
 #Remove cohost
 @event_posts_bp.route('/<int:event_post_id>/hosts/<int:target_id>', methods=['DELETE'])
 @token_required
-def remove_cohost(user_id, target_id, event_post_id):
+def remove_cohost(event_post_id, target_id):
     owner_id = request.user_id
 
     role_row = db.session.execute(select(event_hosts.c.role).where(event_hosts.c.event_post_id == event_post_id, event_hosts.c.user_id == owner_id)).first()
@@ -285,7 +334,10 @@ def remove_cohost(user_id, target_id, event_post_id):
     if target_id == owner_id:
         return jsonify({"message": "Owner cannot remove themselves"}), 400
     
-    db.session.execute(delete(event_hosts).values(user_id=target_id, event_post_id=event_post_id, role=HostRole.cohost.value))
+    removed = db.session.execute(delete(event_hosts).where(event_hosts.c.user_id == target_id, event_hosts.c.event_post_id == event_post_id))
+    if removed.rowcount:
+        adjust(Users, target_id, event_count=-1)
+        invalidate(f"event:{event_post_id}", f"user:{target_id}", f"user-events:{target_id}")
     db.session.commit()
     return jsonify({"message": "Successfully removed cohost"}), 201
 
@@ -305,6 +357,8 @@ def rsvp_event(event_post_id):
         return jsonify({"message": "Already RSVP'd to event"}), 200
     
     db.session.execute(insert(event_rsvps).values(user_id=user_id, event_post_id=event_post_id))
+    adjust(EventPosts, event_post_id, attendee_count=1)
+    invalidate(f"event:{event_post_id}")
     db.session.commit()
     return jsonify({"message": "Successfully RSVP'd to event"}), 201
 
@@ -320,7 +374,10 @@ def unrsvp_event(event_post_id):
         return jsonify({"message": "Event not found"}), 404
 
     
-    db.session.execute(delete(event_rsvps).where(event_rsvps.c.user_id == user_id, event_rsvps.c.event_post_id == event_post_id))
+    removed = db.session.execute(delete(event_rsvps).where(event_rsvps.c.user_id == user_id, event_rsvps.c.event_post_id == event_post_id))
+    if removed.rowcount:
+        adjust(EventPosts, event_post_id, attendee_count=-1)
+        invalidate(f"event:{event_post_id}")
     db.session.commit()
     return jsonify({"message": "Successfully removed RSVP"}), 201
 
@@ -331,31 +388,21 @@ def list_attendees(event_post_id):
     if not db.session.get(EventPosts, event_post_id):
         return jsonify({"message": "Event not found"}), 404
     
-    try:
-        page = max(int(request.args.get("page", 1)), 1)
-    except ValueError:
-        page=1
-
-    per_page = 40
+    page_request = PageRequest(per_page=40)
 
-    qry = (db.session.query(Users.id, Users.username, Users.profile_picture).join(event_rsvps.c.Users.id == event_rsvps.c.user_id).filter(event_rsvps.c.event_post_id == event_post_id).order_by(event_rsvps.c.created_at.desc(), Users.id.desc()))
-    pagination = qry.paginate(page=page, per_page=per_page, error_out=False)
+    qry = select(Users.id, Users.username, Users.profile_photo_id).join(event_rsvps, Users.id == event_rsvps.c.user_id).where(event_rsvps.c.event_post_id == event_post_id)
+    attendees, next_cursor, total = paginate(qry, [event_rsvps.c.created_at, event_rsvps.c.user_id], page_request)
 
     items =[]
-    for user in pagination.items:
+    for user_id, username, profile_photo_id in attendees:
         items.append({
-            "id": user.id,
-            "username": user.username,
-            "profile_picture": user.profile_picture
+            "id": user_id,
+            "username": username,
+            "profile_photo_id": profile_photo_id,
+            "avatar_url": avatar_url(user_id, profile_photo_id)
         })
 
-    return jsonify({
-        "items": items,
-        "page": pagination.page,
-        "per_page": pagination.per_page,
-        "total": pagination.total,
-        "pages": pagination.pages
-    }), 200
+    return json_response(page_request.response(items, next_cursor, total))
 
 
 #Search events
@@ -389,102 +436,88 @@ def search_events():
     if to_param and start_to is None:
         return jsonify({"message": "Invalid 'to' datetime format"}), 400
 
-    try:
-        page = max(int(request.args.get("page", 1)), 1)
-    except ValueError:
-        page=1
-
-    per_page = 10
+    page_request = PageRequest(per_page=10)
 
-    qry = db.session.query(EventPosts)
+    #loader options go on the page query below, facets group the same rows without them
+    qry, order = select(EventPosts), None
     if query_params:
-        qry = qry.filter(or_(EventPosts.title.ilike(f"%{query_params}%"), EventPosts.description.ilike(f"%{query_params}%")))
-    if city:
-        qry = qry.filter(EventPosts.city.ilike(f"%{city}%"))
-    if state:
-        qry = qry.filter(EventPosts.state.ilike(f"%{state}%"))
+        qry, order = match(qry, EventPosts, query_params)
+    #normalized keys and zipcode prefixes are served by the (location, start_time) indexes
     if country:
-        qry = qry.filter(EventPosts.country.ilike(f"%{country}%"))
+        qry = qry.where(EventPosts.country_key == normalize(country))
+    if state:
+        qry = qry.where(EventPosts.state_key == normalize(state))
+    if city:
+        qry = qry.where(EventPosts.city_key == normalize(city))
     if zipcode:
-        qry = qry.filter(EventPosts.zipcode.ilike(f"%{zipcode}%"))
-    
-    qry = qry.filter(EventPosts.start_time >= start_from)
-    if start_to:
-        qry = qry.filter(EventPosts.start_time <= start_to)
+        qry = qry.where(prefix_match(EventPosts.zipcode, zipcode))
 
-    qry = qry.order_by(EventPosts.start_time.asc())
+    try:
+        lat, lng, bbox = (request.args.get(name) for name in ("lat", "lng", "bbox"))
+        if lat is not None or lng is not None:
+            latitude, longitude = float(lat), float(lng)
+            radius_km = float(request.args.get("radius_km") or 25)
+            if not (-90 <= latitude <= 90 and -180 <= longitude <= 180 and 0 < radius_km <= MAX_RADIUS_KM):
+                raise ValueError
+            qry = within_radius(qry, latitude, longitude, radius_km)
+        elif bbox:
+            min_lat, min_lng, max_lat, max_lng = (float(value) for value in bbox.split(","))
+            if min_lat > max_lat or min_lng > max_lng:
+                raise ValueError
+            qry = within_box(qry, min_lat, min_lng, max_lat, max_lng)
+    except (TypeError, ValueError):
+        return jsonify({"message": f"lat and lng need a radius_km up to {MAX_RADIUS_KM}, bbox is min_lat,min_lng,max_lat,max_lng"}), 400
+
+    qry = qry.where(EventPosts.start_time >= start_from)
+    if start_to:
+        qry = qry.where(EventPosts.start_time <= start_to)
 
     #need since this route does not require a token
-    owner_user_id = None
-    auth = request.headers.get("Authorization", "")
-    if auth.startswith("Bearer "):
-        token = auth.split(" ", 1)[1].strip()
-        try:
-            data = jose_jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
-            owner_user_id = int(data.get("sub"))
-        except (jose_exceptions.ExpiredSignatureError, jose_exceptions.JWTError, ValueError):
-            owner_user_id = None
-
-    pagination = qry.paginate(page=page, per_page=per_page, error_out=False)
-    items = []
-    for event in pagination.items:
-        data = event_post_schema.dump(event)
-        if owner_user_id and data.get("hosts"):
-            for idx, host in enumerate(data["hosts"]):
-                host_id = host.get("id")
-                if host_id:
-                    host["is_following"] = bool(db.session.execute(
-                        select(exists().where(
-                            (follows.c.follower_id == owner_user_id) &
-                            (follows.c.followed_id == host_id)
-                        ))
-                    ).scalar())
-                    data["hosts"][idx] = host
-        items.append(data)
-
-    return jsonify({
-        "items": items,
-        "page": pagination.page,
-        "per_page": pagination.per_page,
-        "total": pagination.total,
-        "pages": pagination.pages
-    }), 200
+    owner_user_id = optional_user_id()
+
+    #text searches rank by relevance, plain filters list soonest first
+    keys, descending = order or ([EventPosts.start_time, EventPosts.id], False)
+    fields = requested_fields(event_posts_schema)
+    page = qry.options(*event_options(fields), *projection(EventPosts, event_posts_schema, fields))
+    events, next_cursor, total = paginate(page, keys, page_request, descending)
+    if wants(fields, "rsvped_by_me"):
+        annotate_events(events, owner_user_id)
+    items = dump(sparse(event_posts_schema, fields), events)
+    annotate_users([host for data in items for host in data.get("hosts") or []], owner_user_id)
+
+    response = page_request.response(items, next_cursor, total)
+    if (request.args.get("facets") or "").lower() in TRUTHY:
+        response["facets"] = location_facets(qry)
+    return json_response(response)
 
 
 #View my RSVPs
 @event_posts_bp.route('/me/rsvps', methods=['GET'])
 @token_required
-def my_rsvps(user_id):
+def my_rsvps():
     user_id = request.user_id
 
     range = (request.args.get("range") or "upcoming").lower()
 
-    try:
-        page = max(int(request.args.get("page", 1)), 1)
-    except ValueError:
-        page=1
-
-    per_page = 10
+    page_request = PageRequest(per_page=10)
 
     now = datetime.now(timezone.utc)
 
-    qry = (db.session.query(EventPosts).join(event_rsvps, EventPosts.id == event_rsvps.c.event_post_id).filter(event_rsvps.c.user_id == user_id))
+    fields = requested_fields(event_posts_schema)
+    qry = events_query(fields).options(*projection(EventPosts, event_posts_schema, fields))
+    qry = qry.join(event_rsvps, EventPosts.id == event_rsvps.c.event_post_id).where(event_rsvps.c.user_id == user_id)
 
+    descending = False
     if range == "upcoming":
-        qry = qry.filter(EventPosts.start_time >= now).order_by(EventPosts.start_time.asc())
+        qry = qry.where(EventPosts.start_time >= now)
     elif range == "past":
-        qry = qry.filter(EventPosts.start_time < now).order_by(EventPosts.start_time.desc())
-    else:
-        qry = qry.order_by(EventPosts.start_time.asc())
+        qry = qry.where(EventPosts.start_time < now)
+        descending = True
 
-    pagination = qry.paginate(page=page, per_page=per_page, error_out=False)
-    return jsonify({
-        "items": event_posts_schema.dump(pagination.items),
-        "page": pagination.page,
-        "per_page": pagination.per_page,
-        "total": pagination.total,
-        "pages": pagination.pages
-    }), 200
+    events, next_cursor, total = paginate(qry, [EventPosts.start_time, EventPosts.id], page_request, descending=descending)
+    if wants(fields, "rsvped_by_me"):
+        annotate_events(events, user_id)
+    return json_response(page_request.response(dump(sparse(event_posts_schema, fields), events), next_cursor, total))
 
 
 #Upload event post cover photo
@@ -500,6 +533,11 @@ def upload_event_cover(event_post_id):
     is_host = db.session.execute(select(event_hosts.c.user_id).where(event_hosts.c.event_post_id == event_post_id, event_hosts.c.user_id == user_id)).first() is not None
     if not is_host:
         return jsonify({"message": "Forbidden, must be a host to modify this event"}), 403
+
+    try:
+        check_upload_request()
+    except UploadRejected as e:
+        return jsonify({"message": e.message}), e.status
     
     if "photo" not in request.files:
         return jsonify({"message": "No file provided"}), 400
@@ -507,30 +545,31 @@ def upload_event_cover(event_post_id):
     if not file or file.filename == "":
         return jsonify({"message": "No file selected"}), 400
     
-    filename = secure_filename(file.filename)
     old_cover_id = event.cover_photo_id 
 
-    file_data = file.read()
-
     try:
-        photo = Photos(
-            user_id=user_id,
-            filename=filename,
-            content_type=file.mimetype or "image/jpeg",
-            file_data=file_data
-        )
+        photo = photo_from_upload(file, user_id)
         db.session.add(photo)
         db.session.flush()
 
         event.cover_photo_id = photo.id
+        invalidate(f"event:{event_post_id}")
         db.session.add(event)
+        db.session.flush()
 
+        orphans = []
         if old_cover_id:
             old = db.session.get(Photos, old_cover_id)
             if old and old.user_id == user_id:
                 db.session.delete(old)
+                db.session.flush()
+                orphans = release_blobs([old.content_hash])
 
         db.session.commit()
+        if old_cover_id:
+            hot_images.invalidate_photo(old_cover_id)
+        purge_blobs(orphans)
+        schedule_photo_variants(photo)
 
         return jsonify({
             "message": "Event cover photo updated",
@@ -541,6 +580,10 @@ def upload_event_cover(event_post_id):
             }
         }), 201
 
+    except UploadRejected as e:
+        db.session.rollback()
+        return jsonify({"message": e.message}), e.status
+
     except Exception as e:
         db.session.rollback()
         return jsonify({"message": "Event cover picture upload failed"}), 500
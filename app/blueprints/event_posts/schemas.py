@@ -1,21 +1,25 @@
 from app.extensions import ma
-from marshmallow import fields
+from marshmallow import fields, validate
 from app.models import EventPosts
-from app.blueprints.users.schemas import UserSchema
+from app.blueprints.users.schemas import UserSchema, AUTHOR_FIELDS
 
 
 class EventPostSchema(ma.SQLAlchemyAutoSchema):
     cover_photo = fields.Nested("PhotoSchema")
-    hosts = fields.Nested(
-        UserSchema,
-        many=True,
-        only=("id", "username", "profile_photo_id", "first_name", "last_name"),
-    )
+    hosts = fields.Nested(UserSchema, many=True, only=AUTHOR_FIELDS)
+    #attendee_count is a counter column, rsvped_by_me comes from app.util.loaders.annotate_events
+    #the full list is under /events/<id>/attendees
+    attendee_count = fields.Integer(dump_only=True)
+    rsvped_by_me = fields.Boolean(dump_only=True)
+    latitude = fields.Float(allow_none=True, validate=validate.Range(min=-90, max=90))
+    longitude = fields.Float(allow_none=True, validate=validate.Range(min=-180, max=180))
 
     class Meta:
         model = EventPosts
         include_fk = True
         include_relationships = True
+        #the location keys and geohash are derived by app.util.locations
+        exclude = ("attendees", "country_key", "state_key", "city_key", "geohash")
 
 
 event_post_schema = EventPostSchema()
@@ -1,61 +1,77 @@
 import io
 from flask import request, jsonify, Flask, send_file
-from sqlalchemy import select, insert, delete, func
-from sqlalchemy.orm import selectinload
+from sqlalchemy import select, insert, delete, update, func
+from sqlalchemy.orm import selectinload, undefer
 from app.models import db, Posts, Users, Photos, EventPosts
-from app.extensions import limiter, cache
+from app.extensions import limiter, cache, photo_variants, hot_images
 from app.blueprints.photos import photos_bp
 from app.blueprints.photos.schemas import photo_schema, photos_schema
 from marshmallow import ValidationError
 from app.util.auth import encode_token, token_required
+from app.util.response_cache import invalidate
+from app.util.photos import store_upload, send_photo, send_cached_image, photo_version, schedule_photo_variants, check_upload_request, check_photo_count, UploadRejected, acquire_blobs, release_blobs, purge_blobs
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
 
-#Upload photo
+#Upload photos to a post
 @photos_bp.route('/upload', methods=['POST'])
 @token_required
-def upload_post_photo(post_id):
+def upload_post_photos():
     user_id = request.user_id
 
+    try:
+        check_upload_request()
+    except UploadRejected as e:
+        return jsonify({"message": e.message}), e.status
+
+    try:
+        post_id = int(request.form.get("post_id", ""))
+    except ValueError:
+        return jsonify({"message": "post_id is required"}), 400
+
     post = db.session.get(Posts, post_id)
 
     if not post:
         return jsonify({"message": "Post not found"}), 404
     if post.user_id != user_id:
         return jsonify({"message": "Forbidden, cannot add photos to another user's post"}), 403
-    
+
+    files = [file for file in request.files.getlist('photos') + request.files.getlist('photo') if file and file.filename]
+    if not files:
+        return jsonify({"message": "No file provided"}), 400
     try:
-        files = []
-        if 'photo' in request.files:
-            files = request.files.getlist('photos')
-        elif 'photo' in request.files:
-            files = [request.files['photo']]
-        else:
-            return jsonify({"message": "No file provided"}), 400
-#got help from Dylan (CodingTemple instructor)
-        saved = []
-        for file in files:
-            if not file or file.filename == '':
-                continue
-
-            photo = Photos(
-                user_id=user_id,
-                post_id=post_id,
-                filename=secure_filename(file.filename),
-                content_type = file.mimetype or 'image/jpeg',
-                file_data = file.read()
-            )
-        if not saved:
-            db.session.rollback()
-            return jsonify({"message": "No valid files"}), 400
-        
+        check_photo_count(files)
+    except UploadRejected as e:
+        return jsonify({"message": e.message}), e.status
+
+    #each file stands on its own, a rejected one is reported without failing the rest
+    rows = []
+    errors = []
+    for file in files:
+        try:
+            rows.append({"user_id": user_id, "post_id": post_id, **store_upload(file)})
+        except UploadRejected as e:
+            errors.append({"filename": file.filename, "message": e.message})
+
+    if not rows:
+        return jsonify({"message": "No valid files", "errors": errors}), 400
+
+    try:
+        acquire_blobs((row["content_hash"], row["size"]) for row in rows)
+        saved = db.session.scalars(insert(Photos).returning(Photos), rows).all()
+        invalidate(f"post:{post_id}")
         db.session.commit()
-        return jsonify({"message": "Upload successfull", "photos": saved})
-    
     except Exception as e:
         db.session.rollback()
         return jsonify({"message": "Upload failed"}), 500
 
+    schedule_photo_variants(*saved)
+    return jsonify({
+        "message": "Upload successful",
+        "photos": photos_schema.dump(saved),
+        "errors": errors
+    }), 201
+
 
 #Delete photo
 @photos_bp.route('/<int:photo_id>', methods=['DELETE'])
@@ -69,8 +85,20 @@ def delete_photo(photo_id):
     if photo.user_id != user_id:
         return jsonify({"message": "Forbidden, only owner can delete photo"}), 403
     try:
+        #the photo may be shown as a post image, an avatar, an event cover or all of them
+        cover_ids = db.session.execute(select(EventPosts.id).where(EventPosts.cover_photo_id == photo_id)).scalars().all()
+        invalidate(f"user:{user_id}", *([f"post:{photo.post_id}"] if photo.post_id else []), *[f"event:{event_id}" for event_id in cover_ids])
+        avatar = db.session.execute(update(Users).where(Users.profile_photo_id == photo_id).values(profile_photo_id=None)).rowcount
+        if cover_ids:
+            db.session.execute(update(EventPosts).where(EventPosts.id.in_(cover_ids)).values(cover_photo_id=None))
         db.session.delete(photo)
+        db.session.flush()
+        orphans = release_blobs([photo.content_hash])
         db.session.commit()
+        if avatar:
+            hot_images.invalidate_avatar(user_id)
+        hot_images.invalidate_photo(photo_id)
+        purge_blobs(orphans)
         return jsonify({"message": "Successfully deleted photo"}), 200
     
     except Exception as e:
@@ -81,18 +109,30 @@ def delete_photo(photo_id):
 #Get photo
 @photos_bp.route('/<int:photo_id>', methods=['GET'])
 def get_photo(photo_id):
-    photo = db.session.get(Photos, photo_id)
+    try:
+        width = photo_variants.resolve_width(request.args.get("size"), request.args.get("w"))
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+
+    image = hot_images.get((photo_id, width))
+    if image is not None:
+        return send_cached_image(image, max_age=3600)
+
+    photo = db.session.get(Photos, photo_id, options=[undefer(Photos.file_data)])
 
     if not photo:
         return jsonify({"message": "Photo not found"}), 404
-    return send_file(
-        io.BytesIO(photo.file_data),
-        mimetype=photo.content_type or "image/jpeg",
-        as_attachment=False,
-        download_name=photo.filename or f"photo_{photo_id}.jpg",
-        max_age=3600,
-        last_modified=photo.upload_date
-    )
+
+    #avatars and event covers (no post) are the hot ones worth keeping in memory
+    cache_key = (photo.id, width) if photo.post_id is None else None
+    return send_photo(photo, f"photo_{photo_id}.jpg", version=photo_version(photo), max_age=3600, width=width, cache_key=cache_key)
+
+
+#Hot image cache statistics for this worker
+@photos_bp.route('/cache/stats', methods=['GET'])
+@token_required
+def image_cache_stats():
+    return jsonify(hot_images.stats()), 200
 
 #============ probably don't need since photos can be grabbed from posts routes ==============
 
@@ -1,14 +1,19 @@
 from app.extensions import ma
+from marshmallow import fields
 from app.models import Photos
+from app.util.photos import photo_url
 
 
 class PhotoSchema(ma.SQLAlchemyAutoSchema):
+    url = fields.Method("get_url", metadata={"columns": ("id", "content_hash")})
 
-    
     class Meta:
         model = Photos
         exclude = ("file_data",)
 
+    def get_url(self, photo):
+        return photo_url(photo)
+
                   
 photo_schema = PhotoSchema()
-photos_schema = PhotoSchema(many=True)
\ No newline at end of file
+photos_schema = PhotoSchema(many=True)
@@ -5,9 +5,20 @@ from app.models import db, Posts, Users, follows, post_likes, Photos
 from app.extensions import limiter, cache
 from app.blueprints.posts import posts_bp
 from app.blueprints.posts.schemas import posts_schema, post_schema
-from app.blueprints.users.schemas import user_schema
+from app.blueprints.users.schemas import author_schema
 from marshmallow import ValidationError
-from app.util.auth import encode_token, token_required, SECRET_KEY
+from app.util.auth import encode_token, token_required, optional_user_id, SECRET_KEY
+from app.util.photos import photo_from_upload, avatar_url, schedule_photo_variants, check_upload_request, check_photo_count, UploadRejected
+from app.util.timeline import fan_out_post, remove_post, timeline_page
+from app.util.pagination import PageRequest, paginate
+from app.util.loaders import posts_query, load_post, load_posts, annotate_posts, annotate_post_dicts
+from app.util.query_budget import query_budget
+from app.util.counters import adjust
+from app.util.relationships import annotate_users
+from app.util.search import match
+from app.util.response_cache import cached, tag, invalidate
+from app.util.serializers import dump, json_response
+from app.util.fieldsets import requested_fields, wants, sparse, projection
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
 from jose import jwt as jose_jwt, exceptions as jose_exceptions
@@ -17,17 +28,21 @@ from jose import jwt as jose_jwt, exceptions as jose_exceptions
 @token_required
 def create_post():
     user_id = request.user_id
-    files = request.files
 
 
     if request.content_type and request.content_type.startswith("multipart/form-data"):
+        try:
+            check_upload_request()
+        except UploadRejected as e:
+            return jsonify({"message": e.message}), e.status
+
         caption = request.form.get("caption")
         location = request.form.get("location")
         photo_ids = request.form.getlist("photo_ids")
 
         new_post = Posts(user_id=user_id, caption=caption, location=location)
         db.session.add(new_post)
-        db.session.commit()
+        db.session.flush()
 
         for photo_id in photo_ids:
             try:
@@ -41,17 +56,36 @@ def create_post():
                 db.session.rollback()
                 return jsonify({"message": f"Photo_id `{photo_id_to_int}` not found"}), 404
             
+            if photo.post_id:
+                invalidate(f"post:{photo.post_id}")
             photo.post_id = new_post.id
             photo.user_id = user_id
 
         files = request.files.getlist("files")
-        for file in files or []:
-            if not file or file.filename == "":
-                continue
-            photo = Photos(user_id=user_id, post_id=new_post.id, filename=secure_filename(file.filename), content_type=file.mimetype or "image/jpeg", file_data=file.read())
-            db.session.add(photo)
-
-        db.session.commit()
+        uploaded = []
+        #a rollback also deletes the blobs stored so far, see store_upload()
+        try:
+            check_photo_count(files)
+            for file in files or []:
+                if not file or file.filename == "":
+                    continue
+                photo = photo_from_upload(file, user_id, post_id=new_post.id)
+                db.session.add(photo)
+                uploaded.append(photo)
+
+            fan_out_post(new_post)
+            adjust(Users, user_id, post_count=1)
+            invalidate(f"user:{user_id}", f"user-posts:{user_id}")
+            db.session.commit()
+        except UploadRejected as e:
+            db.session.rollback()
+            return jsonify({"message": e.message}), e.status
+        except Exception as e:
+            db.session.rollback()
+            return jsonify({"message": "Post creation failed"}), 500
+
+        schedule_photo_variants(*uploaded)
+        annotate_posts([new_post], user_id)
         return post_schema.jsonify(new_post), 201
     
     payload = request.get_json()
@@ -66,80 +100,66 @@ def create_post():
     
     post = Posts(**data)
     db.session.add(post)
+    fan_out_post(post)
+    adjust(Users, user_id, post_count=1)
+    invalidate(f"user:{user_id}", f"user-posts:{user_id}")
     db.session.commit()
+    annotate_posts([post], user_id)
     return post_schema.jsonify(post), 201
   
 
 
 #Search post by key words in caption
 @posts_bp.route('/search', methods=['GET'])
+@query_budget(6)
 def search_posts():
     if request.is_json:
         payload = request.get_json()
         query_params = (payload.get("query_params") or "").strip()
-        page = payload.get("page", 1)
-        per_page = payload.get("per_page", 20)
     else:
         query_params = request.args.get("query_params", "").strip()
-        page = request.args.get("page", 1)
-        per_page = request.args.get("per_page", 20)
 
     if not query_params:
         return jsonify({"message": "Query parameter is required"}), 400
     
-    page = max(int(request.args.get("page", 1)), 1)
-    per_page = 20
+    page_request = PageRequest(per_page=20)
+    fields = requested_fields(posts_schema)
+    qry, order = match(posts_query(fields).options(*projection(Posts, posts_schema, fields)), Posts, query_params)
+    keys, descending = order or ([Posts.created_at, Posts.id], True)
+    posts, next_cursor, total = paginate(qry, keys, page_request, descending)
+    if wants(fields, "liked_by_me"):
+        annotate_posts(posts, optional_user_id())
 
-    qry = Posts.query.filter(Posts.caption.ilike(f"%{query_params}%")).order_by(Posts.created_at.desc())
-    pagination = qry.paginate(page=page, per_page=per_page, error_out=False) #raises not found error if user asks for out of range page
-    
-    return jsonify({
-        "items": posts_schema.dump(pagination.items),
-        "page": pagination.page,
-        "per_page": pagination.per_page,
-        "total": pagination.total,
-        "pages": pagination.pages
-    }), 200
+    return json_response(page_request.response(dump(sparse(posts_schema, fields), posts), next_cursor, total))
 
 
 #View individual post
 @posts_bp.route('/<int:post_id>', methods=['GET'])
+@query_budget(6)
 def get_post(post_id):
-    post = (db.session.query(Posts).options(joinedload(Posts.user)).get(post_id))
-    if not post: 
-        return jsonify({"message": "Post not found"}), 404
-
-    request_user_id = None
-    auth = request.headers.get("Authorization", "")
-    if auth.startswith("Bearer "):
-        token = auth.split(" ", 1)[1].strip()
-        if token:
-            try:
-                decoded = jose_jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
-                request_user_id = int(decoded.get("sub"))
-            except (jose_exceptions.JWTError, ValueError):
-                request_user_id = None
-
-    data = post_schema.dump(post)
-    if post.user:
-        author_data = user_schema.dump(post.user)
-        if request_user_id and post.user.id != request_user_id:
-            is_following = db.session.execute(
-                select(exists().where(
-                    (follows.c.follower_id == request_user_id) &
-                    (follows.c.followed_id == post.user.id)
-                ))
-            ).scalar()
-            author_data["is_following"] = bool(is_following)
-        else:
-            author_data["is_following"] = False
-        data["author"] = author_data
-    return jsonify(data), 200
+    def build():
+        post = load_post(post_id)
+        if not post:
+            return {"message": "Post not found"}, 404
+        tag(f"user:{post.user_id}")
+        data = dump(post_schema, post)
+        if post.user:
+            data["author"] = dump(author_schema, post.user)
+        return data, 200
+
+    data, status = cached(build, tags=[f"post:{post_id}"])
+    if status == 200:
+        request_user_id = optional_user_id()
+        annotate_post_dicts([data], request_user_id)
+        if "author" in data:
+            annotate_users([data["author"]], request_user_id)
+    return json_response(data, status)
 
 
 #View posts in feed of people user follows(like a for you page)
 @posts_bp.route('/feed', methods=['GET'])
 @token_required
+@query_budget(10)
 def get_feed():
     # ============== my original route ==============
     # user_id = request.user_id
@@ -166,36 +186,17 @@ def get_feed():
 
     user_id = request.user_id
 
-    page = max(int(request.args.get("page", 1)), 1)
-    per_page = 10
-
-    followed_ids = db.session.execute(
-        select(follows.c.followed_id).where(follows.c.follower_id == user_id)
-    ).scalars().all()
-
-    visible_user_ids = set(followed_ids + [user_id])
+    page_request = PageRequest(per_page=10)
 
-    if not visible_user_ids:
-        return jsonify({
-            "items": [],
-            "page": page,
-            "per_page": per_page,
-            "total": 0,
-            "pages": 0
-        }), 200
-
-    qry = (
-        db.session.query(Posts)
-        .filter(Posts.user_id.in_(visible_user_ids))
-        .order_by(Posts.created_at.desc())
-    )
+    #home feed is read from the precomputed timeline, see app/util/timeline.py
+    post_ids, next_cursor, total = timeline_page(user_id, page_request)
 
-    pagination = qry.paginate(page=page, per_page=per_page, error_out=False)
-
-    posts = pagination.items
-    posts_data = posts_schema.dump(posts)
-
-    followed_set = set(followed_ids)
+    #?fields= narrows the posts, the author block is always there
+    fields = requested_fields(posts_schema)
+    posts = load_posts(post_ids, *projection(Posts, posts_schema, fields), fields=fields and fields | {"user"})
+    if wants(fields, "liked_by_me"):
+        annotate_posts(posts, user_id)
+    posts_data = dump(sparse(posts_schema, fields), posts)
 
     for idx, post in enumerate(posts):
         p = posts_data[idx]
@@ -208,7 +209,7 @@ def get_feed():
                 "first_name": author.first_name,
                 "last_name": author.last_name,
                 "profile_photo_id": author.profile_photo_id,
-                "is_following": bool(author.id in followed_set),
+                "avatar_url": avatar_url(author.id, author.profile_photo_id),
             }
         else:
             p.setdefault("author", {
@@ -217,43 +218,33 @@ def get_feed():
                 "first_name": None,
                 "last_name": None,
                 "profile_photo_id": None,
-                "is_following": False,
+                "avatar_url": None,
             })
-    
+
+    annotate_users([p["author"] for p in posts_data], user_id)
+    for p in posts_data:
         p["author_is_following"] = p["author"]["is_following"]
 
-    return jsonify({
-        "items": posts_data,
-        "page": pagination.page,
-        "per_page": pagination.per_page,
-        "total": pagination.total,
-        "pages": pagination.pages
-    }), 200
+    return json_response(page_request.response(posts_data, next_cursor, total))
 
 
 #View all post of a user(like viewing their profile)
 @posts_bp.route('/by-user/<int:user_id>', methods=['GET'])
+@query_budget(6)
 def get_posts_by_user(user_id):
-    try:
-        page = max(int(request.args.get("page", 1)), 1)
-    except ValueError:
-        page = 1
-    try:
-        per_page = min(max(int(request.args.get("per_page", 15)), 1), 50)
-    except ValueError:
-        per_page = 15
+    fields = requested_fields(posts_schema)
 
-    posts = (select(Posts).where(Posts.user_id == user_id).order_by(Posts.created_at.desc()))
+    def build():
+        page_request = PageRequest(per_page=15)
+        posts = posts_query(fields).options(*projection(Posts, posts_schema, fields)).where(Posts.user_id == user_id)
+        items, next_cursor, total = paginate(posts, [Posts.created_at, Posts.id], page_request)
+        tag(*[f"post:{post.id}" for post in items])
+        return page_request.response(dump(sparse(posts_schema, fields), items), next_cursor, total), 200
 
-    pagination = db.paginate(posts, page=page, per_page=per_page, error_out=False)
-        
-    return jsonify({
-        "items": posts_schema.dump(pagination.items),
-        "page": pagination.page,
-        "per_page": pagination.per_page,
-        "total": pagination.total,
-        "pages": pagination.pages
-    }), 200
+    data, status = cached(build, tags=[f"user:{user_id}", f"user-posts:{user_id}"])
+    if wants(fields, "liked_by_me"):
+        annotate_post_dicts(data["items"], optional_user_id())
+    return json_response(data, status)
 
 
 #Delete post
@@ -265,6 +256,9 @@ def delete_post(post_id):
     if not post:
         return jsonify({"message": "Post not found"}), 404
     
+    remove_post(post.id)
+    adjust(Users, post.user_id, post_count=-1)
+    invalidate(f"post:{post.id}", f"comments:{post.id}", f"user:{post.user_id}", f"user-posts:{post.user_id}")
     db.session.delete(post)
     db.session.commit()
     return jsonify({"message": f"Successfully deleted post"})
@@ -290,7 +284,9 @@ def update_post(post_id):
     for key, value in post_data.items():
         setattr(post, key, value)
 
+    invalidate(f"post:{post.id}")
     db.session.commit()
+    annotate_posts([post], user_id)
     return post_schema.jsonify(post), 200
 
 
@@ -316,6 +312,8 @@ def like_post(post_id):
         return jsonify({"message": "Post already liked"}), 200
     
     db.session.execute(insert(post_likes).values(user_id=user_id, post_id=post_id))
+    adjust(Posts, post_id, like_count=1)
+    invalidate(f"post:{post_id}")
     db.session.commit()
     return jsonify({"message": "Liked post"}), 201
 
@@ -330,49 +328,41 @@ def unlike_post(post_id):
     if not post:
         return jsonify({"message": "Post not found"}), 404
     
-    db.session.execute(
+    unliked = db.session.execute(
         delete(post_likes).where(
             post_likes.c.user_id ==user_id,
             post_likes.c.post_id == post_id
         )
     )
+    if unliked.rowcount:
+        adjust(Posts, post_id, like_count=-1)
+        invalidate(f"post:{post_id}")
     db.session.commit()
     return jsonify({"message": "Unliked post"}), 200
 
 
 #List of users who liked the post
 @posts_bp.route('/<int:post_id>/likes', methods=['GET'])
-def list_post_likes(current_user, post_id):
+def list_post_likes(post_id):
     post = db.session.get(Posts, post_id)
     if not post:
         return jsonify({"message": "Post not found"}), 404
     
-    try:
-        page = max(int(request.args.get("page", 1)), 1)
-    except ValueError:
-        page=1
-
-    per_page = 40
-
-    qry = (db.session.query(Users.id, Users.username, Users.profile_picture).join(post_likes, Users.id == post_likes.c.user_id).filter(post_likes.c.post_id == post_id).order_by(post_likes.c.created_at.desc(), Users.id.desc()))
+    page_request = PageRequest(per_page=40)
 
-    pagination = qry.paginate(page=page, per_page=per_page, error_out=False)
+    qry = select(Users.id, Users.username, Users.profile_photo_id).join(post_likes, Users.id == post_likes.c.user_id).where(post_likes.c.post_id == post_id)
+    likes, next_cursor, total = paginate(qry, [post_likes.c.created_at, post_likes.c.user_id], page_request)
 
     items =[]
-    for user in pagination.items:
+    for user_id, username, profile_photo_id in likes:
         items.append({
-            "id": user.id,
-            "username": user.username,
-            "profile_picture": user.profile_picture
+            "id": user_id,
+            "username": username,
+            "profile_photo_id": profile_photo_id,
+            "avatar_url": avatar_url(user_id, profile_photo_id)
         })
 
-    return jsonify({
-        "items": items,
-        "page": pagination.page,
-        "per_page": pagination.per_page,
-        "total": pagination.total,
-        "pages": pagination.pages
-    }), 200
+    return json_response(page_request.response(items, next_cursor, total))
 
 
 
@@ -1,16 +1,22 @@
 from app.extensions import ma
 from app.models import Posts
 from marshmallow import fields
-from app.blueprints.users.schemas import UserSchema
+from app.blueprints.users.schemas import UserSchema, AUTHOR_FIELDS
 
 class PostSchema(ma.SQLAlchemyAutoSchema):
     photos = fields.Nested("PhotoSchema", many=True)
     exclude = ("file_data",)
-    user = fields.Nested(UserSchema)
+    user = fields.Nested(UserSchema, only=AUTHOR_FIELDS)
+    #counts are counter columns, liked_by_me comes from app.util.loaders.annotate_posts
+    #the full liker list is under /posts/<id>/likes
+    like_count = fields.Integer(dump_only=True)
+    comment_count = fields.Integer(dump_only=True)
+    liked_by_me = fields.Boolean(dump_only=True)
 
     class Meta:
         model = Posts
         include_relationships = True
+        exclude = ("liked_by", "comments")
 
 post_schema = PostSchema()
 posts_schema = PostSchema(many=True)
@@ -1,12 +1,22 @@
 import io
 from flask import request, jsonify, send_file
 from sqlalchemy import select, insert, delete, exists, func
+from sqlalchemy.orm import undefer
 from app.models import db, Users, follows, Photos, event_hosts, event_rsvps, HostRole, EventPosts, Posts, Comments, post_likes
-from app.extensions import limiter, cache
+from app.extensions import limiter, cache, photo_variants, hot_images
 from app.blueprints.users import users_bp
-from app.blueprints.users.schemas import user_schema, users_schema, user_login_schema
+from app.blueprints.users.schemas import user_schema, user_list_schema, user_login_schema, LIST_FIELDS
 from marshmallow import ValidationError
-from app.util.auth import encode_token, token_required, SECRET_KEY
+from app.util.auth import encode_token, token_required, optional_user_id, SECRET_KEY
+from app.util.photos import photo_from_upload, send_photo, send_cached_image, schedule_photo_variants, check_upload_request, UploadRejected, release_blobs, purge_blobs
+from app.util.timeline import backfill_follow, remove_follow, remove_user
+from app.util.pagination import PageRequest, paginate
+from app.util.counters import adjust, recount_users, recount_posts, recount_events
+from app.util.relationships import annotate_users, RELATIONSHIP_FIELDS
+from app.util.search import search_usernames
+from app.util.response_cache import cached, tag, invalidate
+from app.util.serializers import dump, json_response
+from app.util.fieldsets import requested_fields, sparse, projection
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
 from jose import jwt as jose_jwt, exceptions as jose_exceptions
@@ -49,12 +59,22 @@ def create_user():
     data['password'] = generate_password_hash(data['password'])
     new_user = Users(**data)
     db.session.add(new_user)
+    invalidate(f"username:{new_user.username}")
     db.session.commit()
 
     response = user_schema.dump(new_user)
     return jsonify(response), 201
 
 
+def profile_counts(user):
+    return {
+        "posts": user.post_count,
+        "events": user.event_count,
+        "followers": user.follower_count,
+        "following": user.following_count,
+    }
+
+
 #View another user (public profile)
 @users_bp.route('/<string:username>', methods=['GET'])
 @token_required
@@ -87,48 +107,25 @@ def read_user(username):
     #========================== to also return follows and event hosts ===================
     user_id = getattr(request, "user_id", None)
 
-    target_user = (
-        db.session.execute(
-            select(Users).where(Users.username == username)
-        ).scalar_one_or_none()
-    )
+    def build():
+        target_user = (
+            db.session.execute(
+                select(Users).where(Users.username == username)
+            ).scalar_one_or_none()
+        )
 
-    if not target_user:
-        return jsonify({"message": "User not found"}), 404
+        if not target_user:
+            return {"message": "User not found"}, 404
 
-    posts_count = (
-        db.session.execute(
-            select(func.count(Posts.id)).where(Posts.user_id == target_user.id)
-        ).scalar()
-        or 0
-    )
-
-    events_count = (
-        db.session.execute(
-            select(func.count(EventPosts.id))
-            .select_from(EventPosts)
-            .join(event_hosts, event_hosts.c.event_post_id == EventPosts.id).where(event_hosts.c.user_id == target_user.id)).scalar() or 0)
-
-    followers_count = (
-        db.session.execute(select(func.count(follows.c.follower_id)).where(follows.c.followed_id == target_user.id)).scalar() or 0)
-
-    following_count = (
-        db.session.execute(select(func.count(follows.c.followed_id)).where(follows.c.follower_id == target_user.id)).scalar() or 0)
-
-    is_following = False
-    if user_id and user_id != target_user.id:
-        is_following = db.session.execute(select(exists().where((follows.c.follower_id == user_id) & (follows.c.followed_id == target_user.id)))).scalar()
-
-    payload = user_schema.dump(target_user)
-    payload["counts"] = {
-        "posts": posts_count,
-        "events": events_count,
-        "followers": followers_count,
-        "following": following_count,
-    }
-    payload["is_following"] = bool(is_following)
+        tag(f"user:{target_user.id}")
+        payload = user_schema.dump(target_user)
+        payload["counts"] = profile_counts(target_user)
+        return payload, 200
 
-    return jsonify(payload), 200
+    payload, status = cached(build, tags=[f"username:{username}"])
+    if status == 200:
+        annotate_users([payload], user_id)
+    return jsonify(payload), status
 
 
 #View self
@@ -140,19 +137,10 @@ def read_me():
     user = db.session.get(Users, user_id)
     if not user:
         return jsonify({"message": "User not found"}), 404
-    posts_count = db.session.execute(select(func.count(Posts.id)).where(Posts.user_id == user.id)).scalar() or 0
-    events_count = db.session.execute(select(func.count(EventPosts.id)).select_from(EventPosts).join(event_hosts, event_hosts.c.event_post_id == EventPosts.id).where(event_hosts.c.user_id == user.id)).scalar() or 0
-    followers_count = db.session.execute(select(func.count(follows.c.follower_id)).where(follows.c.followed_id == user.id)).scalar() or 0
-    following_count = db.session.execute(select(func.count(follows.c.followed_id)).where(follows.c.follower_id == user.id)).scalar() or 0
-
     payload = user_schema.dump(user)
-    payload["counts"] = {
-        "posts": posts_count,
-        "events": events_count,
-        "followers": followers_count,
-        "following": following_count,
-    }
-    payload["is_following"] = False #users can't follow themselves
+    payload["counts"] = profile_counts(user)
+    #users can't follow themselves
+    payload.update(is_following=False, follows_me=False, mutual=False)
 
     return jsonify(payload), 200
 
@@ -166,35 +154,74 @@ def delete_user():
     if not user:
         return jsonify({"message": "User not found"}), 404
     try:
+        #rows whose counters change once this user's follows, likes, comments and RSVPs are gone
+        related_user_ids = set(db.session.execute(select(follows.c.followed_id).where(follows.c.follower_id == user_id)).scalars().all())
+        related_user_ids |= set(db.session.execute(select(follows.c.follower_id).where(follows.c.followed_id == user_id)).scalars().all())
+        related_post_ids = set(db.session.execute(select(post_likes.c.post_id).where(post_likes.c.user_id == user_id)).scalars().all())
+        related_post_ids |= set(db.session.execute(select(Comments.post_id).where(Comments.user_id == user_id)).scalars().all())
+        related_event_ids = set(db.session.execute(select(event_rsvps.c.event_post_id).where(event_rsvps.c.user_id == user_id)).scalars().all())
+        hosted_event_ids = set(db.session.execute(select(event_hosts.c.event_post_id).where(event_hosts.c.user_id == user_id)).scalars().all())
+        #co-hosts' event lists show the events this user hosted with them
+        co_host_ids = set(db.session.execute(select(event_hosts.c.user_id).where(event_hosts.c.event_post_id.in_(hosted_event_ids))).scalars().all())
+
         db.session.execute(follows.delete().where(follows.c.follower_id == user_id))
         db.session.execute(follows.delete().where(follows.c.followed_id == user_id))
         db.session.execute(event_rsvps.delete().where(event_rsvps.c.user_id == user_id))
         db.session.execute(event_hosts.delete().where(event_hosts.c.user_id == user_id))
+        remove_user(user_id)
+
+        released_hashes = []
+        deleted_photo_ids = []
 
         hostless_event_ids = db.session.query(EventPosts.id).outerjoin(event_hosts, EventPosts.id == event_hosts.c.event_post_id).filter(event_hosts.c.event_post_id.is_(None)).all()
         if hostless_event_ids:
             ids = [row[0] for row in hostless_event_ids]
             cover_photo_ids = db.session.query(EventPosts.cover_photo_id).filter(EventPosts.id.in_(ids), EventPosts.cover_photo_id.isnot(None)).all()
             if cover_photo_ids:
-                db.session.execute(Photos.__table__.delete().where(Photos.id.in_([p[0] for p in cover_photo_ids])))
+                cover_ids = [p[0] for p in cover_photo_ids]
+                released_hashes += db.session.execute(select(Photos.content_hash).where(Photos.id.in_(cover_ids))).scalars().all()
+                deleted_photo_ids += cover_ids
+                db.session.execute(Photos.__table__.delete().where(Photos.id.in_(cover_ids)))
             db.session.query(EventPosts).filter(EventPosts.id.in_(ids)).delete(synchronize_session=False)
         post_ids = [post_id for (post_id,) in db.session.query(Posts.id).filter(Posts.user_id == user_id).all()]
         if post_ids:
             db.session.execute(post_likes.delete().where(post_likes.c.post_id.in_(post_ids)))
             db.session.query(Comments).filter(Comments.post_id.in_(post_ids)).delete(synchronize_session=False)
+            for photo_id, content_hash in db.session.execute(select(Photos.id, Photos.content_hash).where(Photos.post_id.in_(post_ids))).all():
+                deleted_photo_ids.append(photo_id)
+                released_hashes.append(content_hash)
             db.session.query(Photos).filter(Photos.post_id.in_(post_ids)).delete(synchronize_session=False)
             db.session.query(Posts).filter(Posts.id.in_(post_ids)).delete(synchronize_session=False)
 
         db.session.query(Comments).filter(Comments.user_id == user_id).delete(synchronize_session=False)
         db.session.execute(post_likes.delete().where(post_likes.c.user_id == user_id))
-        db.session.query(Photos).filter(Photos.user_id == user_id).delete(synchronize_session=False)
 
         user.profile_photo_id = None
-        db.session.add(user)
         db.session.flush()
-
+        for photo_id, content_hash in db.session.execute(select(Photos.id, Photos.content_hash).where(Photos.user_id == user_id)).all():
+            deleted_photo_ids.append(photo_id)
+            released_hashes.append(content_hash)
+        db.session.query(Photos).filter(Photos.user_id == user_id).delete(synchronize_session=False)
+        orphans = release_blobs(released_hashes)
+
+        invalidate(
+            f"user:{user_id}", f"username:{user.username}", f"user-posts:{user_id}", f"user-events:{user_id}",
+            f"followers:{user_id}", f"following:{user_id}",
+            *[f"post:{post_id}" for post_id in set(post_ids) | related_post_ids],
+            *[f"comments:{post_id}" for post_id in set(post_ids) | related_post_ids],
+            *[f"event:{event_id}" for event_id in related_event_ids | hosted_event_ids],
+            *[f"user-events:{host_id}" for host_id in co_host_ids],
+            *[name for related_id in related_user_ids for name in (f"user:{related_id}", f"followers:{related_id}", f"following:{related_id}")],
+        )
         db.session.delete(user)
+        db.session.flush()
+        recount_users(list(related_user_ids))
+        recount_posts(list(related_post_ids))
+        recount_events(list(related_event_ids))
         db.session.commit()
+        hot_images.invalidate_avatar(user_id)
+        hot_images.invalidate_photo(*deleted_photo_ids)
+        purge_blobs(orphans)
         return jsonify({"message": f"Successfully deleted user {user_id}"}), 200
     except Exception as e:
         db.session.rollback()
@@ -226,6 +253,9 @@ def update_user():
     if 'password' in user_data:
         user_data['password'] = generate_password_hash(user_data['password'])
 
+    invalidate(f"user:{user_id}", f"username:{user.username}")
+    if new_username:
+        invalidate(f"username:{new_username}")
     for key, value in user_data.items():
         setattr(user, key, value)
 
@@ -257,32 +287,22 @@ def search_user():
     if not username:
         return jsonify({"message": "Username is required"}), 400
 
-    auth = request.headers.get("Authorization", "")
-    
 #need in order to identity user since route is not @token_required
-    owner_user_id = None
-    if auth.startswith("Bearer "):
-        token = auth.split(" ", 1)[1].strip()
-        try: 
-            data = jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
-            owner_user_id = int(data.get("sub"))
-        except (jose_exceptions.ExpiredSignatureError, jose_exceptions.JWTError, ValueError):
-            owner_user_id = None
-
-    users = (
-        db.session.query(Users).filter(Users.username.ilike(f"%{username}%")).order_by(Users.username.asc()).limit(30).all())
-
-    payload = []
-    for u in users:
-        data = user_schema.dump(u)
-        if owner_user_id and owner_user_id != u.id:
-            data["is_following"] = bool(db.session.execute(select(exists().where(follows.c.follower_id == owner_user_id) & (follows.c.followed_id == u.id))).scalar())
-        else:
-            data["is_following"] = False
-        payload.append(data)
-    return jsonify({
+    owner_user_id = optional_user_id()
+
+    fields = requested_fields(user_list_schema, extra=RELATIONSHIP_FIELDS, default=frozenset(LIST_FIELDS + RELATIONSHIP_FIELDS))
+    #ranking reads the follower count and name whatever the client asked for
+    users = search_usernames(username, limit=30, options=projection(Users, user_list_schema, fields, "username", "follower_count"))
+
+    payload = dump(sparse(user_list_schema, fields), users)
+    if fields & set(RELATIONSHIP_FIELDS):
+        annotate_users(payload, owner_user_id)
+    for user in payload:
+        for name in set(RELATIONSHIP_FIELDS) - fields:
+            user.pop(name, None)
+    return json_response({
         "users": payload
-    }), 200
+    })
 
 
 #Follow a user
@@ -301,6 +321,10 @@ def follow_user(target_id):
         return jsonify({"message": "Already following"}), 200
     
     db.session.execute(insert(follows).values(follower_id=follower_id, followed_id=target_id))
+    adjust(Users, follower_id, following_count=1)
+    adjust(Users, target_id, follower_count=1)
+    backfill_follow(follower_id, target_id)
+    invalidate(f"user:{follower_id}", f"user:{target_id}", f"following:{follower_id}", f"followers:{target_id}")
     db.session.commit()
     return jsonify({"message": "Successfully followed"}), 201
 
@@ -314,6 +338,11 @@ def unfollow_user(target_id):
         return jsonify({"message": "User not found"}), 404
     
     unfollow = db.session.execute(follows.delete().where(follows.c.follower_id == follower_id, follows.c.followed_id == target_id))
+    if unfollow.rowcount:
+        adjust(Users, follower_id, following_count=-1)
+        adjust(Users, target_id, follower_count=-1)
+        invalidate(f"user:{follower_id}", f"user:{target_id}", f"following:{follower_id}", f"followers:{target_id}")
+    remove_follow(follower_id, target_id)
     db.session.commit()
     if unfollow.rowcount == 0:
         return jsonify({"message": "Not following"}), 200
@@ -323,37 +352,35 @@ def unfollow_user(target_id):
 #List followers
 @users_bp.route('/<int:user_id>/followers', methods=['GET'])
 def list_followers(user_id):
-    page = max(int(request.args.get("page", 1)), 1)
-    per_page = 30
+    fields = requested_fields(user_list_schema, default=frozenset(LIST_FIELDS))
 
-    qry = (db.session.query(Users).join(follows, Users.id == follows.c.follower_id).filter(follows.c.followed_id == user_id).order_by(Users.username.asc()))
-    pagination = qry.paginate(page=page, per_page=per_page, error_out=False)
+    def build():
+        page_request = PageRequest(per_page=30)
+        qry = select(Users).options(*projection(Users, user_list_schema, fields))
+        qry = qry.join(follows, Users.id == follows.c.follower_id).where(follows.c.followed_id == user_id)
+        users, next_cursor, total = paginate(qry, [Users.username, Users.id], page_request, descending=False)
+        tag(*[f"user:{user.id}" for user in users])
+        return page_request.response(dump(sparse(user_list_schema, fields), users), next_cursor, total), 200
 
-    return jsonify({
-        "items": users_schema.dump(pagination.items),
-        "page": pagination.page,
-        "per_page": pagination.per_page,
-        "total": pagination.total,
-        "pages": pagination.pages
-    }), 200
+    data, status = cached(build, tags=[f"followers:{user_id}"])
+    return json_response(data, status)
 
 
 #List following
 @users_bp.route('/<int:user_id>/following', methods=['GET'])
 def list_following(user_id):
-    page = max(int(request.args.get("page", 1)), 1)
-    per_page = 30
+    fields = requested_fields(user_list_schema, default=frozenset(LIST_FIELDS))
 
-    qry = (db.session.query(Users).join(follows, Users.id == follows.c.followed_id).filter(follows.c.follower_id == user_id).order_by(Users.username.asc()))
-    pagination = qry.paginate(page=page, per_page=per_page, error_out=False)
+    def build():
+        page_request = PageRequest(per_page=30)
+        qry = select(Users).options(*projection(Users, user_list_schema, fields))
+        qry = qry.join(follows, Users.id == follows.c.followed_id).where(follows.c.follower_id == user_id)
+        users, next_cursor, total = paginate(qry, [Users.username, Users.id], page_request, descending=False)
+        tag(*[f"user:{user.id}" for user in users])
+        return page_request.response(dump(sparse(user_list_schema, fields), users), next_cursor, total), 200
 
-    return jsonify({
-        "items": users_schema.dump(pagination.items),
-        "page": pagination.page,
-        "per_page": pagination.per_page,
-        "total": pagination.total,
-        "pages": pagination.pages
-    }), 200
+    data, status = cached(build, tags=[f"following:{user_id}"])
+    return json_response(data, status)
 
 
 #Upload profile picture
@@ -365,39 +392,44 @@ def upload_profile_photo():
     user = db.session.get(Users, user_id)
     if not user:
         return jsonify({"message": "User not found"}), 404
+
+    try:
+        check_upload_request()
+    except UploadRejected as e:
+        return jsonify({"message": e.message}), e.status
     
+    if "photo" not in request.files:
+        return jsonify({"message": "No file provided"}), 400
+
     file = request.files['photo']
     if not file or file.filename == '':
         return jsonify({"message": "No file selected"}), 400
     
-    if "photo" not in request.files:
-        return jsonify({"message": "No file provided"}), 400
-    
-    filename = secure_filename(file.filename)
-
     old_photo_id = user.profile_photo_id
 
-    file_data = file.read()
-
     try:
-        photo = Photos(
-            user_id=user_id,
-            filename=filename,
-            content_type=file.mimetype or 'image/jpeg',
-            file_data=file_data
-        )
+        photo = photo_from_upload(file, user_id)
         db.session.add(photo)
         db.session.flush()
 
         user.profile_photo_id = photo.id
+        invalidate(f"user:{user_id}")
         db.session.add(user)
+        #users and photos point at each other, the old photo can only go once the user row has moved off it
+        db.session.flush()
 
+        orphans = []
         if old_photo_id:
             old = db.session.get(Photos, old_photo_id)
             if old and old.user_id == user_id:
                 db.session.delete(old)
+                db.session.flush()
+                orphans = release_blobs([old.content_hash])
 
         db.session.commit()
+        hot_images.invalidate_avatar(user_id)
+        purge_blobs(orphans)
+        schedule_photo_variants(photo)
 
         return jsonify({
             "message": "Successfully updated profile picture",
@@ -407,6 +439,10 @@ def upload_profile_photo():
                 "content_type": photo.content_type
             }
         }), 201
+
+    except UploadRejected as e:
+        db.session.rollback()
+        return jsonify({"message": e.message}), e.status
     
     except Exception as e:
         db.session.rollback()
@@ -429,12 +465,19 @@ def delete_profile_photo():
     try:
         old = db.session.get(Photos, user.profile_photo_id)
         user.profile_photo_id = None
+        invalidate(f"user:{user_id}")
         db.session.add(user)
+        db.session.flush()
 
+        orphans = []
         if old and old.user_id == user_id:
             db.session.delete(old)
+            db.session.flush()
+            orphans = release_blobs([old.content_hash])
 
         db.session.commit()
+        hot_images.invalidate_avatar(user_id)
+        purge_blobs(orphans)
         return jsonify({"message": "Successfully removed profile picture"}), 200
     
     except Exception as e:
@@ -445,18 +488,25 @@ def delete_profile_photo():
 #Get profile picture
 @users_bp.route('/<int:user_id>/avatar', methods=['GET'])
 def get_profile_photo(user_id):
+    try:
+        width = photo_variants.resolve_width(request.args.get("size"), request.args.get("w"))
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+
+    #unversioned avatar urls change on upload, keep them short lived
+    photo_id = hot_images.avatar_photo_id(user_id)
+    if photo_id is not None:
+        image = hot_images.get((photo_id, width))
+        if image is not None:
+            return send_cached_image(image, max_age=300, version=photo_id)
+
     user = db.session.get(Users, user_id)
     if not user or not user.profile_photo_id:
         return jsonify({"message": "Profile picture not found"}), 404
     
-    photo = db.session.get(Photos, user.profile_photo_id)
+    photo = db.session.get(Photos, user.profile_photo_id, options=[undefer(Photos.file_data)])
     if not photo:
         return jsonify({"message": "Profile photo not found"}), 404
-    
-    return send_file(
-        io.BytesIO(photo.file_data),
-        mimetype=photo.content_type or "image/jpeg",
-        as_attachment=False,
-        download_name=photo.filename or f"user_{user_id}_avatar.jpg",
-        last_modified=photo.upload_date
-    )
+
+    hot_images.set_avatar(user_id, photo.id)
+    return send_photo(photo, f"user_{user_id}_avatar.jpg", version=photo.id, max_age=300, width=width, cache_key=(photo.id, width))
@@ -1,13 +1,30 @@
 from app.extensions import ma
+from marshmallow import fields
 from app.models import Users
+from app.util.photos import avatar_url
+
+#what an embedded post author or event host shows, no contact or profile details
+AUTHOR_FIELDS = ("id", "username", "first_name", "last_name", "profile_photo_id", "avatar_url")
+#what follower, following and search lists show per user, ?fields= picks among these
+LIST_FIELDS = AUTHOR_FIELDS + ("bio", "follower_count")
+
 
 class UserSchema(ma.SQLAlchemyAutoSchema):
+    #columns lists what a computed field reads, for ?fields= projections (app.util.fieldsets)
+    avatar_url = fields.Method("get_avatar_url", metadata={"columns": ("id", "profile_photo_id")})
 
     class Meta:
         model = Users
         include_fk = True
+        dump_only = ("post_count", "event_count", "follower_count", "following_count")
+        #the hash is accepted on create and login, never written out
+        load_only = ("password",)
+
+    def get_avatar_url(self, user):
+        return avatar_url(user.id, user.profile_photo_id)
 
 user_schema = UserSchema()
 users_schema = UserSchema(many=True)
+author_schema = UserSchema(only=AUTHOR_FIELDS)
+user_list_schema = UserSchema(many=True, only=LIST_FIELDS)
 user_login_schema = UserSchema(only=['email', 'password'])
-    
@@ -0,0 +1,489 @@
+import asyncio
+import io
+import json
+import os
+import random
+import statistics
+import tempfile
+import time
+from urllib.parse import urlsplit, quote
+from datetime import datetime, date, timedelta, timezone
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import select, update, delete, func, inspect, create_engine, insert
+from app.models import db, Base, Photos, PhotoBlobs, Users, Posts, Comments, EventPosts, follows, timeline_pull_authors
+from app.extensions import blob_store
+from app.util.photos import acquire_blobs, purge_blobs
+from app.util.timeline import rebuild_timeline, trim_timeline, DEFAULT_FANOUT_LIMIT
+from app.util.counters import COUNTERS, recount
+from app.util.search import INDEXED_COLUMNS, rebuild_search_index, ilike, match
+from app.util.locations import location_keys
+from app.util.migrations import add_photo_blob_columns, add_counter_columns, add_event_location_columns, upgrade, pending_migrations, current_version
+from app.util.query_plans import hot_queries, explain, full_scans
+from app.util.serializers import dump, json_response
+from app.util.auth import encode_token
+from app.blueprints.posts.schemas import posts_schema
+from app.blueprints.event_posts.schemas import event_posts_schema
+from app.blueprints.users.schemas import users_schema
+from app.blueprints.comments.schemas import comments_schema
+
+photos_cli = AppGroup('photos', help="Photo storage maintenance.")
+timeline_cli = AppGroup('timeline', help="Home feed timeline maintenance.")
+counters_cli = AppGroup('counters', help="Denormalized counter maintenance.")
+search_cli = AppGroup('search', help="Full-text search index maintenance.")
+events_cli = AppGroup('events', help="Event location index maintenance.")
+db_cli = AppGroup('db', help="Schema migrations and query plan checks.")
+api_cli = AppGroup('api', help="API response performance checks.")
+
+
+def _ensure_photo_blob_columns():
+    with db.engine.begin() as conn:
+        add_photo_blob_columns(conn)
+    columns = {c["name"]: c for c in inspect(db.engine).get_columns("photos")}
+    return columns["file_data"]["nullable"]
+
+
+#Drain legacy photos.file_data into the blob store
+@photos_cli.command('drain-blobs')
+@click.option('--batch-size', default=100, show_default=True, help="Rows moved per commit.")
+def drain_blobs(batch_size):
+    file_data_nullable = _ensure_photo_blob_columns()
+    #sqlite tables created before file_data became nullable keep their NOT NULL
+    cleared = None if file_data_nullable else b""
+
+    moved = 0
+    last_id = 0
+    while True:
+        rows = db.session.execute(
+            select(Photos.id, Photos.file_data)
+            .where(Photos.content_hash.is_(None), Photos.id > last_id)
+            .order_by(Photos.id.asc())
+            .limit(batch_size)
+        ).all()
+        if not rows:
+            break
+
+        for photo_id, file_data in rows:
+            content_hash, size = blob_store.put(io.BytesIO(file_data or b""))
+            acquire_blobs([(content_hash, size)])
+            db.session.execute(
+                update(Photos)
+                .where(Photos.id == photo_id)
+                .values(content_hash=content_hash, size=size, file_data=cleared)
+            )
+            last_id = photo_id
+
+        db.session.commit()
+        moved += len(rows)
+        click.echo(f"Moved {moved} photos")
+
+    click.echo(f"Done, {moved} photos drained into the blob store")
+
+
+#Recompute blob reference counts from the photos table
+@photos_cli.command('recount-blobs')
+def recount_blobs():
+    counts = db.session.execute(
+        select(Photos.content_hash, func.count(Photos.id), func.max(Photos.size))
+        .where(Photos.content_hash.isnot(None))
+        .group_by(Photos.content_hash)
+    ).all()
+    referenced = set()
+    for content_hash, ref_count, size in counts:
+        db.session.merge(PhotoBlobs(content_hash=content_hash, size=size or 0, ref_count=ref_count))
+        referenced.add(content_hash)
+
+    existing = set(db.session.execute(select(PhotoBlobs.content_hash)).scalars().all())
+    orphans = list(existing - referenced)
+    if orphans:
+        db.session.execute(delete(PhotoBlobs).where(PhotoBlobs.content_hash.in_(orphans)))
+
+    db.session.commit()
+    purge_blobs(orphans)
+    click.echo(f"{len(referenced)} blobs referenced, {len(orphans)} unreferenced blobs purged")
+
+
+#Refill timelines from posts and follows, e.g. after the tables were first created
+@timeline_cli.command('rebuild')
+@click.option('--user-id', type=int, default=None, help="Only rebuild this user's timeline.")
+@click.option('--batch-size', default=200, show_default=True, help="Timelines rebuilt per commit.")
+def rebuild_timelines(user_id, batch_size):
+    limit = current_app.config.get("TIMELINE_FANOUT_LIMIT", DEFAULT_FANOUT_LIMIT)
+    heavy = db.session.execute(
+        select(follows.c.followed_id)
+        .group_by(follows.c.followed_id)
+        .having(func.count() > limit)
+    ).scalars().all()
+    known = set(db.session.execute(select(timeline_pull_authors.c.user_id)).scalars().all())
+    for author_id in set(heavy) - known:
+        db.session.execute(timeline_pull_authors.insert().values(user_id=author_id))
+    db.session.commit()
+
+    if user_id is not None:
+        rebuild_timeline(user_id)
+        db.session.commit()
+        click.echo(f"Rebuilt timeline of user {user_id}")
+        return
+
+    rebuilt = 0
+    last_id = 0
+    while True:
+        user_ids = db.session.execute(
+            select(Users.id).where(Users.id > last_id).order_by(Users.id.asc()).limit(batch_size)
+        ).scalars().all()
+        if not user_ids:
+            break
+        for uid in user_ids:
+            rebuild_timeline(uid)
+        db.session.commit()
+        rebuilt += len(user_ids)
+        last_id = user_ids[-1]
+        click.echo(f"Rebuilt {rebuilt} timelines")
+
+    click.echo(f"Done, {rebuilt} timelines rebuilt, {len(set(heavy) | known)} authors in pull mode")
+
+
+#Cut every timeline back to TIMELINE_MAX_LENGTH entries
+@timeline_cli.command('trim')
+def trim_timelines():
+    user_ids = db.session.execute(select(Users.id).order_by(Users.id.asc())).scalars().all()
+    for uid in user_ids:
+        trim_timeline(uid)
+    db.session.commit()
+    click.echo(f"Trimmed {len(user_ids)} timelines")
+
+
+def _ensure_counter_columns():
+    with db.engine.begin() as conn:
+        add_counter_columns(conn)
+
+
+#Recompute every counter column from the source tables and fix the ones that drifted
+@counters_cli.command('reconcile')
+def reconcile_counters():
+    _ensure_counter_columns()
+    for model, counts in COUNTERS:
+        fixed = recount(model, counts())
+        db.session.commit()
+        click.echo(f"{model.__tablename__}: {fixed} rows corrected")
+
+
+#Recreate the full-text indexes and refill them from posts and event_posts
+@search_cli.command('rebuild')
+def rebuild_search():
+    with db.engine.begin() as conn:
+        for name in INDEXED_COLUMNS:
+            if not rebuild_search_index(conn, name):
+                raise click.ClickException(f"No full-text index support on {conn.dialect.name}, searches keep using ilike")
+            click.echo(f"{name}: full-text index rebuilt")
+    click.echo("Restart the app so running workers pick up the new indexes")
+
+
+def _synthetic_vocabulary(rng, size):
+    syllables = ["ba", "ko", "ri", "men", "sta", "lu", "dor", "ne", "vi", "gap", "pho", "tra", "el", "sun", "qui", "ar"]
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choice(syllables) for _ in range(rng.randint(2, 4))))
+    return sorted(words)
+
+
+def _timed(conn, stmt):
+    start = time.perf_counter()
+    conn.execute(stmt).all()
+    return (time.perf_counter() - start) * 1000
+
+
+#Compare the full-text index against the ilike scan on a synthetic posts table
+@search_cli.command('benchmark')
+@click.option('--rows', default=1_000_000, show_default=True, help="Synthetic posts to generate.")
+@click.option('--queries', default=50, show_default=True, help="Search terms timed per method.")
+@click.option('--database-url', default=None, help="Empty scratch database, a temporary sqlite file by default.")
+@click.option('--seed', default=0, show_default=True)
+def benchmark_search(rows, queries, database_url, seed):
+    rng = random.Random(seed)
+    vocabulary = _synthetic_vocabulary(rng, 5000)
+    #zipf-like word frequencies, a few common words and a long tail
+    weights = [1 / rank for rank in range(1, len(vocabulary) + 1)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(database_url or f"sqlite:///{os.path.join(tmp, 'search-benchmark.db')}")
+        if inspect(engine).has_table("posts"):
+            raise click.ClickException("The benchmark database must be empty")
+        Base.metadata.create_all(engine)
+        dialect = engine.dialect.name
+
+        with engine.begin() as conn:
+            user_id = conn.execute(insert(Users.__table__).values(
+                first_name="Bench", last_name="Mark", email="bench@example.com", username="bench", password="-",
+            )).inserted_primary_key[0]
+        for offset in range(0, rows, 10000):
+            batch = [
+                {"user_id": user_id, "caption": " ".join(rng.choices(vocabulary, weights, k=rng.randint(5, 25)))}
+                for _ in range(min(10000, rows - offset))
+            ]
+            with engine.begin() as conn:
+                conn.execute(insert(Posts.__table__), batch)
+            click.echo(f"Inserted {offset + len(batch)} posts")
+
+        #prefixes of mid-frequency words, the search box case of a half typed word
+        terms = [word[:4] for word in rng.sample(vocabulary[50:1000], queries)]
+        timings = {"ilike": [], "full-text": []}
+        with engine.connect() as conn:
+            for term in terms:
+                stmt = ilike(select(Posts.id), Posts, term).order_by(Posts.created_at.desc(), Posts.id.desc()).limit(20)
+                timings["ilike"].append(_timed(conn, stmt))
+
+                stmt, order = match(select(Posts.id), Posts, term, dialect=dialect)
+                if order is None:
+                    raise click.ClickException(f"No full-text index support on {dialect}")
+                keys, descending = order
+                stmt = stmt.order_by(*[key.desc() if descending else key.asc() for key in keys]).limit(20)
+                timings["full-text"].append(_timed(conn, stmt))
+        engine.dispose()
+
+    click.echo(f"{rows} posts on {dialect}, {queries} prefix searches, first page of 20")
+    for method, samples in timings.items():
+        samples.sort()
+        p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+        click.echo(f"{method:>10}: median {statistics.median(samples):.1f} ms, p95 {p95:.1f} ms")
+
+
+def _ensure_event_location_columns():
+    with db.engine.begin() as conn:
+        add_event_location_columns(conn)
+
+
+#Fill the normalized location keys and geohashes of existing events
+@events_cli.command('backfill-locations')
+@click.option('--batch-size', default=500, show_default=True, help="Events updated per commit.")
+def backfill_locations(batch_size):
+    _ensure_event_location_columns()
+    updated = 0
+    last_id = 0
+    while True:
+        events = db.session.execute(
+            select(EventPosts).where(EventPosts.id > last_id).order_by(EventPosts.id.asc()).limit(batch_size)
+        ).scalars().all()
+        if not events:
+            break
+        #bulk update by primary key, the before_update listener doesn't run here
+        db.session.execute(update(EventPosts), [{"id": event.id, **location_keys(event)} for event in events])
+        db.session.commit()
+        updated += len(events)
+        last_id = events[-1].id
+        click.echo(f"Updated {updated} events")
+
+    click.echo(f"Done, {updated} events indexed by location")
+
+
+#Create missing tables and apply pending schema migrations
+@db_cli.command('upgrade')
+@click.option('--to', 'target', type=int, default=None, help="Stop after this version.")
+def upgrade_schema(target):
+    applied = upgrade(db.engine, target, echo=click.echo)
+    click.echo(f"Schema at version {current_version(db.engine)}, {len(applied)} migrations applied")
+
+
+#Show the schema version and the migrations still to apply
+@db_cli.command('current')
+def schema_current():
+    click.echo(f"Schema at version {current_version(db.engine)}")
+    for version, name, _ in pending_migrations(db.engine):
+        click.echo(f"Pending {version}: {name}")
+
+
+#Log the query plan of each endpoint's main query and flag full table scans and sorts
+@db_cli.command('explain')
+@click.option('--strict', is_flag=True, help="Exit with an error when any query scans a whole table or sorts.")
+def explain_hot_queries(strict):
+    flagged = []
+    with db.engine.connect() as conn:
+        for name, stmt in hot_queries().items():
+            plan = explain(conn, stmt)
+            scans = full_scans(conn, plan)
+            current_app.logger.info("query plan for %s:\n%s", name, "\n".join(plan))
+            click.echo(f"{name}{'  NOT INDEXED: ' + ', '.join(scans) if scans else ''}")
+            for line in plan:
+                click.echo(f"    {line}")
+            if scans:
+                flagged.append(name)
+
+    if flagged:
+        message = f"{len(flagged)} queries scan whole tables or sort: {', '.join(flagged)}"
+        if strict:
+            raise click.ClickException(message)
+        click.echo(message)
+    else:
+        click.echo("Every query is served by an index")
+
+
+def _synthetic_objects(rng, count):
+    """Unsaved model instances shaped like a page of each hot list endpoint, by schema."""
+    start = datetime(2030, 1, 1, tzinfo=timezone.utc)
+
+    def user(i):
+        return Users(
+            id=i, first_name=f"First{i}", last_name=f"Last{i}", email=f"user{i}@example.com", username=f"user{i}",
+            password="-", dob=date(1990, 1, 1) + timedelta(days=i), profile_photo_id=i if i % 2 else None,
+            bio="bio " * rng.randint(0, 20), created_at=start, post_count=i, event_count=0, follower_count=i * 3, following_count=i,
+        )
+
+    def photo(i):
+        return Photos(id=i, filename=f"{i}.jpg", content_type="image/jpeg", content_hash=f"{i:064x}", size=rng.randint(10_000, 2_000_000), upload_date=start)
+
+    users = [user(i) for i in range(1, count + 1)]
+    posts = [
+        Posts(
+            id=i, user=users[i - 1], caption="caption " * rng.randint(1, 30), location="Brooklyn, NY", created_at=start - timedelta(minutes=i),
+            like_count=rng.randint(0, 500), comment_count=rng.randint(0, 50),
+            photos=[photo(i * 10 + n) for n in range(rng.randint(1, 4))],
+        )
+        for i in range(1, count + 1)
+    ]
+    for post in posts:
+        post.liked_by_me = bool(post.id % 3)
+    events = [
+        EventPosts(
+            id=i, title=f"Event {i}", description="description " * rng.randint(5, 40), created_at=start, start_time=start + timedelta(days=i),
+            street_address="1 Main St", city="New York", state="NY", zipcode="10001", country="USA",
+            latitude=40.7 + i / 1000, longitude=-74.0 + i / 1000, attendee_count=rng.randint(0, 200),
+            cover_photo=photo(i), cover_photo_id=i, hosts=users[i - 1:i + 1],
+        )
+        for i in range(1, count + 1)
+    ]
+    for event in events:
+        event.rsvped_by_me = bool(event.id % 2)
+    comments = [
+        Comments(id=i, user_id=users[i - 1].id, user=users[i - 1], post_id=1, comment="comment " * rng.randint(1, 15), created_at=start)
+        for i in range(1, count + 1)
+    ]
+    return {posts_schema: posts, event_posts_schema: events, users_schema: users, comments_schema: comments}
+
+
+def _per_item_us(fn, items, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(items)
+        best = min(best, time.perf_counter() - start)
+    return best / len(items) * 1_000_000
+
+
+#Per item cost of marshmallow + jsonify against the precompiled serializers + orjson
+@api_cli.command('benchmark-serializers')
+@click.option('--items', default=500, show_default=True, help="Objects per list.")
+@click.option('--repeat', default=5, show_default=True, help="Runs per method, the fastest counts.")
+@click.option('--seed', default=0, show_default=True)
+def benchmark_serializers(items, repeat, seed):
+    rng = random.Random(seed)
+    with current_app.test_request_context():
+        for schema, objects in _synthetic_objects(rng, items).items():
+            name = type(schema).__name__
+            if schema.dump(objects) != dump(schema, objects):
+                raise click.ClickException(f"{name}: precompiled output differs from the schema's")
+            before = _per_item_us(lambda batch: current_app.json.response({"items": schema.dump(batch)}).get_data(), objects, repeat)
+            after = _per_item_us(lambda batch: json_response({"items": dump(schema, batch)}).get_data(), objects, repeat)
+            click.echo(f"{name:>16}: {before:7.1f} us -> {after:6.1f} us per item, {before / after:4.1f}x")
+
+
+def _read_path_targets():
+    """(name, path, headers) for each endpoint the ASGI app serves, using rows of the current database."""
+    user = db.session.scalars(select(Users).order_by(Users.following_count.desc(), Users.id).limit(1)).first()
+    if user is None:
+        raise click.ClickException("The database has no users to benchmark with")
+    auth = {"Authorization": f"Bearer {encode_token(user.id)}"}
+    post_id = db.session.scalars(select(Posts.id).order_by(Posts.id.desc()).limit(1)).first()
+    photo_id = db.session.scalars(select(Photos.id).order_by(Photos.id.desc()).limit(1)).first()
+    title = db.session.scalars(select(EventPosts.title).order_by(EventPosts.id.desc()).limit(1)).first()
+
+    targets = [("feed", "/posts/feed", auth), ("profile", f"/users/{quote(user.username)}", auth)]
+    if post_id is not None:
+        targets.append(("post", f"/posts/{post_id}", {}))
+    if photo_id is not None:
+        targets.append(("photo", f"/photos/{photo_id}", {}))
+    if title and title.split():
+        targets.append(("event search", f"/events/search?query_params={quote(title.split()[0])}", {}))
+    return targets
+
+
+async def _http_get(url, path, headers, slow, timeout):
+    """One GET on a fresh connection, returns (status, body, ms). A slow client stalls before ending its headers."""
+    parts = urlsplit(url)
+    head = f"GET {parts.path.rstrip('/')}{path} HTTP/1.1\r\nHost: {parts.netloc}\r\nConnection: close\r\n"
+    head += "".join(f"{name}: {value}\r\n" for name, value in headers.items())
+
+    async def exchange():
+        reader, writer = await asyncio.open_connection(parts.hostname, parts.port or 80)
+        try:
+            writer.write(head.encode("latin1"))
+            if slow:
+                await writer.drain()
+                await asyncio.sleep(slow)
+            writer.write(b"\r\n")
+            await writer.drain()
+            response = await reader.read()
+        finally:
+            writer.close()
+        status_line, _, rest = response.partition(b"\r\n")
+        return int(status_line.split()[1]), rest.partition(b"\r\n\r\n")[2]
+
+    start = time.perf_counter()
+    status, body = await asyncio.wait_for(exchange(), timeout)
+    return status, body, (time.perf_counter() - start) * 1000
+
+
+async def _load(url, path, headers, concurrency, requests, slow, timeout):
+    gate = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with gate:
+            try:
+                status, _, ms = await _http_get(url, path, headers, slow, timeout)
+                #429s count as failures, run both servers with RATELIMIT_ENABLED=false
+                return ms if status < 400 else None
+            except (OSError, ValueError, IndexError, asyncio.TimeoutError):
+                return None
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*[one() for _ in range(requests)])
+    return [ms for ms in results if ms is not None], requests, time.perf_counter() - start
+
+
+def _same_response(first, second):
+    if first[0] != second[0]:
+        return False
+    try:
+        return json.loads(first[1]) == json.loads(second[1])
+    except ValueError:
+        return first[1] == second[1]
+
+
+#Latency and throughput of the Flask and the ASGI servers side by side, under a growing number of clients
+@api_cli.command('benchmark-read-path')
+@click.option('--flask-url', default="http://127.0.0.1:8000", show_default=True, help="e.g. gunicorn -w 4 -b :8000 flask_app:app")
+@click.option('--asgi-url', default="http://127.0.0.1:8001", show_default=True, help="e.g. uvicorn --port 8001 asgi_app:app")
+@click.option('--concurrency', '-c', multiple=True, type=int, default=(10, 100, 1000), show_default=True, help="Clients in flight, repeatable.")
+@click.option('--requests', default=1000, show_default=True, help="Requests per endpoint, server and concurrency.")
+@click.option('--slow-ms', default=0, show_default=True, help="How long each client takes to send its request.")
+@click.option('--timeout', default=30.0, show_default=True, help="Seconds before a request counts as failed.")
+def benchmark_read_path(flask_url, asgi_url, concurrency, requests, slow_ms, timeout):
+    targets = _read_path_targets()
+    servers = {"flask": flask_url, "asgi": asgi_url}
+
+    async def run():
+        for name, path, headers in targets:
+            responses = [await _http_get(url, path, headers, 0, timeout) for url in servers.values()]
+            if not _same_response(*responses):
+                raise click.ClickException(f"{name}: the servers answer {path} differently")
+            for clients in concurrency:
+                for server, url in servers.items():
+                    samples, sent, seconds = await _load(url, path, headers, clients, requests, slow_ms / 1000, timeout)
+                    samples.sort()
+                    line = f"{name:>12} c={clients:<5} {server:>5}: {len(samples) / seconds:8.1f} req/s"
+                    if samples:
+                        p99 = samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+                        line += f", median {statistics.median(samples):7.1f} ms, p99 {p99:7.1f} ms"
+                    click.echo(f"{line}, {sent - len(samples)} failed")
+
+    asyncio.run(run())
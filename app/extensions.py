@@ -2,6 +2,9 @@ from flask_marshmallow import Marshmallow
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 from flask_caching import Cache
+from app.util.blob_store import BlobStorage
+from app.util.variants import PhotoVariants
+from app.util.image_cache import ImageCache
 
 ma = Marshmallow()
 limiter = Limiter(
@@ -9,4 +12,10 @@ limiter = Limiter(
     default_limits=["2500 per day", "1000 per hour"]
 )
 
-cache = Cache()
\ No newline at end of file
+cache = Cache()
+
+blob_store = BlobStorage()
+
+photo_variants = PhotoVariants()
+
+hot_images = ImageCache()
\ No newline at end of file
@@ -1,14 +1,37 @@
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
 import enum
-from sqlalchemy import String, Integer, ForeignKey, DateTime, Table, Column, Date, Enum as EnumType, CheckConstraint, func, LargeBinary
-from datetime import datetime, date
+from sqlalchemy import String, Integer, Float, ForeignKey, DateTime, Table, Column, Date, Enum as EnumType, CheckConstraint, func, LargeBinary, Index, TypeDecorator
+from datetime import datetime, date, timezone
 
 
 
 class Base(DeclarativeBase):
     pass
 
+
+class UTCDateTime(TypeDecorator):
+    """DateTime(timezone=True) that binds aware values in UTC.
+
+    sqlite keeps timestamps as text without the offset, so every value is
+    written as UTC in the driver's format, which sorts and compares as text
+    and lets the (..., created_at, id) indexes serve keyset pages.
+    """
+    impl = DateTime(timezone=True)
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is not None and value.tzinfo is not None:
+            value = value.astimezone(timezone.utc)
+        return value
+
+
+def utcnow(context):
+    """Insert default, the server default's sqlite format lacks the fraction bound values have."""
+    now = datetime.now(timezone.utc)
+    #sqlite hands timestamps back naive, a new row reads the same before and after a reload
+    return now.replace(tzinfo=None) if context.dialect.name == "sqlite" else now
+
 db = SQLAlchemy(model_class = Base)
 
 class HostRole(enum.Enum):
@@ -21,8 +44,10 @@ follows = Table(
     Base.metadata,
     Column("follower_id", Integer, ForeignKey("users.id"), primary_key=True),
     Column("followed_id", Integer, ForeignKey("users.id"), primary_key=True),
-    Column("created_at", DateTime(timezone=True), nullable=False, server_default=func.now()),
-    CheckConstraint("follower_id <> followed_id", name="check_no_self_follow")
+    Column("created_at", UTCDateTime, nullable=False, default=utcnow, server_default=func.now()),
+    CheckConstraint("follower_id <> followed_id", name="check_no_self_follow"),
+    # the primary key serves "who do I follow", this serves "who follows me"
+    Index("ix_follows_followed", "followed_id", "follower_id")
 )
 
 post_likes = Table(
@@ -30,7 +55,8 @@ post_likes = Table(
     Base.metadata,
     Column("user_id", Integer, ForeignKey("users.id"), primary_key=True),
     Column("post_id", Integer, ForeignKey("posts.id"), primary_key=True),
-    Column("created_at", DateTime(timezone=True), nullable=False, server_default=func.now())
+    Column("created_at", UTCDateTime, nullable=False, default=utcnow, server_default=func.now()),
+    Index("ix_post_likes_post_created_user", "post_id", "created_at", "user_id")
 )
 
 # table presennce = GOING
@@ -39,7 +65,8 @@ event_rsvps = Table(
     Base.metadata,
     Column("user_id", Integer, ForeignKey("users.id"), primary_key=True),
     Column("event_post_id", Integer, ForeignKey("event_posts.id"), primary_key=True),
-    Column("created_at", DateTime(timezone=True), nullable=False, server_default=func.now())
+    Column("created_at", UTCDateTime, nullable=False, default=utcnow, server_default=func.now()),
+    Index("ix_event_rsvps_event_created_user", "event_post_id", "created_at", "user_id")
 )
 
 event_hosts = Table(
@@ -48,7 +75,29 @@ event_hosts = Table(
     Column("user_id", Integer, ForeignKey("users.id"), primary_key=True),
     Column("event_post_id", Integer, ForeignKey("event_posts.id"), primary_key=True),
     Column("role", EnumType(HostRole), server_default=HostRole.owner.value, nullable=False),
-    Column("created_at", DateTime(timezone=True), nullable=False, server_default=func.now())
+    Column("created_at", UTCDateTime, nullable=False, default=utcnow, server_default=func.now()),
+    # user_id lookups use the primary key, loading an event's hosts uses this
+    Index("ix_event_hosts_event", "event_post_id", "user_id")
+)
+
+# materialized home feed, filled on post creation for every follower (fan-out on write)
+timeline_entries = Table(
+    "timeline_entries",
+    Base.metadata,
+    Column("user_id", Integer, ForeignKey("users.id"), primary_key=True),
+    Column("post_id", Integer, ForeignKey("posts.id"), primary_key=True),
+    Column("author_id", Integer, ForeignKey("users.id"), nullable=False),
+    Column("created_at", UTCDateTime, nullable=False),
+    Index("ix_timeline_entries_user_created", "user_id", "created_at", "post_id"),
+    Index("ix_timeline_entries_user_author", "user_id", "author_id")
+)
+
+# authors with too many followers to fan out to, their posts are pulled at read time
+timeline_pull_authors = Table(
+    "timeline_pull_authors",
+    Base.metadata,
+    Column("user_id", Integer, ForeignKey("users.id"), primary_key=True),
+    Column("created_at", UTCDateTime, nullable=False, default=utcnow, server_default=func.now())
 )
 
  
@@ -64,7 +113,12 @@ class Users(Base):
     dob: Mapped[date] = mapped_column(Date, default=date.today, nullable=False)
     profile_photo_id: Mapped[int] = mapped_column(ForeignKey("photos.id"), nullable=True)
     bio: Mapped[str] = mapped_column(String(280), nullable=True)
-    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    created_at: Mapped[datetime] = mapped_column(UTCDateTime, default=utcnow, server_default=func.now(), nullable=False)
+    # denormalized counters kept in step by app.util.counters, `flask counters reconcile` repairs drift
+    post_count: Mapped[int] = mapped_column(Integer, nullable=False, default=0, server_default="0")
+    event_count: Mapped[int] = mapped_column(Integer, nullable=False, default=0, server_default="0")
+    follower_count: Mapped[int] = mapped_column(Integer, nullable=False, default=0, server_default="0")
+    following_count: Mapped[int] = mapped_column(Integer, nullable=False, default=0, server_default="0")
 
     posts: Mapped[list['Posts']] = relationship('Posts', back_populates='user')
 
@@ -87,12 +141,16 @@ class Photos(Base):
     __tablename__ = 'photos'
 
     id: Mapped[int] = mapped_column(primary_key=True)
-    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"))
-    post_id: Mapped[int] = mapped_column(ForeignKey("posts.id"), nullable=True)
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"), index=True)
+    post_id: Mapped[int] = mapped_column(ForeignKey("posts.id"), nullable=True, index=True)
     filename: Mapped[str] = mapped_column(String(255), nullable=False)
     content_type: Mapped[str] = mapped_column(String(100), nullable=False)
-    file_data: Mapped[bytes] = mapped_column(LargeBinary, nullable=False)
-    upload_date: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now())
+    content_hash: Mapped[str] = mapped_column(ForeignKey("photo_blobs.content_hash"), nullable=True, index=True)
+    size: Mapped[int] = mapped_column(Integer, nullable=True)
+    # legacy inline bytes, drained into the blob store by `flask photos drain-blobs`.
+    # Deferred so metadata reads (feeds, schemas) never pull them; serving routes undefer explicitly.
+    file_data: Mapped[bytes] = mapped_column(LargeBinary, nullable=True, deferred=True, deferred_raiseload=True)
+    upload_date: Mapped[datetime] = mapped_column(UTCDateTime, default=utcnow, server_default=func.now())
 
     user: Mapped['Users'] = relationship('Users', back_populates='photos', primaryjoin='Photos.user_id==Users.id', foreign_keys='Photos.user_id')
     post: Mapped['Posts'] = relationship('Posts', back_populates='photos', primaryjoin='Photos.post_id==Posts.id', foreign_keys='Photos.post_id')
@@ -105,6 +163,15 @@ class Photos(Base):
             'upload_date': self.upload_date.isoformat()
         }
 
+# one row per stored blob, shared by every Photos row with the same content
+class PhotoBlobs(Base):
+    __tablename__ = 'photo_blobs'
+
+    content_hash: Mapped[str] = mapped_column(String(64), primary_key=True)
+    size: Mapped[int] = mapped_column(Integer, nullable=False)
+    ref_count: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    created_at: Mapped[datetime] = mapped_column(UTCDateTime, default=utcnow, server_default=func.now(), nullable=False)
+
 class Posts(Base):
     __tablename__ = 'posts'
 
@@ -112,7 +179,13 @@ class Posts(Base):
     user_id: Mapped[int] = mapped_column(Integer, ForeignKey('users.id'), nullable=False)
     caption: Mapped[str] = mapped_column(String(1000), nullable=True)
     location: Mapped[str] = mapped_column(String(200), nullable=True)
-    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    created_at: Mapped[datetime] = mapped_column(UTCDateTime, default=utcnow, server_default=func.now(), nullable=False)
+    like_count: Mapped[int] = mapped_column(Integer, nullable=False, default=0, server_default="0")
+    comment_count: Mapped[int] = mapped_column(Integer, nullable=False, default=0, server_default="0")
+
+    __table_args__ = (
+        Index("ix_posts_user_created", "user_id", "created_at", "id"),
+    )
 
     user: Mapped['Users'] = relationship('Users', back_populates='posts')
 
@@ -129,7 +202,11 @@ class Comments(Base):
     user_id: Mapped[int] = mapped_column(Integer, ForeignKey('users.id'), nullable=False)
     post_id: Mapped[int] = mapped_column(Integer, ForeignKey('posts.id'), nullable=False)
     comment: Mapped[str] = mapped_column(String(1000), nullable=False)
-    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    created_at: Mapped[datetime] = mapped_column(UTCDateTime, default=utcnow, server_default=func.now(), nullable=False)
+
+    __table_args__ = (
+        Index("ix_comments_post_created", "post_id", "created_at", "id"),
+    )
 
     user: Mapped['Users'] = relationship('Users', back_populates='comments')
     post: Mapped['Posts'] = relationship('Posts', back_populates='comments')
@@ -141,13 +218,28 @@ class EventPosts(Base):
     cover_photo_id: Mapped[int] = mapped_column(ForeignKey("photos.id"), nullable=True)
     title: Mapped[str] = mapped_column(String(150), nullable=False)
     description: Mapped[str] = mapped_column(String(2000), nullable=False)
-    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now(), nullable=False)
-    start_time: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)
+    created_at: Mapped[datetime] = mapped_column(UTCDateTime, default=utcnow, server_default=func.now(), nullable=False)
+    start_time: Mapped[datetime] = mapped_column(UTCDateTime, nullable=False)
     street_address: Mapped[str] = mapped_column(String(200))
     city: Mapped[str] = mapped_column(String(100), nullable=False)
     state: Mapped[str] = mapped_column(String(150), nullable=False)
     zipcode: Mapped[str] = mapped_column(String(10), nullable=False)
     country: Mapped[str] = mapped_column(String(200), nullable=False)
+    attendee_count: Mapped[int] = mapped_column(Integer, nullable=False, default=0, server_default="0")
+    # normalized copies of country/state/city and a geohash of the coordinates, set by app.util.locations
+    country_key: Mapped[str] = mapped_column(String(200), nullable=True)
+    state_key: Mapped[str] = mapped_column(String(150), nullable=True)
+    city_key: Mapped[str] = mapped_column(String(100), nullable=True)
+    latitude: Mapped[float] = mapped_column(Float, nullable=True)
+    longitude: Mapped[float] = mapped_column(Float, nullable=True)
+    geohash: Mapped[str] = mapped_column(String(12), nullable=True)
+
+    __table_args__ = (
+        Index("ix_event_posts_start", "start_time", "id"),
+        Index("ix_event_posts_location_start", "country_key", "state_key", "city_key", "start_time"),
+        Index("ix_event_posts_zipcode_start", "zipcode", "start_time", postgresql_ops={"zipcode": "text_pattern_ops"}),
+        Index("ix_event_posts_geohash", "geohash", postgresql_ops={"geohash": "text_pattern_ops"}),
+    )
 
     hosts: Mapped[list['Users']] = relationship('Users', secondary=event_hosts, back_populates='hosted_events')
     attendees: Mapped[list['Users']] = relationship('Users', secondary=event_rsvps, back_populates='rsvps')
@@ -47,3 +47,17 @@ def token_required(f):
     
     return decorations
 
+
+def optional_user_id():
+    """User id from a valid Bearer token, None for anonymous requests or bad tokens."""
+    auth = request.headers.get("Authorization", "")
+    if not auth.startswith("Bearer "):
+        return None
+    token = auth.split(" ", 1)[1].strip()
+    if not token:
+        return None
+    try:
+        data = jwt.decode(token, SECRET_KEY, algorithms=['HS256'])
+        return int(data['sub'])
+    except (jose.exceptions.JWTError, KeyError, TypeError, ValueError):
+        return None
@@ -0,0 +1,142 @@
+import hashlib
+import io
+import os
+import tempfile
+from abc import ABC, abstractmethod
+from flask import current_app
+
+CHUNK_SIZE = 64 * 1024
+
+
+class BlobTooLarge(Exception):
+    pass
+
+
+class BlobStore(ABC):
+    """Content-addressed storage for photo bytes, keyed by sha256 hex digest."""
+
+    @abstractmethod
+    def put(self, stream, max_bytes=None):
+        """Store everything readable from `stream`, returns (content_hash, size).
+
+        Raises BlobTooLarge, without keeping anything, once more than `max_bytes` were read.
+        """
+
+    def put_bytes(self, data):
+        return self.put(io.BytesIO(data))
+
+    @abstractmethod
+    def open(self, content_hash):
+        pass
+
+    def path(self, content_hash):
+        """Real filesystem path for zero-copy serving, or None if the backend has none."""
+        return None
+
+    @abstractmethod
+    def exists(self, content_hash):
+        pass
+
+    @abstractmethod
+    def delete(self, content_hash):
+        pass
+
+
+class LocalBlobStore(BlobStore):
+    """Blobs on local disk under `root/ab/cd/abcd...`."""
+
+    def __init__(self, root):
+        self.root = root
+        self.tmp_dir = os.path.join(root, "tmp")
+        os.makedirs(self.tmp_dir, exist_ok=True)
+
+    def _path(self, content_hash):
+        return os.path.join(self.root, content_hash[:2], content_hash[2:4], content_hash)
+
+    def put(self, stream, max_bytes=None):
+        hasher = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=self.tmp_dir)
+        try:
+            with os.fdopen(fd, "wb") as out:
+                while True:
+                    chunk = stream.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    if max_bytes is not None and size > max_bytes:
+                        raise BlobTooLarge(f"Blob exceeds {max_bytes} bytes")
+                    hasher.update(chunk)
+                    out.write(chunk)
+
+            content_hash = hasher.hexdigest()
+            dest = self._path(content_hash)
+            if os.path.exists(dest):
+                os.remove(tmp_path)
+            else:
+                os.makedirs(os.path.dirname(dest), exist_ok=True)
+                os.replace(tmp_path, dest)
+            return content_hash, size
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def open(self, content_hash):
+        return open(self._path(content_hash), "rb")
+
+    def path(self, content_hash):
+        return self._path(content_hash)
+
+    def exists(self, content_hash):
+        return os.path.exists(self._path(content_hash))
+
+    def delete(self, content_hash):
+        try:
+            os.remove(self._path(content_hash))
+        except FileNotFoundError:
+            pass
+
+
+BACKENDS = {
+    "local": lambda config: LocalBlobStore(config["BLOB_STORE_PATH"]),
+}
+
+
+class BlobStorage:
+    """Flask extension holding the configured BlobStore backend."""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("BLOB_STORE_BACKEND", "local")
+        app.config.setdefault("BLOB_STORE_PATH", os.path.join(app.instance_path, "blobs"))
+
+        backend = app.config["BLOB_STORE_BACKEND"]
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown BLOB_STORE_BACKEND '{backend}'")
+        app.extensions["blob_store"] = BACKENDS[backend](app.config)
+
+    @property
+    def backend(self):
+        return current_app.extensions["blob_store"]
+
+    def put(self, stream, max_bytes=None):
+        return self.backend.put(stream, max_bytes=max_bytes)
+
+    def put_bytes(self, data):
+        return self.backend.put_bytes(data)
+
+    def open(self, content_hash):
+        return self.backend.open(content_hash)
+
+    def path(self, content_hash):
+        return self.backend.path(content_hash)
+
+    def exists(self, content_hash):
+        return self.backend.exists(content_hash)
+
+    def delete(self, content_hash):
+        return self.backend.delete(content_hash)
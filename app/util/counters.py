@@ -0,0 +1,81 @@
+from sqlalchemy import select, update, func, or_
+from app.models import db, Users, Posts, Comments, EventPosts, follows, post_likes, event_rsvps, event_hosts
+
+
+def adjust(model, row_id, **deltas):
+    """Add `deltas` to counter columns of one row.
+
+    The arithmetic runs in the UPDATE itself, so concurrent requests never
+    overwrite each other's increments, and it commits or rolls back together
+    with the write that caused it.
+    """
+    db.session.execute(
+        update(model)
+        .where(model.id == row_id)
+        .values({name: getattr(model, name) + delta for name, delta in deltas.items()})
+        .execution_options(synchronize_session=False)
+    )
+
+
+def _count(table, column, owner):
+    return select(func.count()).select_from(table).where(column == owner).scalar_subquery()
+
+
+def user_counts():
+    return {
+        "post_count": select(func.count()).select_from(Posts).where(Posts.user_id == Users.id).scalar_subquery(),
+        "event_count": _count(event_hosts, event_hosts.c.user_id, Users.id),
+        "follower_count": _count(follows, follows.c.followed_id, Users.id),
+        "following_count": _count(follows, follows.c.follower_id, Users.id),
+    }
+
+
+def post_counts():
+    return {
+        "like_count": _count(post_likes, post_likes.c.post_id, Posts.id),
+        "comment_count": select(func.count()).select_from(Comments).where(Comments.post_id == Posts.id).scalar_subquery(),
+    }
+
+
+def event_counts():
+    return {
+        "attendee_count": _count(event_rsvps, event_rsvps.c.event_post_id, EventPosts.id),
+    }
+
+
+COUNTERS = (
+    (Users, user_counts),
+    (Posts, post_counts),
+    (EventPosts, event_counts),
+)
+
+
+def recount(model, counts, ids=None):
+    """Recompute counters from the source tables, only rows that drifted are written.
+
+    Returns the number of rows that were corrected. `ids` limits the recount
+    to those rows, None recounts the whole table in one UPDATE.
+    """
+    stmt = (
+        update(model)
+        .where(or_(*[getattr(model, name) != expr for name, expr in counts.items()]))
+        .values(counts)
+        .execution_options(synchronize_session=False)
+    )
+    if ids is not None:
+        if not ids:
+            return 0
+        stmt = stmt.where(model.id.in_(ids))
+    return db.session.execute(stmt).rowcount
+
+
+def recount_users(ids=None):
+    return recount(Users, user_counts(), ids)
+
+
+def recount_posts(ids=None):
+    return recount(Posts, post_counts(), ids)
+
+
+def recount_events(ids=None):
+    return recount(EventPosts, event_counts(), ids)
@@ -0,0 +1,69 @@
+from flask import request
+from sqlalchemy import inspect
+from sqlalchemy.orm import load_only
+
+#restricted schemas kept around, each distinct ?fields= value makes one per schema
+MAX_SPARSE_SCHEMAS = 256
+
+_sparse_schemas = {}
+
+
+class InvalidFieldset(ValueError):
+    pass
+
+
+def requested_fields(schema, extra=(), default=None):
+    """Field names asked for with ?fields=a,b,c, `default` when there are none.
+
+    `id` is always included. `extra` names keys a route adds on top of the
+    schema, like the viewer's follow flags. Unknown names raise InvalidFieldset.
+    A None result means every field is wanted.
+    """
+    raw = request.args.get("fields")
+    if raw is None or not raw.strip():
+        return default
+    names = {name.strip() for name in raw.split(",") if name.strip()}
+    unknown = names - schema.dump_fields.keys() - set(extra)
+    if unknown:
+        raise InvalidFieldset(f"Unknown fields: {', '.join(sorted(unknown))}")
+    return frozenset(names | {"id"})
+
+
+def wants(fields, name):
+    return fields is None or name in fields
+
+
+def sparse(schema, fields):
+    """`schema` restricted to `fields`, the same instance for the same fields."""
+    if fields is None:
+        return schema
+    key = (id(schema), fields)
+    restricted = _sparse_schemas.get(key)
+    if restricted is None:
+        if len(_sparse_schemas) >= MAX_SPARSE_SCHEMAS:
+            _sparse_schemas.clear()
+        only = sorted(fields & schema.dump_fields.keys())
+        restricted = _sparse_schemas[key] = type(schema)(many=schema.many, only=only)
+    return restricted
+
+
+def projection(model, schema, fields, *required):
+    """load_only() option for the columns of `model` that `fields` of `schema` read.
+
+    Computed fields declare theirs in metadata["columns"], a relationship
+    needs its local columns to load. `required` are columns the route reads
+    itself. Anything else raises if touched instead of lazy loading per row.
+    Returns an empty list when every field is wanted.
+    """
+    if fields is None:
+        return []
+    mapper = inspect(model)
+    names = set(required)
+    for name in fields & schema.dump_fields.keys():
+        field = schema.dump_fields[name]
+        for attr in field.metadata.get("columns", (field.attribute or name,)):
+            if attr in mapper.column_attrs:
+                names.add(attr)
+            elif attr in mapper.relationships:
+                names.update(mapper.get_property_by_column(column).key for column in mapper.relationships[attr].local_columns)
+    return [load_only(*[getattr(model, name) for name in sorted(names)], raiseload=True)]
@@ -0,0 +1,156 @@
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from flask import current_app
+
+CachedImage = namedtuple("CachedImage", "data etag mimetype filename last_modified version")
+
+
+class LRUImageCache:
+    """Image bytes keyed by (photo_id, width), evicted least-recently-used past `budget` bytes.
+
+    Also remembers which photo is each user's avatar so avatar hits skip the
+    database entirely. Every gunicorn worker has its own copy and only sees
+    its own invalidations, so entries expire after `ttl` seconds to bound how
+    long another worker can serve a replaced or deleted image.
+    """
+
+    def __init__(self, budget, max_item, ttl):
+        self.budget = budget
+        self.max_item = max_item
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._avatars = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        #avatar pointer lookups, kept apart so each image lookup is counted once
+        self.avatar_hits = 0
+        self.avatar_misses = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] < time.monotonic():
+                if entry is not None:
+                    self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, image):
+        size = len(image.data)
+        if size > self.max_item or size > self.budget:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (image, time.monotonic() + self.ttl)
+            self._bytes += size
+            while self._bytes > self.budget:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def _remove(self, key):
+        image, _ = self._entries.pop(key)
+        self._bytes -= len(image.data)
+
+    def avatar_photo_id(self, user_id):
+        with self._lock:
+            entry = self._avatars.get(user_id)
+            if entry is None or entry[1] < time.monotonic():
+                self.avatar_misses += 1
+                return None
+            self.avatar_hits += 1
+            return entry[0]
+
+    def set_avatar(self, user_id, photo_id):
+        with self._lock:
+            self._avatars[user_id] = (photo_id, time.monotonic() + self.ttl)
+            self._avatars.move_to_end(user_id)
+            #pointers are tiny, just keep their number in line with the entries
+            while len(self._avatars) > max(len(self._entries), 1024):
+                self._avatars.popitem(last=False)
+
+    def invalidate_photo(self, *photo_ids):
+        photo_ids = set(photo_ids)
+        with self._lock:
+            for key in [key for key in self._entries if key[0] in photo_ids]:
+                self._remove(key)
+
+    def invalidate_avatar(self, user_id):
+        with self._lock:
+            entry = self._avatars.pop(user_id, None)
+        if entry is not None:
+            self.invalidate_photo(entry[0])
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._avatars.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else None,
+                "avatar_hits": self.avatar_hits,
+                "avatar_misses": self.avatar_misses,
+                "entries": len(self._entries),
+                "avatars": len(self._avatars),
+                "bytes": self._bytes,
+                "budget": self.budget,
+            }
+
+
+class ImageCache:
+    """Flask extension holding the per-process hot image cache."""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("IMAGE_CACHE_BUDGET", 64 * 1024 * 1024)
+        app.config.setdefault("IMAGE_CACHE_MAX_ITEM", 1024 * 1024)
+        app.config.setdefault("IMAGE_CACHE_TTL", 300)
+
+        app.extensions["image_cache"] = LRUImageCache(
+            app.config["IMAGE_CACHE_BUDGET"],
+            app.config["IMAGE_CACHE_MAX_ITEM"],
+            app.config["IMAGE_CACHE_TTL"],
+        )
+
+    @property
+    def backend(self):
+        return current_app.extensions["image_cache"]
+
+    def get(self, key):
+        return self.backend.get(key)
+
+    def put(self, key, image):
+        self.backend.put(key, image)
+
+    def avatar_photo_id(self, user_id):
+        return self.backend.avatar_photo_id(user_id)
+
+    def set_avatar(self, user_id, photo_id):
+        self.backend.set_avatar(user_id, photo_id)
+
+    def invalidate_photo(self, *photo_ids):
+        self.backend.invalidate_photo(*photo_ids)
+
+    def invalidate_avatar(self, user_id):
+        self.backend.invalidate_avatar(user_id)
+
+    def stats(self):
+        return self.backend.stats()
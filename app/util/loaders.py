@@ -0,0 +1,127 @@
+from sqlalchemy import select
+from sqlalchemy.orm import joinedload, selectinload, raiseload
+from app.models import db, Users, Posts, Comments, EventPosts, post_likes, event_rsvps
+from app.util.fieldsets import wants
+
+#columns behind AUTHOR_FIELDS, all an embedded author or host needs
+AUTHOR_COLUMNS = (Users.id, Users.username, Users.first_name, Users.last_name, Users.profile_photo_id)
+
+
+def post_options(fields=None):
+    """Loader options that fetch everything PostSchema dumps in a fixed number of queries.
+
+    The author is joined onto the post query and photos come from one IN
+    query however many posts are on the page. Likes and comments are only
+    exposed as the counter columns plus annotate_posts(). Anything else stays
+    unloaded and raises instead of lazy loading per post. With ?fields=
+    relationships that weren't asked for aren't loaded at all.
+    """
+    options = []
+    if wants(fields, "user"):
+        options.append(joinedload(Posts.user).load_only(*AUTHOR_COLUMNS))
+    if wants(fields, "photos"):
+        options.append(selectinload(Posts.photos))
+    return options + [raiseload("*")]
+
+
+def posts_query(fields=None):
+    return select(Posts).options(*post_options(fields))
+
+
+def load_post(post_id):
+    return db.session.get(Posts, post_id, options=post_options())
+
+
+def load_posts(post_ids, *options, fields=None):
+    """Posts for `post_ids` in the same order, ids that no longer exist are skipped."""
+    if not post_ids:
+        return []
+    posts = db.session.execute(posts_query(fields).options(*options).where(Posts.id.in_(post_ids))).unique().scalars().all()
+    by_id = {post.id: post for post in posts}
+    return [by_id[post_id] for post_id in post_ids if post_id in by_id]
+
+
+def liked_post_ids(viewer_id, post_ids):
+    if not viewer_id or not post_ids:
+        return set()
+    return set(db.session.execute(
+        select(post_likes.c.post_id)
+        .where(post_likes.c.user_id == viewer_id, post_likes.c.post_id.in_(post_ids))
+    ).scalars().all())
+
+
+def annotate_posts(posts, viewer_id=None):
+    """Set liked_by_me on `posts` with one query for the whole page.
+
+    like_count and comment_count are counter columns on the post itself.
+    """
+    liked = liked_post_ids(viewer_id, [post.id for post in posts])
+    for post in posts:
+        post.liked_by_me = post.id in liked
+    return posts
+
+
+def annotate_post_dicts(items, viewer_id=None):
+    """annotate_posts() for serialized posts, e.g. ones from the response cache."""
+    liked = liked_post_ids(viewer_id, [item["id"] for item in items])
+    for item in items:
+        item["liked_by_me"] = item["id"] in liked
+    return items
+
+
+def event_options(fields=None):
+    """Loader options for EventPostSchema, hosts and cover photo in one IN query each."""
+    options = []
+    if wants(fields, "hosts"):
+        options.append(selectinload(EventPosts.hosts).load_only(*AUTHOR_COLUMNS))
+    if wants(fields, "cover_photo"):
+        options.append(selectinload(EventPosts.cover_photo))
+    return options + [raiseload("*")]
+
+
+def events_query(fields=None):
+    return select(EventPosts).options(*event_options(fields))
+
+
+def load_event(event_post_id):
+    return db.session.get(EventPosts, event_post_id, options=event_options())
+
+
+def rsvped_event_ids(viewer_id, event_ids):
+    if not viewer_id or not event_ids:
+        return set()
+    return set(db.session.execute(
+        select(event_rsvps.c.event_post_id)
+        .where(event_rsvps.c.user_id == viewer_id, event_rsvps.c.event_post_id.in_(event_ids))
+    ).scalars().all())
+
+
+def annotate_events(events, viewer_id=None):
+    """Set rsvped_by_me on `events` with one query for the whole page.
+
+    attendee_count is a counter column on the event itself.
+    """
+    rsvped = rsvped_event_ids(viewer_id, [event.id for event in events])
+    for event in events:
+        event.rsvped_by_me = event.id in rsvped
+    return events
+
+
+def annotate_event_dicts(items, viewer_id=None):
+    """annotate_events() for serialized events."""
+    rsvped = rsvped_event_ids(viewer_id, [item["id"] for item in items])
+    for item in items:
+        item["rsvped_by_me"] = item["id"] in rsvped
+    return items
+
+
+def comment_options(fields=None):
+    """Authors for a page of comments in one IN query, only the columns CommentSchema dumps."""
+    options = []
+    if wants(fields, "user"):
+        options.append(selectinload(Comments.user).load_only(Users.id, Users.username, Users.profile_photo_id))
+    return options + [raiseload("*")]
+
+
+def comments_query(fields=None):
+    return select(Comments).options(*comment_options(fields))
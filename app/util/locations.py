@@ -0,0 +1,141 @@
+import math
+from sqlalchemy import event, select, func, or_
+from app.models import db, EventPosts
+from app.util.search import prefix_match
+
+GEOHASH_PRECISION = 9
+#most cells a radius or box search expands to, beyond that it only filters on coordinates
+MAX_CELLS = 16
+KM_PER_DEGREE = 111.32
+MAX_RADIUS_KM = 500
+_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+
+def normalize(value):
+    """Comparison key for a place name, case and whitespace insensitive."""
+    return " ".join((value or "").split()).casefold() or None
+
+
+def geohash(latitude, longitude, precision=GEOHASH_PRECISION):
+    lat_range, lng_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars, bits, bit_count, even = [], 0, 0, True
+    while len(chars) < precision:
+        #bits alternate between longitude and latitude, longitude first
+        value, span = (longitude, lng_range) if even else (latitude, lat_range)
+        mid = (span[0] + span[1]) / 2
+        if value >= mid:
+            bits = bits * 2 + 1
+            span[0] = mid
+        else:
+            bits = bits * 2
+            span[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(_BASE32[bits])
+            bits, bit_count = 0, 0
+    return "".join(chars)
+
+
+def location_keys(event_post):
+    """Normalized place names and geohash for `event_post`, as column values."""
+    has_point = event_post.latitude is not None and event_post.longitude is not None
+    return {
+        "country_key": normalize(event_post.country),
+        "state_key": normalize(event_post.state),
+        "city_key": normalize(event_post.city),
+        "geohash": geohash(event_post.latitude, event_post.longitude) if has_point else None,
+    }
+
+
+def _set_location_keys(mapper, connection, target):
+    for name, value in location_keys(target).items():
+        setattr(target, name, value)
+
+
+event.listen(EventPosts, "before_insert", _set_location_keys)
+event.listen(EventPosts, "before_update", _set_location_keys)
+
+
+def _cell_size(precision):
+    bits = 5 * precision
+    return 180.0 / (1 << (bits // 2)), 360.0 / (1 << ((bits + 1) // 2))
+
+
+def covering_cells(min_lat, min_lng, max_lat, max_lng):
+    """Geohash prefixes whose cells together cover the box, [] when that takes over MAX_CELLS."""
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        height, width = _cell_size(precision)
+        first_row, last_row = math.floor((min_lat + 90) / height), math.floor((max_lat + 90) / height)
+        first_col, last_col = math.floor((min_lng + 180) / width), math.floor((max_lng + 180) / width)
+        if (last_row - first_row + 1) * (last_col - first_col + 1) <= MAX_CELLS:
+            break
+    else:
+        return []
+
+    cells = set()
+    for row in range(first_row, last_row + 1):
+        for col in range(first_col, last_col + 1):
+            lat = min((row + 0.5) * height - 90, 90.0)
+            lng = min((col + 0.5) * width - 180, 180.0)
+            cells.add(geohash(lat, lng, precision))
+    return sorted(cells)
+
+
+def within_box(stmt, min_lat, min_lng, max_lat, max_lng):
+    """Events with coordinates inside the box. Boxes don't wrap the antimeridian."""
+    min_lat, max_lat = max(min_lat, -90.0), min(max_lat, 90.0)
+    min_lng, max_lng = max(min_lng, -180.0), min(max_lng, 180.0)
+    cells = covering_cells(min_lat, min_lng, max_lat, max_lng)
+    if cells:
+        #each cell is a range scan on the geohash index, the coordinates trim the cell edges
+        stmt = stmt.where(or_(*[prefix_match(EventPosts.geohash, cell) for cell in cells]))
+    return stmt.where(
+        EventPosts.latitude.between(min_lat, max_lat),
+        EventPosts.longitude.between(min_lng, max_lng),
+    )
+
+
+def within_radius(stmt, latitude, longitude, radius_km):
+    """Events within `radius_km` of the point.
+
+    Distance is the equirectangular approximation, plain arithmetic that
+    sqlite can evaluate without math functions and well within a percent
+    at event search radii.
+    """
+    dlat = radius_km / KM_PER_DEGREE
+    scale = max(math.cos(math.radians(latitude)), 0.01)
+    dlng = dlat / scale
+    stmt = within_box(stmt, latitude - dlat, longitude - dlng, latitude + dlat, longitude + dlng)
+    north = EventPosts.latitude - latitude
+    east = (EventPosts.longitude - longitude) * scale
+    return stmt.where(north * north + east * east <= dlat * dlat)
+
+
+def location_facets(stmt, limit=50):
+    """Result counts per city and per state for the events `stmt` selects, from one grouped query."""
+    matches = stmt.order_by(None).subquery()
+    rows = db.session.execute(
+        select(
+            matches.c.country_key, matches.c.state_key, matches.c.city_key,
+            func.max(matches.c.country), func.max(matches.c.state), func.max(matches.c.city),
+            func.count(),
+        )
+        .group_by(matches.c.country_key, matches.c.state_key, matches.c.city_key)
+    ).all()
+
+    cities, states = [], {}
+    for country_key, state_key, city_key, country, state, city, count in rows:
+        #one spelling of each place labels the facet, tidied the way normalize() sees it
+        country, state, city = (" ".join((value or "").split()) for value in (country, state, city))
+        cities.append({"city": city, "state": state, "country": country, "count": count})
+        entry = states.setdefault((country_key, state_key), {"state": state, "country": country, "count": 0})
+        entry["count"] += count
+
+    def by_count(facet):
+        return -facet["count"], facet.get("city") or "", facet["state"] or ""
+
+    return {
+        "cities": sorted(cities, key=by_count)[:limit],
+        "states": sorted(states.values(), key=by_count)[:limit],
+    }
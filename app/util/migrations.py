@@ -0,0 +1,135 @@
+from sqlalchemy import Table, Column, Integer, String, DateTime, MetaData, inspect, select, text, func
+from app.models import Base, UTCDateTime, Posts, Comments, Photos, PhotoBlobs, EventPosts, follows, post_likes, event_rsvps, event_hosts
+from app.util.counters import COUNTERS
+from app.util.search import INDEXED_COLUMNS, has_search_index, rebuild_search_index
+
+#kept out of Base.metadata so create_all() alone never marks a database as migrated
+schema_version = Table(
+    "schema_version",
+    MetaData(),
+    Column("version", Integer, primary_key=True),
+    Column("name", String(100), nullable=False),
+    Column("applied_at", DateTime(timezone=True), nullable=False, server_default=func.now())
+)
+
+
+def _add_columns(conn, table, names):
+    #create_all() creates missing tables but never adds columns to existing ones
+    existing = {c["name"] for c in inspect(conn).get_columns(table.name)}
+    for name in names:
+        if name not in existing:
+            column_type = table.c[name].type.compile(dialect=conn.dialect)
+            default = table.c[name].server_default
+            suffix = f" NOT NULL DEFAULT {default.arg}" if default is not None and not table.c[name].nullable else ""
+            conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {name} {column_type}{suffix}"))
+
+
+def _add_indexes(conn, *tables):
+    for table in tables:
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
+
+
+def add_photo_blob_columns(conn):
+    PhotoBlobs.__table__.create(conn, checkfirst=True)
+    _add_columns(conn, Photos.__table__, ("content_hash", "size"))
+
+
+def add_counter_columns(conn):
+    for model, counts in COUNTERS:
+        _add_columns(conn, model.__table__, list(counts()))
+
+
+def add_event_location_columns(conn):
+    _add_columns(conn, EventPosts.__table__, ("country_key", "state_key", "city_key", "latitude", "longitude", "geohash"))
+    _add_indexes(conn, EventPosts.__table__)
+
+
+def add_search_indexes(conn):
+    #an index created after the fact starts out empty, rebuilding fills it from the table
+    for name in INDEXED_COLUMNS:
+        if not has_search_index(conn, name):
+            rebuild_search_index(conn, name)
+
+
+def add_hot_query_indexes(conn):
+    _add_indexes(
+        conn,
+        Posts.__table__, Comments.__table__, Photos.__table__, EventPosts.__table__,
+        follows, post_likes, event_rsvps, event_hosts,
+    )
+
+
+def uniform_sqlite_timestamps(conn):
+    #rows written by the func.now() server default lack the fraction the driver writes,
+    #text order needs one format. Other databases store real timestamps.
+    if conn.dialect.name != "sqlite":
+        return
+    existing = set(inspect(conn).get_table_names())
+    for table in Base.metadata.tables.values():
+        if table.name not in existing:
+            continue
+        for column in table.c:
+            if isinstance(column.type, UTCDateTime):
+                conn.execute(text(
+                    f"UPDATE {table.name} SET {column.name} = {column.name} || '.000000' WHERE length({column.name}) = 19"
+                ))
+
+
+def add_like_and_rsvp_order_indexes(conn):
+    #the indexes now end in user_id, pages order by it after created_at without a sort
+    for name in ("ix_post_likes_post_created", "ix_event_rsvps_event_created"):
+        conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
+    _add_indexes(conn, post_likes, event_rsvps)
+
+
+#append only, a released version number never changes meaning. Every step
+#checks before it alters, so databases made by create_all() pass through them unchanged.
+MIGRATIONS = [
+    (1, "photo blob columns", add_photo_blob_columns),
+    (2, "counter columns", add_counter_columns),
+    (3, "event location columns", add_event_location_columns),
+    (4, "full-text search indexes", add_search_indexes),
+    (5, "hot query indexes", add_hot_query_indexes),
+    (6, "uniform sqlite timestamps", uniform_sqlite_timestamps),
+    (7, "like and rsvp order indexes", add_like_and_rsvp_order_indexes),
+]
+
+
+def applied_versions(bind):
+    if not inspect(bind).has_table(schema_version.name):
+        return set()
+    with bind.connect() as conn:
+        return set(conn.execute(select(schema_version.c.version)).scalars().all())
+
+
+def pending_migrations(bind):
+    applied = applied_versions(bind)
+    return [migration for migration in MIGRATIONS if migration[0] not in applied]
+
+
+def upgrade(bind, target=None, echo=None):
+    """Create missing tables, then apply pending migrations up to `target` in order.
+
+    Each migration commits in its own transaction together with its
+    schema_version row, so a failure leaves the earlier ones recorded.
+    Returns the versions applied.
+    """
+    Base.metadata.create_all(bind)
+    schema_version.create(bind, checkfirst=True)
+
+    done = []
+    for version, name, step in pending_migrations(bind):
+        if target is not None and version > target:
+            break
+        with bind.begin() as conn:
+            step(conn)
+            conn.execute(schema_version.insert().values(version=version, name=name))
+        done.append(version)
+        if echo:
+            echo(f"Applied {version}: {name}")
+    return done
+
+
+def current_version(bind):
+    return max(applied_versions(bind), default=0)
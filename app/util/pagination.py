@@ -0,0 +1,142 @@
+import base64
+import hashlib
+import json
+from datetime import datetime
+from flask import current_app, request
+from sqlalchemy import select, func, tuple_, DateTime
+from app.models import db, UTCDateTime
+from app.extensions import cache
+
+DEFAULT_TOTAL_TTL = 60
+TRUTHY = ("1", "true", "yes")
+
+
+class InvalidPageRequest(ValueError):
+    pass
+
+
+def encode_cursor(values):
+    values = [v.isoformat() if isinstance(v, datetime) else v for v in values]
+    raw = json.dumps(values, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor, keys):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(raw)
+    except (ValueError, TypeError):
+        raise InvalidPageRequest("Invalid cursor")
+    if not isinstance(values, list) or len(values) != len(keys):
+        raise InvalidPageRequest("Invalid cursor")
+    try:
+        return [
+            datetime.fromisoformat(v) if isinstance(key.type, (DateTime, UTCDateTime)) and v is not None else v
+            for key, v in zip(keys, values)
+        ]
+    except (TypeError, ValueError):
+        raise InvalidPageRequest("Invalid cursor")
+
+
+class PageRequest:
+    """Paging arguments from the query string.
+
+    `cursor` continues after the last row of a previous page. `page` is the
+    legacy offset mode and always reports totals, `include_total=1` asks for
+    them in cursor mode too.
+    """
+
+    def __init__(self, per_page, max_per_page=50):
+        args = request.args
+        self.cursor = args.get("cursor") or None
+
+        try:
+            self.per_page = min(max(int(args.get("per_page", per_page)), 1), max_per_page)
+        except ValueError:
+            self.per_page = per_page
+
+        self.page = None
+        if self.cursor is None and args.get("page") not in (None, ""):
+            try:
+                self.page = max(int(args.get("page")), 1)
+            except ValueError:
+                self.page = 1
+
+        self.include_total = self.page is not None or (args.get("include_total") or "").lower() in TRUTHY
+
+    @property
+    def offset(self):
+        return (self.page - 1) * self.per_page if self.page else 0
+
+    def response(self, items, next_cursor, total=None):
+        data = {
+            "items": items,
+            "per_page": self.per_page,
+            "next_cursor": next_cursor,
+            "has_more": next_cursor is not None,
+        }
+        if self.page is not None:
+            data["page"] = self.page
+        if total is not None:
+            data["total"] = total
+            data["pages"] = -(-total // self.per_page)
+        return data
+
+
+def cached_total(stmt, ttl=None):
+    """COUNT(*) of `stmt`, cached per endpoint and filter arguments.
+
+    Totals are only informational, so a count up to PAGINATION_TOTAL_TTL
+    seconds old is served instead of counting on every page.
+    """
+    ignored = {"cursor", "page", "per_page", "include_total"}
+    args = sorted((k, v) for k, v in request.args.items(multi=True) if k not in ignored)
+    viewer = getattr(request, "user_id", None)
+    digest = hashlib.sha1(json.dumps([request.path, viewer, args]).encode()).hexdigest()
+    key = f"page_total:{digest}"
+
+    total = cache.get(key)
+    if total is None:
+        total = db.session.execute(
+            select(func.count()).select_from(stmt.order_by(None).subquery())
+        ).scalar()
+        cache.set(key, total, timeout=ttl or current_app.config.get("PAGINATION_TOTAL_TTL", DEFAULT_TOTAL_TTL))
+    return total
+
+
+def keyset_page(stmt, keys, page_request, descending=True):
+    """Run one page of `stmt` ordered by `keys`, returns (rows, next_cursor).
+
+    `keys` must end in a unique column so the order is total. Rows are plain
+    values for single-entity or single-column selects and tuples otherwise.
+    """
+    single = len(stmt.column_descriptions) == 1
+
+    if page_request.cursor:
+        values = decode_cursor(page_request.cursor, keys)
+        row_key = tuple_(*keys)
+        stmt = stmt.where(row_key < tuple_(*values) if descending else row_key > tuple_(*values))
+
+    stmt = (
+        stmt.add_columns(*keys)
+        .order_by(None)
+        .order_by(*[key.desc() if descending else key.asc() for key in keys])
+        .limit(page_request.per_page + 1)
+    )
+    if page_request.page:
+        stmt = stmt.offset(page_request.offset)
+
+    result = db.session.execute(stmt).all()
+    has_more = len(result) > page_request.per_page
+    result = result[:page_request.per_page]
+
+    next_cursor = encode_cursor(list(result[-1][-len(keys):])) if has_more else None
+    rows = [row[0] if single else tuple(row[:-len(keys)]) for row in result]
+    return rows, next_cursor
+
+
+def paginate(stmt, keys, page_request, descending=True):
+    """keyset_page() plus the optional cached total, returns (rows, next_cursor, total)."""
+    rows, next_cursor = keyset_page(stmt, keys, page_request, descending)
+    total = cached_total(stmt) if page_request.include_total else None
+    return rows, next_cursor, total
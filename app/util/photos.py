@@ -0,0 +1,391 @@
+import io
+import os
+import hashlib
+from collections import Counter
+from datetime import timezone
+from flask import send_file, request, url_for, current_app, g, has_app_context, has_request_context
+from sqlalchemy import select, update, delete, event
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from werkzeug.utils import secure_filename
+from app.models import db, Photos, PhotoBlobs
+from app.util.variants import variant_format
+from app.util.blob_store import BlobTooLarge
+from app.util.image_cache import CachedImage
+from app.extensions import blob_store, photo_variants, hot_images
+
+#photo bytes never change for a given version, so versioned urls can be cached forever
+IMMUTABLE_MAX_AGE = 31536000
+
+DEFAULT_PHOTO_MAX_BYTES = 15 * 1024 * 1024
+DEFAULT_PHOTO_MAX_FILES = 10
+
+#leading bytes of the image formats we accept, the sniffed type wins over the client's mimetype
+SIGNATURES = (
+    (0, b"\xff\xd8\xff", "image/jpeg"),
+    (0, b"\x89PNG\r\n\x1a\n", "image/png"),
+    (0, b"GIF87a", "image/gif"),
+    (0, b"GIF89a", "image/gif"),
+    (8, b"WEBP", "image/webp"),
+    (4, b"ftypheic", "image/heic"),
+    (4, b"ftypheix", "image/heic"),
+    (4, b"ftypmif1", "image/heif"),
+)
+SNIFF_BYTES = 16
+
+
+class UploadRejected(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+class _PrefixedStream:
+    """Replays already sniffed bytes in front of a non-seekable stream."""
+
+    def __init__(self, head, stream):
+        self.head = head
+        self.stream = stream
+
+    def read(self, size=-1):
+        if not self.head:
+            return self.stream.read(size)
+        if size is None or size < 0:
+            data, self.head = self.head + self.stream.read(), b""
+            return data
+        data, self.head = self.head[:size], self.head[size:]
+        if len(data) < size:
+            data += self.stream.read(size - len(data))
+        return data
+
+
+def sniff_image_type(head):
+    for offset, signature, content_type in SIGNATURES:
+        if head[offset:offset + len(signature)] == signature:
+            if content_type == "image/webp" and not head.startswith(b"RIFF"):
+                continue
+            return content_type
+    return None
+
+
+def check_upload_request():
+    """Reject oversized bodies from Content-Length, before the multipart body is parsed."""
+    max_request = current_app.config.get("MAX_CONTENT_LENGTH")
+    if max_request and request.content_length and request.content_length > max_request:
+        raise UploadRejected(f"Request body exceeds {max_request} bytes", 413)
+
+
+def check_photo_count(files):
+    max_files = current_app.config.get("PHOTO_MAX_FILES", DEFAULT_PHOTO_MAX_FILES)
+    if len(files) > max_files:
+        raise UploadRejected(f"At most {max_files} photos per request", 413)
+
+
+def store_upload(file):
+    """Stream an uploaded file into the blob store, returns the Photos column values for it.
+
+    Werkzeug has already spooled the part to a temporary file; it is copied into
+    the store in chunks and hashed on the way. Non-images and files over
+    PHOTO_MAX_BYTES raise UploadRejected before anything is kept. The bytes
+    are deleted again if the request's transaction ends without a commit
+    and nothing else references them.
+    """
+    stream = file.stream
+    head = stream.read(SNIFF_BYTES)
+    content_type = sniff_image_type(head)
+    if content_type is None:
+        raise UploadRejected(f"'{file.filename}' is not a supported image")
+
+    if stream.seekable():
+        stream.seek(0)
+    else:
+        stream = _PrefixedStream(head, stream)
+
+    max_bytes = current_app.config.get("PHOTO_MAX_BYTES", DEFAULT_PHOTO_MAX_BYTES)
+    try:
+        content_hash, size = blob_store.put(stream, max_bytes=max_bytes)
+    except BlobTooLarge:
+        raise UploadRejected(f"'{file.filename}' exceeds {max_bytes} bytes", 413)
+    g.setdefault("uploaded_blobs", set()).add(content_hash)
+
+    return {
+        "filename": secure_filename(file.filename),
+        "content_type": content_type,
+        "content_hash": content_hash,
+        "size": size,
+    }
+
+
+def _after_commit(session):
+    if has_app_context():
+        g.pop("uploaded_blobs", None)
+
+
+def _after_transaction_end(session, transaction):
+    #rolled back, or closed by the request teardown without a commit
+    if transaction.parent is not None or not has_app_context():
+        return
+    uploaded = g.pop("uploaded_blobs", None)
+    if not uploaded:
+        return
+    try:
+        #this session can't run queries while its transaction ends
+        with db.engine.connect() as conn:
+            referenced = set(conn.execute(
+                select(PhotoBlobs.content_hash).where(PhotoBlobs.content_hash.in_(uploaded))
+            ).scalars())
+        for content_hash in uploaded - referenced:
+            blob_store.delete(content_hash)
+    except Exception:
+        current_app.logger.warning("could not delete uploaded blobs %s", sorted(uploaded), exc_info=True)
+
+
+event.listen(db.session, "after_commit", _after_commit)
+event.listen(db.session, "after_transaction_end", _after_transaction_end)
+
+
+def photo_from_upload(file, user_id, post_id=None):
+    """Store an uploaded file and build the Photos row pointing at it, taking a blob reference."""
+    values = store_upload(file)
+    acquire_blobs([(values["content_hash"], values["size"])])
+    return Photos(user_id=user_id, post_id=post_id, **values)
+
+
+def acquire_blobs(blobs):
+    """Take one reference per (content_hash, size) pair, creating photo_blobs rows as needed."""
+    counts = Counter()
+    sizes = {}
+    for content_hash, size in blobs:
+        if content_hash:
+            counts[content_hash] += 1
+            sizes[content_hash] = size
+
+    insert = pg_insert if db.session.get_bind().dialect.name == "postgresql" else sqlite_insert
+    for content_hash, count in counts.items():
+        db.session.execute(
+            insert(PhotoBlobs)
+            .values(content_hash=content_hash, size=sizes[content_hash], ref_count=count)
+            .on_conflict_do_update(
+                index_elements=[PhotoBlobs.content_hash],
+                set_={"ref_count": PhotoBlobs.ref_count + count}
+            )
+        )
+
+
+def release_blobs(content_hashes):
+    """Drop one reference per hash (None entries are legacy rows and ignored).
+
+    Blobs left without references lose their photo_blobs row here and are
+    returned; pass them to purge_blobs once the transaction has committed.
+    photos.content_hash references that row, so delete and flush the
+    Photos rows being released first.
+    """
+    counts = Counter(h for h in content_hashes if h)
+    if not counts:
+        return []
+
+    for content_hash, count in counts.items():
+        db.session.execute(
+            update(PhotoBlobs)
+            .where(PhotoBlobs.content_hash == content_hash)
+            .values(ref_count=PhotoBlobs.ref_count - count)
+        )
+
+    orphans = db.session.execute(
+        select(PhotoBlobs.content_hash).where(PhotoBlobs.content_hash.in_(counts), PhotoBlobs.ref_count <= 0)
+    ).scalars().all()
+    if orphans:
+        db.session.execute(delete(PhotoBlobs).where(PhotoBlobs.content_hash.in_(orphans)))
+    return orphans
+
+
+def purge_blobs(content_hashes):
+    """Delete stored bytes and derivatives of blobs released by release_blobs."""
+    for content_hash in content_hashes:
+        #an upload may have re-acquired the same content since it was released
+        if db.session.get(PhotoBlobs, content_hash) is not None:
+            continue
+        blob_store.delete(content_hash)
+        photo_variants.discard(content_hash)
+
+
+def schedule_photo_variants(*photos):
+    """Queue the preset sizes for freshly uploaded photos, generated off the request worker."""
+    for photo in photos:
+        if photo is None or not photo.content_hash:
+            continue
+        src_path = blob_store.path(photo.content_hash)
+        if src_path:
+            photo_variants.schedule_presets(src_path, photo.content_hash, photo.content_type)
+
+
+def photo_version(photo):
+    return photo.content_hash[:16] if photo.content_hash else str(photo.id)
+
+
+#stands in for the id while building a url template, never a real row
+_ID_MARKER = 987654321
+
+
+def _url_template(endpoint, id_arg):
+    """url_for(endpoint, id_arg=..., v=...) as a format string, built once per script root.
+
+    Every post and event on a list page links photos, url_for for each of
+    them was most of the serialization time. Ids and versions are digits
+    and hex, which url_for wouldn't escape either.
+    """
+    key = (endpoint, request.script_root if has_request_context() else None)
+    templates = current_app.extensions.setdefault("photo_url_templates", {})
+    template = templates.get(key)
+    if template is None:
+        url = url_for(endpoint, **{id_arg: _ID_MARKER}, v="VERSION")
+        template = templates[key] = url.replace("{", "{{").replace("}", "}}").replace(str(_ID_MARKER), "{0}").replace("VERSION", "{1}")
+    return template
+
+
+def photo_url(photo):
+    if photo is None:
+        return None
+    return _url_template("photos_bp.get_photo", "photo_id").format(photo.id, photo_version(photo))
+
+
+def avatar_url(user_id, profile_photo_id):
+    #profile photo ids are never reused, so the id works as the avatar version
+    if not profile_photo_id:
+        return None
+    return _url_template("users_bp.get_profile_photo", "user_id").format(user_id, profile_photo_id)
+
+
+def _photo_etag(photo):
+    if photo.content_hash:
+        return photo.content_hash
+    return hashlib.sha256(photo.file_data or b"").hexdigest()
+
+
+def _last_modified(photo):
+    if photo.upload_date is None:
+        return None
+    #sqlite hands back naive utc datetimes
+    if photo.upload_date.tzinfo is None:
+        return photo.upload_date.replace(tzinfo=timezone.utc)
+    return photo.upload_date
+
+
+def _not_modified(etag, last_modified):
+    if request.if_none_match:
+        return request.if_none_match.contains(etag)
+    since = request.if_modified_since
+    return since is not None and last_modified is not None and last_modified.replace(microsecond=0) <= since
+
+
+def _set_cache_headers(response, etag, last_modified, max_age, immutable):
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    response.cache_control.no_cache = None
+    response.cache_control.public = True
+    response.cache_control.max_age = max_age
+    response.cache_control.immutable = immutable
+    return response
+
+
+def _variant_path(photo, width):
+    """Path of the resized derivative if it is ready, otherwise queue it and return None."""
+    if not width or not photo.content_hash:
+        return None
+    path = photo_variants.get(photo.content_hash, width, photo.content_type)
+    if path is None:
+        src_path = blob_store.path(photo.content_hash)
+        if src_path:
+            photo_variants.schedule(src_path, photo.content_hash, width, photo.content_type)
+    return path
+
+
+def _send(source, etag, mimetype, filename, last_modified, version, max_age):
+    immutable = version is not None and request.args.get("v") == str(version)
+    if immutable:
+        max_age = IMMUTABLE_MAX_AGE
+
+    if _not_modified(etag, last_modified):
+        response = current_app.response_class(status=304)
+        return _set_cache_headers(response, etag, last_modified, max_age, immutable)
+
+    if callable(source):
+        source = source()
+
+    response = send_file(
+        source,
+        mimetype=mimetype,
+        as_attachment=False,
+        download_name=filename,
+        etag=etag,
+        last_modified=last_modified,
+        max_age=max_age,
+        conditional=True,
+    )
+    return _set_cache_headers(response, etag, last_modified, max_age, immutable)
+
+
+def send_cached_image(image, max_age=3600, version=None):
+    """Serve a hot_images entry, same headers and conditional handling as send_photo."""
+    return _send(
+        lambda: io.BytesIO(image.data), image.etag, image.mimetype, image.filename,
+        image.last_modified, image.version if version is None else version, max_age
+    )
+
+
+def send_photo(photo, download_name, version=None, max_age=3600, width=None, cache_key=None):
+    """Serve a Photos row with a content-hash ETag, conditional GET and byte ranges.
+
+    Requests carrying `?v=<version>` get immutable long-lived caching. 304s are
+    answered from the row metadata without opening the blob. With `width` the
+    cached derivative is sent; while it is still being generated the original
+    goes out with a short max-age so clients come back for the resized one.
+    With `cache_key` the bytes are also kept in hot_images for the next request.
+    """
+    etag = _photo_etag(photo)
+    last_modified = _last_modified(photo)
+    mimetype = photo.content_type or "image/jpeg"
+    filename = photo.filename or download_name
+
+    variant_path = _variant_path(photo, width)
+    if variant_path:
+        etag = f"{etag}-w{width}"
+        mimetype = variant_format(photo.content_type)[1]
+    elif width and photo.content_hash:
+        version = None
+        max_age = 60
+        cache_key = None
+
+    def source():
+        if variant_path:
+            return variant_path
+        if photo.content_hash:
+            return blob_store.path(photo.content_hash) or blob_store.open(photo.content_hash)
+        return io.BytesIO(photo.file_data)
+
+    if cache_key is not None and not _not_modified(etag, last_modified):
+        image = _load_hot_image(cache_key, source, etag, mimetype, filename, last_modified, photo_version(photo))
+        if image is not None:
+            return send_cached_image(image, max_age, version)
+
+    return _send(source, etag, mimetype, filename, last_modified, version, max_age)
+
+
+def _load_hot_image(cache_key, source, etag, mimetype, filename, last_modified, version):
+    """Read a small image into hot_images; None when it is too big to keep in memory."""
+    source = source()
+    if isinstance(source, str):
+        if os.path.getsize(source) > current_app.config["IMAGE_CACHE_MAX_ITEM"]:
+            return None
+        with open(source, "rb") as f:
+            data = f.read()
+    else:
+        with source:
+            data = source.read(current_app.config["IMAGE_CACHE_MAX_ITEM"] + 1)
+        if len(data) > current_app.config["IMAGE_CACHE_MAX_ITEM"]:
+            return None
+
+    image = CachedImage(data, etag, mimetype, filename, last_modified, version)
+    hot_images.put(cache_key, image)
+    return image
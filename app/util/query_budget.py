@@ -0,0 +1,34 @@
+from functools import wraps
+from flask import current_app, request
+from flask_sqlalchemy.record_queries import get_recorded_queries
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+def query_budget(limit):
+    """Flag views that run more than `limit` SQL statements.
+
+    Counts through Flask-SQLAlchemy's query recording, so it only does
+    anything when SQLALCHEMY_RECORD_QUERIES is on. Overruns are logged, or
+    raised when QUERY_BUDGET_STRICT is set so N+1 regressions fail loudly
+    under TestingConfig.
+    """
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            if not current_app.config.get("SQLALCHEMY_RECORD_QUERIES"):
+                return f(*args, **kwargs)
+
+            before = len(get_recorded_queries())
+            response = f(*args, **kwargs)
+            used = len(get_recorded_queries()) - before
+            if used > limit:
+                message = f"{request.endpoint} ran {used} queries, budget is {limit}"
+                if current_app.config.get("QUERY_BUDGET_STRICT"):
+                    raise QueryBudgetExceeded(message)
+                current_app.logger.warning(message)
+            return response
+        return wrapper
+    return decorator
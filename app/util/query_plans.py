@@ -0,0 +1,89 @@
+from sqlalchemy import select, func, text
+from app.models import Users, Posts, Comments, Photos, EventPosts, follows, post_likes, event_rsvps, event_hosts, timeline_entries
+
+#stands in for the id in the route's URL, the plan doesn't depend on which row it is
+SAMPLE_ID = 1
+
+
+def _page(stmt, *keys, descending=True):
+    return stmt.order_by(*[key.desc() if descending else key.asc() for key in keys]).limit(21)
+
+
+def hot_queries():
+    """Main statement of each read endpoint, shaped the way the route runs it."""
+    return {
+        "posts.get_feed": _page(
+            select(timeline_entries.c.post_id).where(timeline_entries.c.user_id == SAMPLE_ID),
+            timeline_entries.c.created_at, timeline_entries.c.post_id,
+        ),
+        "posts.get_posts_by_user": _page(select(Posts.id).where(Posts.user_id == SAMPLE_ID), Posts.created_at, Posts.id),
+        "posts.list_post_likes": _page(
+            select(Users.id).join(post_likes, Users.id == post_likes.c.user_id).where(post_likes.c.post_id == SAMPLE_ID),
+            post_likes.c.created_at, post_likes.c.user_id,
+        ),
+        "comments.view_comments_of_post": _page(
+            select(Comments.id).where(Comments.post_id == SAMPLE_ID), Comments.created_at, Comments.id, descending=False,
+        ),
+        "users.list_followers": _page(
+            select(Users.id).join(follows, Users.id == follows.c.follower_id).where(follows.c.followed_id == SAMPLE_ID),
+            Users.username, Users.id, descending=False,
+        ),
+        "users.list_following": _page(
+            select(Users.id).join(follows, Users.id == follows.c.followed_id).where(follows.c.follower_id == SAMPLE_ID),
+            Users.username, Users.id, descending=False,
+        ),
+        "users.search_user": select(Users.id).where(func.lower(Users.username) >= "an", func.lower(Users.username) < "ao").limit(200),
+        "event_posts.read_all_event_posts": _page(
+            select(EventPosts.id).where(EventPosts.start_time >= func.current_timestamp()),
+            EventPosts.start_time, EventPosts.id, descending=False,
+        ),
+        "event_posts.my_hosting": _page(
+            select(EventPosts.id).join(event_hosts, EventPosts.id == event_hosts.c.event_post_id).where(event_hosts.c.user_id == SAMPLE_ID),
+            EventPosts.start_time, EventPosts.id, descending=False,
+        ),
+        "event_posts.list_attendees": _page(
+            select(Users.id).join(event_rsvps, Users.id == event_rsvps.c.user_id).where(event_rsvps.c.event_post_id == SAMPLE_ID),
+            event_rsvps.c.created_at, event_rsvps.c.user_id,
+        ),
+        "event_posts.search_events": _page(
+            select(EventPosts.id).where(
+                EventPosts.country_key == "usa", EventPosts.state_key == "ny", EventPosts.city_key == "new york",
+                EventPosts.start_time >= func.current_timestamp(),
+            ),
+            EventPosts.start_time, EventPosts.id, descending=False,
+        ),
+        #selectinload() queries behind every post and event page
+        "loaders.post_photos": select(Photos.id).where(Photos.post_id.in_([SAMPLE_ID, SAMPLE_ID + 1])),
+        "loaders.event_hosts": select(event_hosts.c.user_id).where(event_hosts.c.event_post_id.in_([SAMPLE_ID, SAMPLE_ID + 1])),
+        "users.photos": select(Photos.id).where(Photos.user_id == SAMPLE_ID),
+    }
+
+
+def explain(conn, stmt):
+    """Plan `stmt` would run with on `conn`, one line per plan step."""
+    sql = str(stmt.compile(dialect=conn.dialect, compile_kwargs={"literal_binds": True}))
+    if conn.dialect.name == "sqlite":
+        return [row[-1] for row in conn.execute(text(f"EXPLAIN QUERY PLAN {sql}")).all()]
+    if conn.dialect.name == "postgresql":
+        #small or empty tables make postgres prefer seq scans, ask whether an index could serve it
+        with conn.begin_nested():
+            conn.execute(text("SET LOCAL enable_seqscan = off"))
+            return [row[0] for row in conn.execute(text(f"EXPLAIN {sql}")).all()]
+    return [row[0] for row in conn.execute(text(f"EXPLAIN {sql}")).all()]
+
+
+def full_scans(conn, plan):
+    """Tables the plan reads in full, and sorts no index hands the rows in order for."""
+    scans = []
+    for line in plan:
+        step = line.strip()
+        if conn.dialect.name == "sqlite" and step.startswith("SCAN ") and " USING " not in step:
+            scans.append(step.split()[1])
+        elif conn.dialect.name == "sqlite" and step.startswith("USE TEMP B-TREE FOR ") and "ORDER BY" in step:
+            scans.append(f"sort ({step[len('USE TEMP B-TREE FOR '):]})")
+        elif "Seq Scan on " in step:
+            scans.append(step.split("Seq Scan on ", 1)[1].split()[0])
+        elif step.startswith("Sort Key: "):
+            #under Sort and Incremental Sort nodes alike
+            scans.append(f"sort ({step[len('Sort Key: '):]})")
+    return scans
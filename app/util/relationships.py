@@ -0,0 +1,50 @@
+from collections import namedtuple
+from flask import g
+from sqlalchemy import select, and_, or_
+from app.models import db, follows
+
+Relationship = namedtuple("Relationship", "is_following follows_me mutual")
+NONE = Relationship(False, False, False)
+#keys annotate_users() adds
+RELATIONSHIP_FIELDS = Relationship._fields
+
+
+def resolve_relationships(viewer_id, user_ids):
+    """Map each of `user_ids` to the viewer's Relationship with that user.
+
+    Both follow directions for every id come from one query, and answers are
+    kept on flask.g so later lookups in the same request are free.
+    Anonymous viewers and the viewer themself always get NONE.
+    """
+    user_ids = {user_id for user_id in user_ids if user_id is not None}
+    if not viewer_id:
+        return {user_id: NONE for user_id in user_ids}
+
+    known = g.setdefault("relationships", {}).setdefault(viewer_id, {})
+    missing = user_ids - known.keys() - {viewer_id}
+    if missing:
+        following, followers = set(), set()
+        rows = db.session.execute(
+            select(follows.c.follower_id, follows.c.followed_id).where(or_(
+                and_(follows.c.follower_id == viewer_id, follows.c.followed_id.in_(missing)),
+                and_(follows.c.followed_id == viewer_id, follows.c.follower_id.in_(missing)),
+            ))
+        ).all()
+        for follower_id, followed_id in rows:
+            if follower_id == viewer_id:
+                following.add(followed_id)
+            else:
+                followers.add(follower_id)
+        for user_id in missing:
+            is_following, follows_me = user_id in following, user_id in followers
+            known[user_id] = Relationship(is_following, follows_me, is_following and follows_me)
+
+    return {user_id: known.get(user_id, NONE) for user_id in user_ids}
+
+
+def annotate_users(users, viewer_id, key="id"):
+    """Add is_following, follows_me and mutual to serialized user dicts in place."""
+    relationships = resolve_relationships(viewer_id, [user.get(key) for user in users])
+    for user in users:
+        user.update(relationships.get(user.get(key), NONE)._asdict())
+    return users
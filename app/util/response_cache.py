@@ -0,0 +1,125 @@
+import hashlib
+import os
+import time
+from urllib.parse import urlencode
+from flask import current_app, g, has_app_context, request
+from sqlalchemy import event
+from app.extensions import cache
+from app.models import db
+
+DEFAULT_TIMEOUT = 300
+#seconds to serve uncached after the cache store failed, before trying it again
+RETRY_AFTER = 5
+
+_down_until = 0.0
+#wall clock of the last failure, invalidations this worker made around then may be lost
+_failed_at = 0.0
+
+
+def _store_failed(action):
+    global _down_until, _failed_at
+    _down_until = time.monotonic() + current_app.config.get("RESPONSE_CACHE_RETRY_AFTER", RETRY_AFTER)
+    _failed_at = time.time()
+    current_app.logger.warning("response cache store unavailable, %s", action, exc_info=True)
+
+
+def _tag_key(tag):
+    return f"tag:{tag}"
+
+
+def _new_token():
+    return os.urandom(8).hex()
+
+
+def _tokens(tags):
+    """Current token of every tag. A tag without one, never written or evicted, gets a fresh token."""
+    tags = sorted(tags)
+    keys = [_tag_key(tag) for tag in tags]
+    values = cache.get_many(*keys) if keys else []
+    missing = [key for key, value in zip(keys, values) if value is None]
+    if missing:
+        for key in missing:
+            cache.add(key, _new_token(), timeout=0)
+        values = cache.get_many(*keys)
+    return dict(zip(tags, values))
+
+
+def tag(*tags):
+    """Record more entities the response being built by cached() depends on."""
+    g.setdefault("response_tags", set()).update(tags)
+
+
+def invalidate(*tags):
+    """Expire every cached response tagged with any of `tags` once the session commits.
+
+    Called before the commit, a rollback drops them again.
+    """
+    g.setdefault("stale_tags", set()).update(tags)
+
+
+def _after_commit(session):
+    if not has_app_context():
+        return
+    stale = g.pop("stale_tags", None)
+    if stale:
+        #a new token orphans every entry stored under the old one, they age out by TTL
+        try:
+            cache.set_many({_tag_key(tag): _new_token() for tag in stale}, timeout=0)
+        except Exception:
+            _store_failed("responses tagged %s stay cached until they expire" % sorted(stale))
+
+
+def _after_rollback(session):
+    if has_app_context():
+        g.pop("stale_tags", None)
+
+
+event.listen(db.session, "after_commit", _after_commit)
+event.listen(db.session, "after_rollback", _after_rollback)
+
+
+def _cache_key():
+    args = urlencode(sorted(request.args.items(multi=True)))
+    return "view:" + hashlib.sha1(f"{request.path}?{args}".encode()).hexdigest()
+
+
+def cached(build, tags=(), timeout=None):
+    """Shared response for this URL, returns build()'s (payload, status).
+
+    The entry is keyed on path and query string only, so `build` must not
+    use the viewer; routes add viewer fields to the payload afterwards.
+    Entries are stored with the token of each tag they depend on and a
+    lookup only hits while none of those tokens changed. `tags` are the
+    ones known from the URL, their tokens are read before `build` runs so
+    a write that commits during the build can't be missed. Tags found
+    while building are added with tag(). Only 200 responses are stored.
+
+    An unreachable or slow store fails open, responses are built uncached
+    for RESPONSE_CACHE_RETRY_AFTER seconds before it is tried again. This
+    worker then ignores entries stored before the failure, other workers
+    may serve them until RESPONSE_CACHE_TIMEOUT.
+    """
+    if not current_app.config.get("RESPONSE_CACHE_ENABLED", True) or time.monotonic() < _down_until:
+        return build()
+
+    key = _cache_key()
+    try:
+        entry = cache.get(key)
+        if entry is not None and entry["stored_at"] > _failed_at and _tokens(entry["tokens"]) == entry["tokens"]:
+            return entry["payload"], entry["status"]
+        tokens = _tokens(tags)
+    except Exception:
+        _store_failed("serving uncached")
+        return build()
+
+    g.response_tags = set(tags)
+    payload, status = build()
+    found = g.pop("response_tags", set()) - set(tags)
+    if status == 200:
+        try:
+            tokens.update(_tokens(found))
+            ttl = timeout or current_app.config.get("RESPONSE_CACHE_TIMEOUT", DEFAULT_TIMEOUT)
+            cache.set(key, {"tokens": tokens, "payload": payload, "status": status, "stored_at": time.time()}, timeout=ttl)
+        except Exception:
+            _store_failed("response not stored")
+    return payload, status
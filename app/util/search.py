@@ -0,0 +1,258 @@
+import re
+import sqlite3
+from flask import current_app
+from sqlalchemy import event, func, inspect, literal_column, or_, select, table, column, text
+from sqlalchemy.exc import DBAPIError
+from app.models import db, Users, Posts, EventPosts
+
+#searchable text columns per table, most important first
+INDEXED_COLUMNS = {
+    "posts": ("caption",),
+    "event_posts": ("title", "description"),
+    "users": ("username",),
+}
+#usernames are single tokens, indexed by trigram so any part of a name matches
+TRIGRAM_TABLES = {"users"}
+WORD_TOKENIZER = "tokenize='unicode61 remove_diacritics 2', prefix='2 3'"
+TRIGRAM_TOKENIZER = "tokenize='trigram'"
+#the sqlite trigram tokenizer needs 3.34, older builds only get the prefix index
+SQLITE_HAS_TRIGRAM = sqlite3.sqlite_version_info >= (3, 34, 0)
+#bm25() column weights on sqlite, setweight() labels on postgres
+BM25_WEIGHTS = (10.0, 1.0)
+TS_WEIGHTS = ("A", "B")
+TS_CONFIG = "simple"
+
+_TERM = re.compile(r"[^\W_]+")
+
+
+def terms(query):
+    """Lowercased word terms of a search box query, punctuation is dropped."""
+    return _TERM.findall((query or "").lower())
+
+
+def _sqlite_ddl(name, columns):
+    if name in TRIGRAM_TABLES:
+        #lower(username) is what username search compares prefixes against
+        ddl = [f"CREATE INDEX IF NOT EXISTS ix_{name}_{columns[0]}_lower ON {name} (lower({columns[0]}))"]
+        if not SQLITE_HAS_TRIGRAM:
+            return ddl
+        return ddl + _sqlite_fts_ddl(name, columns, TRIGRAM_TOKENIZER)
+    return _sqlite_fts_ddl(name, columns, WORD_TOKENIZER)
+
+
+def _sqlite_fts_ddl(name, columns, tokenizer):
+    fts = f"{name}_fts"
+    cols = ", ".join(columns)
+    new = ", ".join(f"new.{c}" for c in columns)
+    old = ", ".join(f"old.{c}" for c in columns)
+    delete_old = f"INSERT INTO {fts}({fts}, rowid, {cols}) VALUES ('delete', old.id, {old});"
+    insert_new = f"INSERT INTO {fts}(rowid, {cols}) VALUES (new.id, {new});"
+    #external content table, the triggers keep it in step with every write to the base table
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5({cols}, content='{name}', content_rowid='id', {tokenizer})",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {name} BEGIN {insert_new} END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {name} BEGIN {delete_old} END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF {cols} ON {name} BEGIN {delete_old} {insert_new} END",
+    ]
+
+
+def _postgresql_ddl(name, columns):
+    if name in TRIGRAM_TABLES:
+        #text_pattern_ops lets LIKE 'prefix%' use the btree whatever the database collation
+        return [
+            f"CREATE INDEX IF NOT EXISTS ix_{name}_{columns[0]}_lower ON {name} (lower({columns[0]}) text_pattern_ops)",
+            f"CREATE INDEX IF NOT EXISTS {_pg_index(name)} ON {name} USING GIN (lower({columns[0]}) gin_trgm_ops)",
+        ]
+    vector = " || ".join(
+        f"setweight(to_tsvector('{TS_CONFIG}', coalesce({c}, '')), '{weight}')"
+        for c, weight in zip(columns, TS_WEIGHTS)
+    )
+    #a generated column is recomputed by postgres itself on insert and update
+    return [
+        f"ALTER TABLE {name} ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS ({vector}) STORED",
+        f"CREATE INDEX IF NOT EXISTS {_pg_index(name)} ON {name} USING GIN (search_vector)",
+    ]
+
+
+def _pg_index(name):
+    return f"ix_{name}_trigram" if name in TRIGRAM_TABLES else f"ix_{name}_search_vector"
+
+
+def _ensure_pg_trgm(connection):
+    if connection.scalar(text("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")):
+        return True
+    try:
+        with connection.begin_nested():
+            connection.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+        return True
+    except DBAPIError:
+        #needs a role allowed to create extensions, until then username search skips the trigram index
+        return False
+
+
+_DDL = {"sqlite": _sqlite_ddl, "postgresql": _postgresql_ddl}
+
+
+def create_search_index(connection, name):
+    """Create the full-text index for table `name`, a no-op where it already exists.
+
+    Returns False on databases without a supported full-text engine.
+    """
+    dialect = connection.dialect.name
+    ddl = _DDL.get(dialect)
+    if ddl is None:
+        return False
+    statements = ddl(name, INDEXED_COLUMNS[name])
+    if dialect == "postgresql" and name in TRIGRAM_TABLES and not _ensure_pg_trgm(connection):
+        statements = statements[:1]
+    for statement in statements:
+        connection.execute(text(statement))
+    return True
+
+
+def rebuild_search_index(connection, name):
+    """Recreate the index for `name` and repopulate it from the base table."""
+    dialect = connection.dialect.name
+    if dialect == "sqlite":
+        fts = f"{name}_fts"
+        if name in TRIGRAM_TABLES and not SQLITE_HAS_TRIGRAM:
+            return create_search_index(connection, name)
+        for suffix in ("ai", "ad", "au"):
+            connection.execute(text(f"DROP TRIGGER IF EXISTS {fts}_{suffix}"))
+        connection.execute(text(f"DROP TABLE IF EXISTS {fts}"))
+        create_search_index(connection, name)
+        connection.execute(text(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')"))
+        return True
+    if dialect == "postgresql":
+        create_search_index(connection, name)
+        if has_search_index(connection, name):
+            connection.execute(text(f"REINDEX INDEX {_pg_index(name)}"))
+        return True
+    return False
+
+
+def has_search_index(bind, name):
+    dialect = bind.dialect.name
+    inspector = inspect(bind)
+    if dialect == "sqlite":
+        return inspector.has_table(f"{name}_fts")
+    if dialect == "postgresql":
+        return any(index["name"] == _pg_index(name) for index in inspector.get_indexes(name))
+    return False
+
+
+#new databases get the index from create_all(), existing ones from `flask search rebuild`
+def _after_create(target, connection, **kw):
+    create_search_index(connection, target.name)
+
+
+for _model in (Users, Posts, EventPosts):
+    event.listen(_model.__table__, "after_create", _after_create)
+
+
+def _index_ready(name):
+    #inspected once per process, restart the app after running `flask search rebuild`
+    ready = current_app.extensions.setdefault("search_indexes", {})
+    if name not in ready:
+        ready[name] = has_search_index(db.engine, name)
+    return ready[name]
+
+
+def ilike(stmt, model, query):
+    """The substring match used where no full-text index is available."""
+    pattern = f"%{query}%"
+    return stmt.where(or_(*[getattr(model, c).ilike(pattern) for c in INDEXED_COLUMNS[model.__tablename__]]))
+
+
+def match(stmt, model, query, dialect=None):
+    """Filter `stmt` to rows of `model` matching `query`, returns (stmt, order).
+
+    Every term is matched as a prefix and all terms must match. `order` is
+    (keys, descending) for paginate(), ranking the best matches first with
+    the primary key as tie breaker. When the index is missing, or the query
+    has no word terms, this falls back to ilike() and `order` is None so the
+    caller keeps its usual ordering.
+
+    `dialect` skips the index check, for callers that manage their own engine.
+    """
+    name = model.__tablename__
+    words = terms(query)
+    if dialect is None:
+        dialect = db.engine.dialect.name
+        if not _index_ready(name):
+            words = []
+    if not words or dialect not in _DDL:
+        return ilike(stmt, model, query), None
+
+    if dialect == "sqlite":
+        fts = table(f"{name}_fts", column("rowid"))
+        index = literal_column(f"{name}_fts")
+        weights = BM25_WEIGHTS[:len(INDEXED_COLUMNS[name])]
+        stmt = (
+            stmt.join(fts, fts.c.rowid == model.id)
+            .where(index.op("MATCH")(" ".join(f'"{word}"*' for word in words)))
+        )
+        #bm25() is negative, lower is a better match
+        return stmt, ([func.bm25(index, *weights), model.id], False)
+
+    vector = literal_column(f"{name}.search_vector")
+    tsquery = func.to_tsquery(TS_CONFIG, " & ".join(f"{word}:*" for word in words))
+    stmt = stmt.where(vector.op("@@")(tsquery))
+    return stmt, ([func.ts_rank(vector, tsquery), model.id], True)
+
+
+USERNAME_CANDIDATES = 200
+
+
+def _like_escape(value):
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def prefix_match(expr, prefix, dialect=None):
+    """`expr` starts with `prefix`, written so a plain btree index on `expr` serves it."""
+    if (dialect or db.engine.dialect.name) == "sqlite":
+        #sqlite compares text bytewise, so a prefix is a range scan on the lower() index
+        return (expr >= prefix) & (expr < prefix[:-1] + chr(ord(prefix[-1]) + 1))
+    return expr.like(_like_escape(prefix) + "%", escape="\\")
+
+
+def search_usernames(query, limit=30, options=()):
+    """Users whose username contains `query`, best matches first.
+
+    An exact username comes first, then names starting with `query`, then
+    names containing it, each tier ordered by follower count. Prefixes are a
+    range scan on the lower(username) index. Substrings come from the
+    trigram index and are only looked up for queries of 3 or more
+    characters, which is the shortest a trigram can match. Databases
+    without a trigram index fall back to a substring scan. Follower
+    weighting only reorders the first USERNAME_CANDIDATES rows of each tier.
+    `options` are loader options for the Users rows, they must load
+    username and follower_count.
+    """
+    query = (query or "").lower()
+    if not query:
+        return []
+    dialect = db.engine.dialect.name
+    lowered = func.lower(Users.username)
+
+    found = db.session.execute(
+        select(Users).options(*options).where(prefix_match(lowered, query, dialect)).order_by(lowered).limit(USERNAME_CANDIDATES)
+    ).scalars().all()
+
+    if len(found) < limit and len(query) >= 3:
+        stmt = select(Users).options(*options).where(Users.id.notin_([user.id for user in found]))
+        if dialect == "sqlite" and _index_ready("users"):
+            fts = table("users_fts", column("rowid"))
+            phrase = '"' + query.replace('"', '""') + '"'
+            stmt = stmt.join(fts, fts.c.rowid == Users.id).where(literal_column("users_fts").op("MATCH")(phrase))
+        else:
+            #postgres serves this LIKE from the gin_trgm_ops index when it exists
+            stmt = stmt.where(lowered.like("%" + _like_escape(query) + "%", escape="\\"))
+        found += db.session.execute(stmt.limit(USERNAME_CANDIDATES)).scalars().all()
+
+    def rank(user):
+        name = user.username.lower()
+        tier = 0 if name == query else 1 if name.startswith(query) else 2
+        return tier, -user.follower_count, len(name), name
+
+    return sorted(found, key=rank)[:limit]
@@ -0,0 +1,110 @@
+import orjson
+from flask import current_app
+from marshmallow import fields, missing
+from marshmallow.decorators import PRE_DUMP, POST_DUMP
+
+_ISO_FORMATS = (None, "iso", "iso8601")
+
+
+def _expression(field, schema, env, i):
+    """Python expression serializing `v` (never None) the way `field` does, None if it needs the generic path."""
+    kind = type(field)
+    if kind is fields.Integer and not field.as_string:
+        return "v if v.__class__ is int else int(v)"
+    if kind is fields.Float and not field.as_string:
+        return "float(v)"
+    if kind is fields.String:
+        return "v if v.__class__ is str else str(v)"
+    if kind in (fields.Boolean, fields.Raw):
+        return "v"
+    if kind in (fields.DateTime, fields.Date) and field.format in _ISO_FORMATS:
+        return "v.isoformat()"
+    if kind is fields.Nested:
+        env[f"nested{i}"] = _dump_one(field.schema)
+        if field.schema.many or field.many:
+            return f"[nested{i}(item) for item in v]"
+        return f"nested{i}(v)"
+    return None
+
+
+def _dump_one(schema):
+    """Function dumping one object exactly like schema.dump(obj, many=False).
+
+    The schema's fields are turned into straight line code once: a getattr
+    and a conversion per field instead of marshmallow's per field dispatch.
+    Fields it has no conversion for, and schemas with dump hooks, go
+    through marshmallow itself.
+    """
+    #kept on the schema itself, so restricted schemas made per request don't pile up here
+    dump_one = schema.__dict__.get("_compiled_dump")
+    if dump_one is not None:
+        return dump_one
+
+    if schema._hooks[PRE_DUMP] or schema._hooks[POST_DUMP]:
+        def dump_one(obj):
+            return schema.dump(obj, many=False)
+    else:
+        env = {"MISSING": missing, "get_attribute": schema.get_attribute}
+        lines = ["def dump_one(obj):", "    out = {}"]
+        for i, (name, field) in enumerate(schema.dump_fields.items()):
+            key = field.data_key if field.data_key is not None else name
+            attr = field.attribute or name
+            expression = None
+            if "." not in attr and field.dump_default is missing:
+                expression = _expression(field, schema, env, i)
+
+            if isinstance(field, fields.Method) and field.serialize_method_name:
+                env[f"method{i}"] = getattr(schema, field.serialize_method_name)
+                lines.append(f"    out[{key!r}] = method{i}(obj)")
+            elif expression is None:
+                env[f"field{i}"] = field
+                lines += [
+                    f"    v = field{i}.serialize({name!r}, obj, accessor=get_attribute)",
+                    f"    if v is not MISSING:",
+                    f"        out[{key!r}] = v",
+                ]
+            else:
+                lines += [
+                    f"    v = getattr(obj, {attr!r}, MISSING)",
+                    f"    if v is not MISSING:",
+                    f"        out[{key!r}] = None if v is None else {expression}",
+                ]
+        lines.append("    return out")
+        exec(compile("\n".join(lines), f"<dump {type(schema).__name__}>", "exec"), env)
+        dump_one = env["dump_one"]
+
+    schema._compiled_dump = dump_one
+    return dump_one
+
+
+def dump(schema, obj, many=None):
+    """Same result as schema.dump(obj, many), several times faster on the list endpoints."""
+    dump_one = _dump_one(schema)
+    if schema.many if many is None else many:
+        return [dump_one(item) for item in obj]
+    return dump_one(obj)
+
+
+def _options():
+    #the same output jsonify() gives, sorted keys and indented in debug mode
+    options = orjson.OPT_SORT_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+    compact = current_app.json.compact
+    if (compact is None and current_app.debug) or compact is False:
+        options |= orjson.OPT_INDENT_2
+    return options
+
+
+def dumps(payload):
+    """One compact JSON document as bytes, for ndjson lines."""
+    return orjson.dumps(payload, default=current_app.json.default, option=orjson.OPT_SORT_KEYS | orjson.OPT_PASSTHROUGH_DATETIME)
+
+
+def json_response(payload, status=200):
+    """jsonify() encoded with orjson.
+
+    Values orjson has no encoding for, and datetimes which jsonify()
+    writes as HTTP dates, go through the app's JSON provider default.
+    Unlike jsonify() non-ASCII text is written as UTF-8 rather than \\u escapes.
+    """
+    body = orjson.dumps(payload, default=current_app.json.default, option=_options() | orjson.OPT_APPEND_NEWLINE)
+    return current_app.response_class(body, status=status, mimetype=current_app.json.mimetype)
@@ -0,0 +1,136 @@
+import os
+import sqlite3
+import threading
+import time
+from urllib.parse import urlsplit, urlencode, parse_qsl, urlunsplit
+from limits.storage import Storage
+
+DEFAULT_TIMEOUT = 0.1
+DEFAULT_POOL_SIZE = 50
+#expired counters are swept every this many increments on a connection
+PURGE_EVERY = 1000
+
+
+class SQLiteStorage(Storage):
+    """Rate limit counters in a SQLite file, shared by every worker on the host.
+
+    For single host deployments and offline test runs, `sqlite:///path/to/limits.db`.
+    Each thread keeps one connection open, and a hit is a single upsert.
+    """
+
+    STORAGE_SCHEME = ["sqlite"]
+
+    def __init__(self, uri, wrap_exceptions=False, timeout=DEFAULT_TIMEOUT, **options):
+        #sqlite:///relative/path and sqlite:////absolute/path, as in SQLAlchemy URLs
+        self.path = uri.split("://", 1)[1][1:]
+        self.timeout = float(timeout)
+        self.local = threading.local()
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        conn = self._connect()
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS rate_limits (key TEXT PRIMARY KEY, count INTEGER NOT NULL, expires_at REAL NOT NULL)")
+        finally:
+            conn.close()
+        super().__init__(uri, wrap_exceptions=wrap_exceptions)
+
+    @property
+    def base_exceptions(self):
+        return sqlite3.Error
+
+    def _connect(self):
+        #autocommit, every statement below is atomic on its own
+        return sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None, check_same_thread=False)
+
+    @property
+    def connection(self):
+        conn = getattr(self.local, "connection", None)
+        if conn is None:
+            conn = self.local.connection = self._connect()
+            self.local.hits = 0
+        return conn
+
+    def incr(self, key, expiry, amount=1):
+        now = time.time()
+        conn = self.connection
+        count = conn.execute(
+            "INSERT INTO rate_limits (key, count, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT (key) DO UPDATE SET "
+            "count = CASE WHEN expires_at <= ? THEN excluded.count ELSE count + excluded.count END, "
+            "expires_at = CASE WHEN expires_at <= ? THEN excluded.expires_at ELSE expires_at END "
+            "RETURNING count",
+            (key, amount, now + expiry, now, now),
+        ).fetchone()[0]
+
+        self.local.hits += 1
+        if self.local.hits % PURGE_EVERY == 0:
+            conn.execute("DELETE FROM rate_limits WHERE expires_at <= ?", (now,))
+        return count
+
+    def get(self, key):
+        row = self.connection.execute("SELECT count FROM rate_limits WHERE key = ? AND expires_at > ?", (key, time.time())).fetchone()
+        return row[0] if row else 0
+
+    def get_expiry(self, key):
+        row = self.connection.execute("SELECT expires_at FROM rate_limits WHERE key = ? AND expires_at > ?", (key, time.time())).fetchone()
+        return row[0] if row else time.time()
+
+    def check(self):
+        try:
+            self.connection.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def reset(self):
+        return self.connection.execute("DELETE FROM rate_limits").rowcount
+
+    def clear(self, key):
+        self.connection.execute("DELETE FROM rate_limits WHERE key = ?", (key,))
+
+
+def _with_query(url, **params):
+    parts = urlsplit(url)
+    query = dict(parse_qsl(parts.query))
+    for name, value in params.items():
+        query.setdefault(name, str(value))
+    return urlunsplit(parts._replace(query=urlencode(query)))
+
+
+def configure_shared_store(app):
+    """Point the rate limiter and the cache at SHARED_STORE_URL, if set.
+
+    Must run before limiter.init_app() and cache.init_app(). The URL
+    replaces CACHE_TYPE and RATELIMIT_STORAGE_URI with their options,
+    the fail open settings are left alone when given. Supported URLs:
+
+    - redis://host:port/db, both use one connection pool per worker
+    - file:///dir, counters in dir/rate_limits.db and responses under
+      dir/cache, shared by the workers of one host without a server
+
+    Calls to the store time out after SHARED_STORE_TIMEOUT seconds. The
+    limiter then counts in memory, per worker, until the store answers
+    again, and the response cache serves uncached.
+    """
+    url = app.config.get("SHARED_STORE_URL")
+    if not url:
+        return
+    timeout = app.config.get("SHARED_STORE_TIMEOUT", DEFAULT_TIMEOUT)
+    pool_size = app.config.get("SHARED_STORE_POOL_SIZE", DEFAULT_POOL_SIZE)
+    scheme = urlsplit(url).scheme
+
+    if scheme in ("redis", "rediss"):
+        options = {"socket_timeout": timeout, "socket_connect_timeout": timeout, "max_connections": pool_size}
+        limiter_uri, limiter_options = url, options
+        cache_config = {"CACHE_TYPE": "RedisCache", "CACHE_REDIS_URL": _with_query(url, **options)}
+    elif scheme == "file":
+        root = urlsplit(url).path
+        limiter_uri, limiter_options = f"sqlite:///{os.path.join(root, 'rate_limits.db')}", {"timeout": timeout}
+        cache_config = {"CACHE_TYPE": "FileSystemCache", "CACHE_DIR": os.path.join(root, "cache"), "CACHE_THRESHOLD": 10000}
+    else:
+        raise ValueError(f"Unsupported SHARED_STORE_URL scheme: {scheme}")
+
+    app.config.update(cache_config, RATELIMIT_STORAGE_URI=limiter_uri, RATELIMIT_STORAGE_OPTIONS=limiter_options)
+    #an unreachable store must not turn into failed requests
+    app.config.setdefault("RATELIMIT_SWALLOW_ERRORS", True)
+    app.config.setdefault("RATELIMIT_IN_MEMORY_FALLBACK_ENABLED", True)
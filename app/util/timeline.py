@@ -0,0 +1,218 @@
+from flask import current_app
+from sqlalchemy import select, insert, delete, func, exists, literal, and_, tuple_
+from app.models import db, Users, Posts, follows, timeline_entries, timeline_pull_authors
+from app.util.pagination import encode_cursor, decode_cursor
+
+DEFAULT_MAX_LENGTH = 800
+DEFAULT_FANOUT_LIMIT = 10000
+DEFAULT_BACKFILL = 50
+#each new post trims one in this many of the timelines it was pushed to
+DEFAULT_TRIM_EVERY = 50
+
+
+def _config(key, default):
+    return current_app.config.get(key, default)
+
+
+def is_pull_author(author_id):
+    return db.session.execute(
+        select(exists().where(timeline_pull_authors.c.user_id == author_id))
+    ).scalar()
+
+
+def fan_out_post(post):
+    """Push a new post into the author's and every follower's timeline.
+
+    Authors past TIMELINE_FANOUT_LIMIT followers, by their follower_count,
+    switch to pull mode: only their own timeline gets the entry and
+    followers merge their posts in at read time.
+
+    Each post also trims the timelines it reached whose user id falls in
+    the same slice as the post id, one in TIMELINE_TRIM_EVERY. A timeline
+    gets trimmed about once every TIMELINE_TRIM_EVERY entries pushed to
+    it, so it stays within that many entries of TIMELINE_MAX_LENGTH.
+    """
+    db.session.flush()
+    columns = ["user_id", "post_id", "author_id", "created_at"]
+    db.session.execute(
+        insert(timeline_entries).from_select(
+            columns,
+            select(Posts.user_id, Posts.id, Posts.user_id, Posts.created_at).where(Posts.id == post.id)
+        )
+    )
+
+    follower_count, pull = db.session.execute(
+        select(Users.follower_count, exists().where(timeline_pull_authors.c.user_id == Users.id))
+        .where(Users.id == post.user_id)
+    ).one()
+
+    every = _config("TIMELINE_TRIM_EVERY", DEFAULT_TRIM_EVERY)
+    trimmed = [post.user_id] if post.user_id % every == post.id % every else []
+    if not pull:
+        if follower_count > _config("TIMELINE_FANOUT_LIMIT", DEFAULT_FANOUT_LIMIT):
+            db.session.execute(insert(timeline_pull_authors).values(user_id=post.user_id))
+        else:
+            db.session.execute(
+                insert(timeline_entries).from_select(
+                    columns,
+                    select(follows.c.follower_id, Posts.id, Posts.user_id, Posts.created_at)
+                    .join(Posts, Posts.user_id == follows.c.followed_id)
+                    .where(Posts.id == post.id)
+                )
+            )
+            trimmed += db.session.execute(
+                select(follows.c.follower_id)
+                .where(follows.c.followed_id == post.user_id, follows.c.follower_id % every == post.id % every)
+            ).scalars().all()
+
+    for user_id in trimmed:
+        trim_timeline(user_id)
+
+
+def remove_post(post_id):
+    db.session.execute(delete(timeline_entries).where(timeline_entries.c.post_id == post_id))
+
+
+def backfill_follow(follower_id, followed_id):
+    """Copy the newest posts of a newly followed push-mode author into the follower's timeline."""
+    if is_pull_author(followed_id):
+        return
+
+    recent = (
+        select(Posts.id, Posts.created_at)
+        .where(Posts.user_id == followed_id)
+        .order_by(Posts.created_at.desc(), Posts.id.desc())
+        .limit(_config("TIMELINE_BACKFILL", DEFAULT_BACKFILL))
+        .subquery()
+    )
+    db.session.execute(
+        insert(timeline_entries).from_select(
+            ["user_id", "post_id", "author_id", "created_at"],
+            select(literal(follower_id), recent.c.id, literal(followed_id), recent.c.created_at)
+            .where(~exists().where(
+                (timeline_entries.c.user_id == follower_id) & (timeline_entries.c.post_id == recent.c.id)
+            ))
+        )
+    )
+    trim_timeline(follower_id)
+
+
+def remove_follow(follower_id, followed_id):
+    db.session.execute(
+        delete(timeline_entries).where(
+            timeline_entries.c.user_id == follower_id,
+            timeline_entries.c.author_id == followed_id
+        )
+    )
+
+
+def remove_user(user_id):
+    db.session.execute(
+        delete(timeline_entries).where(
+            (timeline_entries.c.user_id == user_id) | (timeline_entries.c.author_id == user_id)
+        )
+    )
+    db.session.execute(delete(timeline_pull_authors).where(timeline_pull_authors.c.user_id == user_id))
+
+
+def trim_timeline(user_id):
+    """Keep only the newest TIMELINE_MAX_LENGTH entries of one timeline."""
+    cutoff = db.session.execute(
+        select(timeline_entries.c.created_at, timeline_entries.c.post_id)
+        .where(timeline_entries.c.user_id == user_id)
+        .order_by(timeline_entries.c.created_at.desc(), timeline_entries.c.post_id.desc())
+        .offset(_config("TIMELINE_MAX_LENGTH", DEFAULT_MAX_LENGTH) - 1)
+        .limit(1)
+    ).first()
+    if cutoff is None:
+        return
+    db.session.execute(
+        delete(timeline_entries).where(
+            timeline_entries.c.user_id == user_id,
+            (timeline_entries.c.created_at < cutoff.created_at) | and_(
+                timeline_entries.c.created_at == cutoff.created_at,
+                timeline_entries.c.post_id < cutoff.post_id
+            )
+        )
+    )
+
+
+def rebuild_timeline(user_id):
+    """Recreate one timeline from scratch out of the posts of followed push-mode authors and the user's own."""
+    db.session.execute(delete(timeline_entries).where(timeline_entries.c.user_id == user_id))
+
+    followed = (
+        select(follows.c.followed_id)
+        .where(follows.c.follower_id == user_id)
+        .where(~exists().where(timeline_pull_authors.c.user_id == follows.c.followed_id))
+    )
+    recent = (
+        select(Posts.id, Posts.user_id, Posts.created_at)
+        .where((Posts.user_id == user_id) | Posts.user_id.in_(followed))
+        .order_by(Posts.created_at.desc(), Posts.id.desc())
+        .limit(_config("TIMELINE_MAX_LENGTH", DEFAULT_MAX_LENGTH))
+        .subquery()
+    )
+    db.session.execute(
+        insert(timeline_entries).from_select(
+            ["user_id", "post_id", "author_id", "created_at"],
+            select(literal(user_id), recent.c.id, recent.c.user_id, recent.c.created_at)
+        )
+    )
+
+
+def timeline_page(user_id, page_request):
+    """One page of a home feed as (post_ids, next_cursor, total).
+
+    Pushed entries come from an indexed range scan of timeline_entries and are
+    merged with the newest posts of followed pull-mode authors. The total is
+    only counted when the page request asks for it.
+    """
+    entry_keys = [timeline_entries.c.created_at, timeline_entries.c.post_id]
+    post_keys = [Posts.created_at, Posts.id]
+    after = decode_cursor(page_request.cursor, entry_keys) if page_request.cursor else None
+    window = page_request.offset + page_request.per_page + 1
+
+    pushed = select(*entry_keys).where(timeline_entries.c.user_id == user_id)
+    if after:
+        pushed = pushed.where(tuple_(*entry_keys) < tuple_(*after))
+    rows = db.session.execute(
+        pushed.order_by(*[key.desc() for key in entry_keys]).limit(window)
+    ).all()
+
+    pull_ids = db.session.execute(
+        select(follows.c.followed_id)
+        .join(timeline_pull_authors, timeline_pull_authors.c.user_id == follows.c.followed_id)
+        .where(follows.c.follower_id == user_id)
+    ).scalars().all()
+
+    if pull_ids:
+        pulled = select(*post_keys).where(Posts.user_id.in_(pull_ids))
+        if after:
+            pulled = pulled.where(tuple_(*post_keys) < tuple_(*after))
+        seen = {post_id for _, post_id in rows}
+        rows += [
+            row for row in db.session.execute(
+                pulled.order_by(*[key.desc() for key in post_keys]).limit(window)
+            ).all()
+            if row[1] not in seen
+        ]
+        rows.sort(reverse=True)
+
+    rows = rows[page_request.offset:window]
+    has_more = len(rows) > page_request.per_page
+    rows = rows[:page_request.per_page]
+    next_cursor = encode_cursor(list(rows[-1])) if has_more else None
+
+    total = None
+    if page_request.include_total:
+        total = db.session.execute(
+            select(func.count()).select_from(timeline_entries).where(timeline_entries.c.user_id == user_id)
+        ).scalar()
+        if pull_ids:
+            #approximate, entries pushed before an author switched to pull mode count twice
+            total += db.session.execute(
+                select(func.count()).select_from(Posts).where(Posts.user_id.in_(pull_ids))
+            ).scalar()
+
+    return [post_id for _, post_id in rows], next_cursor, total
@@ -0,0 +1,209 @@
+import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from flask import current_app
+
+DEFAULT_PRESETS = {"avatar": 64, "thumb": 200, "feed": 400, "large": 1080}
+
+FORMATS = {
+    "image/png": ("PNG", "image/png", "png"),
+    "image/gif": ("PNG", "image/png", "png"),
+    "image/webp": ("WEBP", "image/webp", "webp"),
+}
+DEFAULT_FORMAT = ("JPEG", "image/jpeg", "jpg")
+
+
+def variant_format(content_type):
+    """(pillow format, mimetype, extension) used for derivatives of `content_type`."""
+    return FORMATS.get(content_type, DEFAULT_FORMAT)
+
+
+def render_variant(src_path, dest_path, width, pil_format):
+    """Runs in the process pool: write `src_path` scaled down to `width` into `dest_path`."""
+    from PIL import Image, ImageOps
+
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(dest_path))
+    os.close(fd)
+    try:
+        with Image.open(src_path) as img:
+            img = ImageOps.exif_transpose(img)
+            if img.width > width:
+                img = img.resize((width, max(1, round(img.height * width / img.width))), Image.LANCZOS)
+            if pil_format == "JPEG" and img.mode not in ("RGB", "L"):
+                img = img.convert("RGB")
+            img.save(tmp_path, pil_format, quality=85, optimize=True)
+        os.replace(tmp_path, dest_path)
+        return os.path.getsize(dest_path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class VariantCache:
+    """Resized photo derivatives on disk, generated in a process pool and evicted
+    least-recently-used once the directory grows past its byte budget."""
+
+    def __init__(self, root, budget, workers):
+        self.root = root
+        self.budget = budget
+        self.workers = workers
+        self._pool = None
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._bytes = None
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, content_hash, width, ext):
+        return os.path.join(self.root, content_hash[:2], f"{content_hash}_{width}.{ext}")
+
+    def get(self, content_hash, width, ext):
+        """Path of a ready derivative, or None."""
+        path = self._path(content_hash, width, ext)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def schedule(self, src_path, content_hash, width, content_type):
+        """Queue a derivative for generation unless it exists or is already queued."""
+        pil_format, _, ext = variant_format(content_type)
+        dest = self._path(content_hash, width, ext)
+        key = (content_hash, width)
+        with self._lock:
+            if key in self._pending or os.path.exists(dest):
+                return
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.workers)
+            future = self._pool.submit(render_variant, src_path, dest, width, pil_format)
+            self._pending[key] = future
+        future.add_done_callback(lambda f: self._done(key, f))
+
+    def _done(self, key, future):
+        with self._lock:
+            self._pending.pop(key, None)
+        if future.exception() is None:
+            self._account(future.result())
+
+    def _scan(self):
+        entries = []
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def _account(self, size):
+        with self._lock:
+            if self._bytes is None:
+                self._bytes = sum(size for _, size, _ in self._scan())
+            else:
+                self._bytes += size
+            if self._bytes > self.budget:
+                self._evict()
+
+    def _evict(self):
+        #other workers write here too, so evict from what is actually on disk
+        entries = sorted(self._scan())
+        total = sum(size for _, size, _ in entries)
+        target = self.budget * 0.9
+        for _, size, path in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+        self._bytes = total
+
+    def discard(self, content_hash):
+        """Drop every derivative of a blob."""
+        folder = os.path.join(self.root, content_hash[:2])
+        if not os.path.isdir(folder):
+            return
+        for name in os.listdir(folder):
+            if name.startswith(content_hash + "_"):
+                try:
+                    os.remove(os.path.join(folder, name))
+                except FileNotFoundError:
+                    pass
+
+    def clear(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+        os.makedirs(self.root, exist_ok=True)
+        with self._lock:
+            self._bytes = 0
+
+
+class PhotoVariants:
+    """Flask extension exposing the derivative cache and the size presets."""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("PHOTO_VARIANT_PRESETS", DEFAULT_PRESETS)
+        app.config.setdefault("PHOTO_VARIANT_PATH", os.path.join(app.instance_path, "variants"))
+        app.config.setdefault("PHOTO_VARIANT_DISK_BUDGET", 512 * 1024 * 1024)
+        app.config.setdefault("PHOTO_VARIANT_WORKERS", 2)
+
+        app.extensions["photo_variants"] = VariantCache(
+            app.config["PHOTO_VARIANT_PATH"],
+            app.config["PHOTO_VARIANT_DISK_BUDGET"],
+            app.config["PHOTO_VARIANT_WORKERS"],
+        )
+
+    @property
+    def cache(self):
+        return current_app.extensions["photo_variants"]
+
+    @property
+    def presets(self):
+        return current_app.config["PHOTO_VARIANT_PRESETS"]
+
+    def resolve_width(self, size=None, width=None):
+        """Map `?size=<preset>` or `?w=<px>` to a preset width, None means the original.
+
+        Arbitrary widths snap up to the nearest preset so the cache stays bounded.
+        Raises ValueError for unknown presets or bad widths.
+        """
+        if size:
+            if size not in self.presets:
+                raise ValueError(f"Unknown size '{size}'")
+            return self.presets[size]
+        if width is None or width == "":
+            return None
+        try:
+            width = int(width)
+        except (TypeError, ValueError):
+            raise ValueError("Width must be an integer")
+        if width <= 0:
+            raise ValueError("Width must be positive")
+        widths = sorted(self.presets.values())
+        for preset in widths:
+            if preset >= width:
+                return preset
+        return None
+
+    def get(self, content_hash, width, content_type):
+        return self.cache.get(content_hash, width, variant_format(content_type)[2])
+
+    def schedule(self, src_path, content_hash, width, content_type):
+        self.cache.schedule(src_path, content_hash, width, content_type)
+
+    def schedule_presets(self, src_path, content_hash, content_type):
+        for width in set(self.presets.values()):
+            self.cache.schedule(src_path, content_hash, width, content_type)
+
+    def discard(self, content_hash):
+        self.cache.discard(content_hash)
@@ -0,0 +1,4 @@
+from app.asgi import create_asgi_app
+
+#serves beside flask_app.py on the same database, run with `uvicorn asgi_app:app`
+app = create_asgi_app("ProductionConfig")
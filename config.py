@@ -7,18 +7,46 @@ class DevelopmentConfig:
     DEBUG = True
     CACHE_TYPE = "SimpleCache"
     CACHE_DEFAULT_TIMEOUT = 300
+    MAX_CONTENT_LENGTH = 50 * 1024 * 1024
+    PHOTO_MAX_BYTES = 15 * 1024 * 1024
+    PHOTO_MAX_FILES = 10
+    SQLALCHEMY_RECORD_QUERIES = True
 
 class TestingConfig:
     SQLALCHEMY_DATABASE_URI = 'sqlite:///testing.db'
     DEBUG = True
     CACHE_TYPE = "SimpleCache"
+    MAX_CONTENT_LENGTH = 50 * 1024 * 1024
+    PHOTO_MAX_BYTES = 15 * 1024 * 1024
+    PHOTO_MAX_FILES = 10
+    SQLALCHEMY_RECORD_QUERIES = True
+    QUERY_BUDGET_STRICT = True
+    #file:///dir runs the suite against the store gunicorn workers share, without a server
+    SHARED_STORE_URL = os.environ.get('SHARED_STORE_URL')
 
 
 class ProductionConfig:
     SQLALCHEMY_DATABASE_URI = os.environ.get('SQLALCHEMY_DATABASE_URI') or 'sqlite:///app.db'
     DEBUG = True
-    
-
-
-
-
+    BLOB_STORE_BACKEND = os.environ.get('BLOB_STORE_BACKEND') or 'local'
+    BLOB_STORE_PATH = os.environ.get('BLOB_STORE_PATH') or os.path.join(os.getcwd(), 'blobs')
+    MAX_CONTENT_LENGTH = int(os.environ.get('MAX_CONTENT_LENGTH') or 50 * 1024 * 1024)
+    PHOTO_MAX_BYTES = int(os.environ.get('PHOTO_MAX_BYTES') or 15 * 1024 * 1024)
+    PHOTO_MAX_FILES = int(os.environ.get('PHOTO_MAX_FILES') or 10)
+    IMAGE_CACHE_BUDGET = int(os.environ.get('IMAGE_CACHE_BUDGET') or 64 * 1024 * 1024)
+    CACHE_TYPE = os.environ.get('CACHE_TYPE') or 'SimpleCache'
+    CACHE_DEFAULT_TIMEOUT = int(os.environ.get('CACHE_DEFAULT_TIMEOUT') or 300)
+    RESPONSE_CACHE_TIMEOUT = int(os.environ.get('RESPONSE_CACHE_TIMEOUT') or 60)
+    #redis:// or file:///dir, shared by every worker for rate limits and the cache
+    SHARED_STORE_URL = os.environ.get('SHARED_STORE_URL')
+    SHARED_STORE_TIMEOUT = float(os.environ.get('SHARED_STORE_TIMEOUT') or 0.1)
+    SHARED_STORE_POOL_SIZE = int(os.environ.get('SHARED_STORE_POOL_SIZE') or 50)
+    RATELIMIT_ENABLED = (os.environ.get('RATELIMIT_ENABLED') or 'true').lower() != 'false'
+    #async read path (asgi_app.py), SQLALCHEMY_DATABASE_URI on the psycopg/aiosqlite driver by default
+    ASYNC_DATABASE_URI = os.environ.get('ASYNC_DATABASE_URI')
+    ASYNC_POOL_SIZE = int(os.environ.get('ASYNC_POOL_SIZE') or 20)
+    ASYNC_MAX_OVERFLOW = int(os.environ.get('ASYNC_MAX_OVERFLOW') or 20)
+
+    TIMELINE_MAX_LENGTH = int(os.environ.get('TIMELINE_MAX_LENGTH') or 800)
+    TIMELINE_FANOUT_LIMIT = int(os.environ.get('TIMELINE_FANOUT_LIMIT') or 10000)
+    TIMELINE_TRIM_EVERY = int(os.environ.get('TIMELINE_TRIM_EVERY') or 50)
@@ -0,0 +1,77 @@
+import io
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+import zlib
+import config
+from sqlalchemy import event
+from app import create_app
+from app.models import db
+from app.util.migrations import upgrade
+
+def png(rgba=(0, 0, 0, 0)):
+    """A 1x1 PNG of one color, different colors make different blobs."""
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + chunk(b"IHDR", struct.pack(">IIBBBBB", 1, 1, 8, 6, 0, 0, 0))
+        + chunk(b"IDAT", zlib.compress(b"\x00" + bytes(rgba)))
+        + chunk(b"IEND", b"")
+    )
+
+
+PNG = png()
+
+
+class AppTestCase(unittest.TestCase):
+    """TestingConfig app on a fresh database and blob store in a temporary directory."""
+
+    #extra config values, on top of TestingConfig
+    settings = {}
+    #enforce foreign keys on sqlite, as postgres always does
+    foreign_keys = True
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        name = f"{type(self).__name__}Config"
+        setattr(config, name, type(name, (config.TestingConfig,), {
+            "SQLALCHEMY_DATABASE_URI": f"sqlite:///{os.path.join(self.dir, 'app.db')}",
+            "BLOB_STORE_PATH": os.path.join(self.dir, "blobs"),
+            "PHOTO_VARIANT_PATH": os.path.join(self.dir, "variants"),
+            "RATELIMIT_ENABLED": False,
+            **self.settings,
+        }))
+        self.app = create_app(name)
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        if self.foreign_keys:
+            event.listen(db.engine, "connect", lambda conn, record: conn.execute("PRAGMA foreign_keys=ON"))
+            db.engine.dispose()
+        upgrade(db.engine)
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+        db.engine.dispose()
+        self.ctx.pop()
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def signup(self, username):
+        """Create a user through the API, returns (id, auth headers)."""
+        response = self.client.post("/users", json={
+            "first_name": username.title(), "last_name": "Test", "email": f"{username}@example.com",
+            "username": username, "password": "secret",
+        })
+        self.assertEqual(response.status_code, 201, response.get_json())
+        response = self.client.post("/users/login", json={"email": f"{username}@example.com", "password": "secret"})
+        body = response.get_json()
+        return body["id"], {"Authorization": f"Bearer {body['token']}"}
+
+    def upload(self, url, headers, field="photo", data=PNG):
+        return self.client.post(
+            url, headers=headers, content_type="multipart/form-data",
+            data={field: (io.BytesIO(data), "photo.png")},
+        )
@@ -0,0 +1,210 @@
+import asyncio
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+import config
+from flask_sqlalchemy.record_queries import get_recorded_queries
+from sqlalchemy import event
+from app.asgi import create_asgi_app
+from app.extensions import cache, limiter
+from app.models import db, Users
+from app.util.auth import encode_token
+from app.util.migrations import upgrade
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATABASE = "asgi_test.db"
+
+
+class AsgiTestConfig(config.TestingConfig):
+    #relative like the shipped configs, Flask-SQLAlchemy puts it in the instance folder
+    SQLALCHEMY_DATABASE_URI = f"sqlite:///{DATABASE}"
+    RATELIMIT_ENABLED = False
+
+class AsgiSharedStoreConfig(AsgiTestConfig):
+    #a file store blocks on disk like Redis does on its socket
+    SHARED_STORE_DIR = tempfile.mkdtemp()
+    SHARED_STORE_URL = f"file://{SHARED_STORE_DIR}"
+    RATELIMIT_ENABLED = True
+
+config.AsgiTestConfig = AsgiTestConfig
+config.AsgiSharedStoreConfig = AsgiSharedStoreConfig
+
+
+async def request(app, path, headers=()):
+    """(status, body) of a GET `path` on the ASGI `app`."""
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    await app({
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path.partition("?")[0],
+        "raw_path": path.partition("?")[0].encode(),
+        "root_path": "",
+        "query_string": path.partition("?")[2].encode(),
+        "headers": [(b"host", b"testserver"), *headers],
+        "client": ("127.0.0.1", 50000),
+        "server": ("testserver", 80),
+    }, receive, send)
+    status = next(m["status"] for m in messages if m["type"] == "http.response.start")
+    body = b"".join(m.get("body", b"") for m in messages if m["type"] == "http.response.body")
+    return status, body
+
+
+class AsgiAppTest(unittest.TestCase):
+    config_name = "AsgiTestConfig"
+
+    def setUp(self):
+        #uvicorn asgi_app:app runs from the repo root
+        self.cwd = os.getcwd()
+        os.chdir(ROOT)
+        self.api = create_asgi_app(self.config_name)
+        self.flask_app = self.api.state.flask_app
+        self.path = os.path.join(self.flask_app.instance_path, DATABASE)
+        with self.flask_app.app_context():
+            db.drop_all()
+            upgrade(db.engine)
+            user = Users(first_name="Ada", last_name="L", email="ada@example.com", username="ada", password="x")
+            db.session.add(user)
+            db.session.commit()
+            self.token = encode_token(user.id)
+
+    def tearDown(self):
+        with self.flask_app.app_context():
+            db.engine.dispose()
+        os.chdir(self.cwd)
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def run_async(self, path):
+        headers = [(b"authorization", f"Bearer {self.token}".encode())]
+
+        async def run():
+            self.loop_thread = threading.get_ident()
+            try:
+                return await request(self.api, path, headers)
+            finally:
+                await self.api.state.async_engine.dispose()
+        return asyncio.run(run())
+
+    def test_async_engine_opens_the_instance_database(self):
+        self.assertEqual(self.api.state.async_engine.url.database, self.path)
+        self.assertFalse(os.path.exists(os.path.join(ROOT, DATABASE)))
+
+    def test_async_route_reads_the_migrated_database(self):
+        status, body = self.run_async("/users/ada")
+        self.assertEqual(status, 200, body)
+        self.assertEqual(json.loads(body)["username"], "ada")
+        self.assertFalse(os.path.exists(os.path.join(ROOT, DATABASE)))
+
+
+class AsgiParityTest(AsgiAppTest):
+    """The async routes answer like their Flask views and are checked the same way."""
+
+    def setUp(self):
+        super().setUp()
+        self.recorded = []
+        self.flask_app.after_request(self.record_queries)
+        self.transactions = []
+        event.listen(db.session, "after_transaction_end", self.record_transaction)
+        self.addCleanup(event.remove, db.session, "after_transaction_end", self.record_transaction)
+
+        client = self.flask_app.test_client()
+        headers = {"Authorization": f"Bearer {self.token}"}
+        response = client.post("/posts", headers=headers, content_type="multipart/form-data", data={"caption": "hello"})
+        self.assertEqual(response.status_code, 201, response.get_json())
+        self.post_id = response.get_json()["id"]
+        response = client.post("/events", headers=headers, json={
+            "title": "Meetup", "description": "d", "start_time": "2030-01-01T10:00:00Z",
+            "street_address": "1 Main St", "city": "New York", "state": "NY", "zipcode": "10001", "country": "USA",
+        })
+        self.assertEqual(response.status_code, 201, response.get_json())
+
+    def record_queries(self, response):
+        self.recorded.append(len(get_recorded_queries()))
+        return response
+
+    def record_transaction(self, session, transaction):
+        self.transactions.append(session)
+
+    def served(self, engine, call):
+        """(status, json, statements run, statements recorded, transactions ended) of `call`."""
+        statements = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        with self.flask_app.app_context():
+            cache.clear()
+        self.recorded.clear()
+        self.transactions.clear()
+        event.listen(engine, "before_cursor_execute", record)
+        try:
+            status, body = call()
+        finally:
+            event.remove(engine, "before_cursor_execute", record)
+        return status, json.loads(body), len(statements), self.recorded[-1], len(self.transactions)
+
+    def test_async_routes_match_the_flask_views(self):
+        client = self.flask_app.test_client()
+        headers = {"Authorization": f"Bearer {self.token}"}
+        with self.flask_app.app_context():
+            sync_engine = db.engine
+
+        def flask_get(path):
+            response = client.get(path, headers=headers)
+            return response.status_code, response.data
+
+        for path in ("/posts/feed", f"/posts/{self.post_id}", "/users/ada", "/events/search?city=new%20york"):
+            with self.subTest(path):
+                expected = self.served(sync_engine, lambda: flask_get(path))
+                actual = self.served(self.api.state.async_engine.sync_engine, lambda: self.run_async(path))
+                self.assertEqual(actual[0], 200, actual[1])
+                self.assertEqual(actual[:2], expected[:2])
+                #same statements, all of them seen by get_recorded_queries() and @query_budget
+                self.assertEqual(actual[2], expected[2])
+                self.assertEqual(actual[3], actual[2])
+                self.assertTrue(actual[4])
+
+
+class AsgiSharedStoreTest(AsgiAppTest):
+    config_name = "AsgiSharedStoreConfig"
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(AsgiSharedStoreConfig.SHARED_STORE_DIR, ignore_errors=True)
+
+    def test_store_calls_run_off_the_event_loop(self):
+        threads = []
+
+        def recorded(fn):
+            def call(*args, **kwargs):
+                threads.append(threading.get_ident())
+                return fn(*args, **kwargs)
+            return call
+
+        backend = next(iter(self.flask_app.extensions["cache"].values()))
+        backend = getattr(backend, "backend", backend)
+        for name in ("get", "get_many", "set", "add"):
+            setattr(backend, name, recorded(getattr(backend, name)))
+        limiter.storage.incr = recorded(limiter.storage.incr)
+
+        status, body = self.run_async("/users/ada")
+        self.assertEqual(status, 200, body)
+        self.assertTrue(threads)
+        self.assertNotIn(self.loop_thread, threads)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,62 @@
+from sqlalchemy import event
+from app.models import db, Photos
+from app.blueprints.photos.schemas import photo_schema
+from app.blueprints.users.schemas import AUTHOR_FIELDS
+from tests.helpers import AppTestCase
+
+POSTS = 10
+PHOTOS_PER_POST = 4
+#legacy rows keep their bytes inline in photos.file_data
+BLOB_SIZE = 256 * 1024
+
+
+class FeedSizeTest(AppTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user_id, self.headers = self.signup("ada")
+        for i in range(POSTS):
+            response = self.client.post("/posts", headers=self.headers, content_type="multipart/form-data", data={"caption": f"post {i}"})
+            self.assertEqual(response.status_code, 201, response.get_json())
+            db.session.add_all([
+                Photos(user_id=self.user_id, post_id=response.get_json()["id"], filename=f"{i}-{n}.png",
+                       content_type="image/png", file_data=bytes(BLOB_SIZE))
+                for n in range(PHOTOS_PER_POST)
+            ])
+        db.session.commit()
+
+    def get_feed(self):
+        statements = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(db.engine, "before_cursor_execute", record)
+        try:
+            response = self.client.get("/posts/feed", headers=self.headers)
+        finally:
+            event.remove(db.engine, "before_cursor_execute", record)
+        self.assertEqual(response.status_code, 200, response.get_json())
+        return response, statements
+
+    def test_feed_never_reads_photo_bytes(self):
+        _, statements = self.get_feed()
+        self.assertTrue(statements)
+        self.assertFalse([sql for sql in statements if "file_data" in sql])
+
+    def test_feed_response_size_is_independent_of_photo_size(self):
+        response, _ = self.get_feed()
+        items = response.get_json()["items"]
+        self.assertEqual(len(items), POSTS)
+        self.assertEqual(sum(len(item["photos"]) for item in items), POSTS * PHOTOS_PER_POST)
+        #metadata only, a few hundred bytes per photo against 10 MB of blobs
+        self.assertLess(len(response.data), 32 * 1024)
+
+    def test_feed_items_use_the_slim_schemas(self):
+        response, _ = self.get_feed()
+        photo_fields = set(photo_schema.dump_fields)
+        self.assertNotIn("file_data", photo_fields)
+        for item in response.get_json()["items"]:
+            self.assertEqual(set(item["user"]), set(AUTHOR_FIELDS))
+            self.assertNotIn("email", item["author"])
+            for photo in item["photos"]:
+                self.assertEqual(set(photo), photo_fields)
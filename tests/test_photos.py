@@ -0,0 +1,82 @@
+import io
+from sqlalchemy import select, text
+from app.models import db, Users, Photos, PhotoBlobs
+from tests.helpers import AppTestCase, png
+
+
+class AvatarBlobTest(AppTestCase):
+    def setUp(self):
+        super().setUp()
+        self.assertEqual(db.session.execute(text("PRAGMA foreign_keys")).scalar(), 1)
+        self.user_id, self.headers = self.signup("ada")
+
+    def test_replace_avatar_drops_the_orphaned_blob(self):
+        first = self.upload("/users/me/avatar", self.headers, data=png((255, 0, 0, 255)))
+        self.assertEqual(first.status_code, 201, first.get_json())
+        old_id = first.get_json()["profile_picture"]["photo_id"]
+
+        second = self.upload("/users/me/avatar", self.headers, data=png((0, 0, 255, 255)))
+        self.assertEqual(second.status_code, 201, second.get_json())
+        db.session.expire_all()
+        self.assertIsNone(db.session.get(Photos, old_id))
+        new = db.session.get(Photos, second.get_json()["profile_picture"]["photo_id"])
+        self.assertEqual(db.session.execute(select(PhotoBlobs.content_hash)).scalars().all(), [new.content_hash])
+
+    def test_replace_avatar_with_the_same_image_keeps_the_blob(self):
+        self.assertEqual(self.upload("/users/me/avatar", self.headers).status_code, 201)
+        self.assertEqual(self.upload("/users/me/avatar", self.headers).status_code, 201)
+        self.assertEqual(db.session.execute(select(PhotoBlobs.ref_count)).scalars().all(), [1])
+
+    def test_delete_avatar_drops_the_orphaned_blob(self):
+        self.assertEqual(self.upload("/users/me/avatar", self.headers).status_code, 201)
+        response = self.client.delete("/users/me/avatar", headers=self.headers)
+        self.assertEqual(response.status_code, 200, response.get_json())
+        db.session.expire_all()
+        self.assertIsNone(db.session.get(Users, self.user_id).profile_photo_id)
+        self.assertEqual(db.session.execute(select(Photos)).all(), [])
+        self.assertEqual(db.session.execute(select(PhotoBlobs)).all(), [])
+
+
+class PhotoDeleteTest(AppTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user_id, self.headers = self.signup("ada")
+
+    def test_delete_post_photo_drops_the_orphaned_blob(self):
+        response = self.client.post("/posts", headers=self.headers, content_type="multipart/form-data", data={"caption": "hi"})
+        self.assertEqual(response.status_code, 201, response.get_json())
+        response = self.client.post(
+            "/photos/upload", headers=self.headers, content_type="multipart/form-data",
+            data={"post_id": str(response.get_json()["id"]), "photos": (io.BytesIO(png((0, 255, 0, 255))), "photo.png")},
+        )
+        self.assertEqual(response.status_code, 201, response.get_json())
+        photo_id = response.get_json()["photos"][0]["id"]
+
+        response = self.client.delete(f"/photos/{photo_id}", headers=self.headers)
+        self.assertEqual(response.status_code, 200, response.get_json())
+        self.assertEqual(db.session.execute(select(PhotoBlobs)).all(), [])
+
+    def test_delete_photo_in_use_as_avatar(self):
+        response = self.upload("/users/me/avatar", self.headers)
+        self.assertEqual(response.status_code, 201, response.get_json())
+        photo_id = response.get_json()["profile_picture"]["photo_id"]
+
+        response = self.client.delete(f"/photos/{photo_id}", headers=self.headers)
+        self.assertEqual(response.status_code, 200, response.get_json())
+        db.session.expire_all()
+        self.assertIsNone(db.session.get(Users, self.user_id).profile_photo_id)
+        self.assertEqual(db.session.execute(select(PhotoBlobs)).all(), [])
+
+    def test_replace_event_cover_drops_the_orphaned_blob(self):
+        response = self.client.post("/events", headers=self.headers, json={
+            "title": "Meetup", "description": "d", "start_time": "2030-01-01T10:00:00Z",
+            "street_address": "1 Main St", "city": "New York", "state": "NY", "zipcode": "10001", "country": "USA",
+        })
+        self.assertEqual(response.status_code, 201, response.get_json())
+        url = f"/events/{response.get_json()['id']}/cover"
+
+        self.assertEqual(self.upload(url, self.headers, data=png((255, 0, 0, 255))).status_code, 201)
+        response = self.upload(url, self.headers, data=png((0, 0, 255, 255)))
+        self.assertEqual(response.status_code, 201, response.get_json())
+        new = db.session.get(Photos, response.get_json()["cover"]["photo_id"])
+        self.assertEqual(db.session.execute(select(PhotoBlobs.content_hash)).scalars().all(), [new.content_hash])
@@ -0,0 +1,79 @@
+import io
+from sqlalchemy import event
+from app.extensions import cache
+from app.models import db
+from tests.helpers import AppTestCase, png
+
+
+class PostQueryCountTest(AppTestCase):
+    """Post reads run the same number of queries for 2 posts as for 10 (N+1 guard).
+
+    TestingConfig sets QUERY_BUDGET_STRICT, so a route over its
+    @query_budget also fails here with a 500.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.viewer_id, self.viewer = self.signup("viewer")
+        self.authors = [self.signup(name) for name in ("ada", "bob")]
+        for author_id, _ in self.authors:
+            self.assertEqual(self.client.post(f"/users/{author_id}/follow", headers=self.viewer).status_code, 201)
+        self.fans = [self.signup(f"fan{i}") for i in range(3)]
+        self.post_ids = []
+
+    def add_posts(self, count, photos):
+        for i in range(count):
+            author_id, headers = self.authors[len(self.post_ids) % len(self.authors)]
+            response = self.client.post("/posts", headers=headers, content_type="multipart/form-data", data={"caption": f"sunset {len(self.post_ids)}"})
+            self.assertEqual(response.status_code, 201, response.get_json())
+            post_id = response.get_json()["id"]
+            self.post_ids.append(post_id)
+
+            response = self.client.post("/photos/upload", headers=headers, content_type="multipart/form-data", data={
+                "post_id": str(post_id),
+                "photos": [(io.BytesIO(png((len(self.post_ids), n, 0, 255))), f"{n}.png") for n in range(photos)],
+            })
+            self.assertEqual(response.status_code, 201, response.get_json())
+            for _, fan in self.fans:
+                self.assertEqual(self.client.post(f"/posts/{post_id}/like", headers=fan).status_code, 201)
+                self.assertEqual(self.client.post(f"/comments/by-post/{post_id}", headers=fan, json={"text": "nice"}).status_code, 201)
+
+    def count_queries(self, url):
+        statements = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        #lookups memoized per process or viewer, like the search index check, only run the first time
+        self.client.get(url, headers=self.viewer)
+        #a cached response would hide the queries
+        cache.clear()
+        event.listen(db.engine, "before_cursor_execute", record)
+        try:
+            response = self.client.get(url, headers=self.viewer)
+        finally:
+            event.remove(db.engine, "before_cursor_execute", record)
+        self.assertEqual(response.status_code, 200, response.get_json())
+        return len(statements), response.get_json()
+
+    def reads(self):
+        author_id = self.authors[0][0]
+        return {
+            "feed": f"/posts/feed?per_page={len(self.post_ids)}",
+            "by_user": f"/posts/by-user/{author_id}?per_page={len(self.post_ids)}",
+            "search": "/posts/search?query_params=sunset",
+            "get_post": f"/posts/{self.post_ids[-1]}",
+        }
+
+    def test_query_count_does_not_grow_with_posts(self):
+        self.add_posts(2, photos=1)
+        small = {name: self.count_queries(url) for name, url in self.reads().items()}
+        self.add_posts(8, photos=3)
+        large = {name: self.count_queries(url) for name, url in self.reads().items()}
+
+        self.assertEqual(len(small["feed"][1]["items"]), 2)
+        self.assertEqual(len(large["feed"][1]["items"]), 10)
+        self.assertEqual(len(large["get_post"][1]["photos"]), 3)
+        for name in small:
+            with self.subTest(name):
+                self.assertEqual(large[name][0], small[name][0])
@@ -0,0 +1,107 @@
+from sqlalchemy import select
+from app.models import db, Posts, EventPosts
+from app.blueprints.posts.schemas import posts_schema
+from app.blueprints.event_posts.schemas import event_posts_schema
+from app.util.loaders import posts_query, events_query, annotate_posts, annotate_events
+from app.util.relationships import Relationship
+from app.util.search import has_search_index, ilike
+from tests.helpers import AppTestCase
+
+CAPTIONS = ("sunset over the harbor", "Sunny morning", "harbor lights", "rainy day")
+EVENTS = (("Harbor cleanup", "bring gloves"), ("Sunset yoga", "on the harbor pier"), ("Book club", "rainy day reads"))
+
+
+def event_payload(title, description):
+    return {
+        "title": title, "description": description, "start_time": "2030-01-01T10:00:00Z",
+        "street_address": "1 Main St", "city": "New York", "state": "NY", "zipcode": "10001", "country": "USA",
+    }
+
+
+class SearchTest(AppTestCase):
+    """Full-text search finds what the ilike() filter it replaced found, serialized like schema.dump()."""
+
+    def setUp(self):
+        super().setUp()
+        self.ada_id, self.ada = self.signup("ada")
+        self.bob_id, self.bob = self.signup("bob")
+        self.post_ids = []
+        for caption in CAPTIONS:
+            response = self.client.post("/posts", headers=self.ada, content_type="multipart/form-data", data={"caption": caption})
+            self.assertEqual(response.status_code, 201, response.get_json())
+            self.post_ids.append(response.get_json()["id"])
+        self.assertEqual(self.client.post(f"/posts/{self.post_ids[0]}/like", headers=self.bob).status_code, 201)
+        self.event_ids = []
+        for title, description in EVENTS:
+            response = self.client.post("/events", headers=self.ada, json=event_payload(title, description))
+            self.assertEqual(response.status_code, 201, response.get_json())
+            self.event_ids.append(response.get_json()["id"])
+        self.assertEqual(self.client.post(f"/events/{self.event_ids[1]}/rsvp", headers=self.bob).status_code, 201)
+
+    def search(self, url):
+        response = self.client.get(url, headers=self.bob)
+        self.assertEqual(response.status_code, 200, response.get_json())
+        return response.get_json()["items"]
+
+    def ilike_ids(self, model, term):
+        return sorted(db.session.scalars(ilike(select(model.id), model, term)))
+
+    def assertSamePosts(self, term):
+        items = self.search(f"/posts/search?query_params={term}")
+        self.assertEqual(sorted(item["id"] for item in items), self.ilike_ids(Posts, term))
+        db.session.expire_all()
+        posts = db.session.scalars(posts_query().where(Posts.id.in_([item["id"] for item in items]))).unique().all()
+        annotate_posts(posts, self.bob_id)
+        with self.app.test_request_context():
+            expected = {post["id"]: post for post in posts_schema.dump(posts)}
+        self.assertEqual({item["id"]: item for item in items}, expected)
+        return items
+
+    def assertSameEvents(self, term):
+        items = self.search(f"/events/search?query_params={term}")
+        self.assertEqual(sorted(item["id"] for item in items), self.ilike_ids(EventPosts, term))
+        db.session.expire_all()
+        events = db.session.scalars(events_query().where(EventPosts.id.in_([item["id"] for item in items]))).unique().all()
+        annotate_events(events, self.bob_id)
+        with self.app.test_request_context():
+            expected = {event["id"]: event for event in event_posts_schema.dump(events)}
+        #hosts also carry the viewer's relationship flags, added after the dump
+        for item in items:
+            for host in item["hosts"]:
+                for flag in Relationship._fields:
+                    host.pop(flag)
+        self.assertEqual({item["id"]: item for item in items}, expected)
+        return items
+
+    def test_uses_the_full_text_index(self):
+        self.assertTrue(has_search_index(db.engine, "posts"))
+        self.assertTrue(has_search_index(db.engine, "event_posts"))
+
+    def test_posts_match_ilike(self):
+        for term in ("harbor", "sun", "SUNSET", "rainy", "nothing"):
+            with self.subTest(term):
+                self.assertSamePosts(term)
+        items = self.assertSamePosts("sunset")
+        self.assertIs(items[0]["liked_by_me"], True)
+        self.assertEqual(items[0]["user"]["username"], "ada")
+
+    def test_events_match_ilike(self):
+        for term in ("harbor", "sun", "rainy", "gloves", "nothing"):
+            with self.subTest(term):
+                self.assertSameEvents(term)
+        items = self.assertSameEvents("yoga")
+        self.assertIs(items[0]["rsvped_by_me"], True)
+        self.assertEqual([host["username"] for host in items[0]["hosts"]], ["ada"])
+
+    def test_index_follows_updates_and_deletes(self):
+        response = self.client.put(f"/posts/{self.post_ids[3]}", headers=self.ada, json={"caption": "harbor at night"})
+        self.assertEqual(response.status_code, 200, response.get_json())
+        self.assertEqual(self.client.delete(f"/posts/{self.post_ids[2]}", headers=self.ada).status_code, 200)
+        self.assertEqual([item["id"] for item in self.assertSamePosts("rainy")], [])
+        self.assertEqual(sorted(item["id"] for item in self.assertSamePosts("harbor")), [self.post_ids[0], self.post_ids[3]])
+
+        response = self.client.put(f"/events/{self.event_ids[2]}", headers=self.ada, json=event_payload("Harbor book club", "sunny reads"))
+        self.assertEqual(response.status_code, 200, response.get_json())
+        self.assertEqual(self.client.delete(f"/events/{self.event_ids[0]}", headers=self.ada).status_code, 200)
+        self.assertEqual([item["id"] for item in self.assertSameEvents("rainy")], [])
+        self.assertEqual(sorted(item["id"] for item in self.assertSameEvents("harbor")), self.event_ids[1:])
@@ -0,0 +1,87 @@
+import io
+import json
+import random
+from flask import jsonify
+from sqlalchemy import select
+from app.commands import _synthetic_objects
+from app.models import db, Posts, Users, EventPosts, Comments
+from app.blueprints.posts.schemas import posts_schema
+from app.blueprints.event_posts.schemas import event_posts_schema
+from app.blueprints.users.schemas import users_schema, user_list_schema
+from app.blueprints.comments.schemas import comments_schema
+from app.util.loaders import posts_query, events_query, comments_query, annotate_posts, annotate_events
+from app.util.serializers import dump, json_response
+from tests.helpers import AppTestCase, png
+
+
+class SerializerTest(AppTestCase):
+    """The precompiled serializers give what schema.dump() gives, field for field."""
+
+    def setUp(self):
+        super().setUp()
+        self.ada_id, self.ada = self.signup("ada")
+        self.bob_id, self.bob = self.signup("bob")
+        for caption in ("sunset", "harbor"):
+            response = self.client.post("/posts", headers=self.ada, content_type="multipart/form-data", data={"caption": caption})
+            self.assertEqual(response.status_code, 201, response.get_json())
+            post_id = response.get_json()["id"]
+            response = self.client.post("/photos/upload", headers=self.ada, content_type="multipart/form-data", data={
+                "post_id": str(post_id), "photos": [(io.BytesIO(png((post_id, 0, 0, 255))), "photo.png")],
+            })
+            self.assertEqual(response.status_code, 201, response.get_json())
+        #bob likes the first post only, so liked_by_me is True on one and False on the other
+        self.assertEqual(self.client.post(f"/posts/{post_id - 1}/like", headers=self.bob).status_code, 201)
+        self.assertEqual(self.client.post(f"/comments/by-post/{post_id}", headers=self.bob, json={"text": "nice"}).status_code, 201)
+
+        for title in ("Meetup", "Picnic"):
+            response = self.client.post("/events", headers=self.ada, json={
+                "title": title, "description": "d", "start_time": "2030-01-01T10:00:00Z",
+                "street_address": "1 Main St", "city": "New York", "state": "NY", "zipcode": "10001", "country": "USA",
+            })
+            self.assertEqual(response.status_code, 201, response.get_json())
+        self.assertEqual(self.client.post(f"/events/{response.get_json()['id']}/rsvp", headers=self.bob).status_code, 201)
+        db.session.expire_all()
+        #photo urls are built with url_for, as in a request
+        request_context = self.app.test_request_context()
+        request_context.push()
+        self.addCleanup(request_context.pop)
+
+    def assertSameOutput(self, schema, objects):
+        self.assertEqual(dump(schema, objects), schema.dump(objects))
+        self.assertEqual(json.loads(json_response({"items": dump(schema, objects)}).get_data()),
+                         json.loads(jsonify({"items": schema.dump(objects)}).get_data()))
+
+    def test_posts(self):
+        posts = db.session.scalars(posts_query().order_by(Posts.id)).unique().all()
+        annotate_posts(posts, self.bob_id)
+        self.assertEqual([post.liked_by_me for post in posts], [True, False])
+        self.assertSameOutput(posts_schema, posts)
+        item = dump(posts_schema, posts)[0]
+        self.assertIs(item["liked_by_me"], True)
+        self.assertEqual(item["user"]["username"], "ada")
+        self.assertEqual(len(item["photos"]), 1)
+
+    def test_users(self):
+        users = db.session.scalars(select(Users).order_by(Users.id)).all()
+        self.assertSameOutput(users_schema, users)
+        self.assertSameOutput(user_list_schema, users)
+
+    def test_events(self):
+        events = db.session.scalars(events_query().order_by(EventPosts.id)).unique().all()
+        annotate_events(events, self.bob_id)
+        self.assertEqual([event.rsvped_by_me for event in events], [False, True])
+        self.assertSameOutput(event_posts_schema, events)
+        item = dump(event_posts_schema, events)[1]
+        self.assertIs(item["rsvped_by_me"], True)
+        self.assertEqual([host["username"] for host in item["hosts"]], ["ada"])
+
+    def test_comments(self):
+        comments = db.session.scalars(comments_query().order_by(Comments.id)).unique().all()
+        self.assertTrue(comments)
+        self.assertSameOutput(comments_schema, comments)
+
+    def test_benchmark_objects(self):
+        #the unsaved objects `flask api benchmark-serializers` times, with every optional field filled in
+        for schema, objects in _synthetic_objects(random.Random(0), 20).items():
+            with self.subTest(type(schema).__name__):
+                self.assertSameOutput(schema, objects)